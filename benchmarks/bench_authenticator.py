@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+"""Compares per-call latency of `Authenticator.auth` against the previous
+one-connection-per-request implementation, using the local stub backend.
+
+Usage: python -m benchmarks.bench_authenticator [--calls N] [--handshake-delay S]
+"""
+
+import argparse
+import statistics
+import time
+from typing import Callable, List
+
+import requests as req
+
+from benchmarks.stub_backend import StubBackend
+from utils.authenticator import (
+    Authenticator,
+    DEFAULT_CONNECT_TIMEOUT,
+    DEFAULT_READ_TIMEOUT,
+)
+from utils.auth_cache import AuthCache
+
+BOX_ID = "bench-box"
+PASSWORD = "bench-password"
+TOKEN = "bench-token"
+# The timeouts of the authenticator, for the baseline calls
+TIMEOUT = (DEFAULT_CONNECT_TIMEOUT, DEFAULT_READ_TIMEOUT)
+
+
+def _measure(call: Callable[[], object], calls: int) -> List[float]:
+    samples = []
+    for _ in range(calls):
+        start = time.perf_counter()
+        call()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def _report(name: str, samples: List[float]):
+    samples = sorted(samples)
+    print(
+        "{:<12} mean {:8.3f} ms  p50 {:8.3f} ms  p95 {:8.3f} ms  max {:8.3f} ms".format(
+            name,
+            statistics.mean(samples) * 1e3,
+            samples[len(samples) // 2] * 1e3,
+            samples[int(len(samples) * 0.95) - 1] * 1e3,
+            samples[-1] * 1e3,
+        )
+    )
+
+
+def main():  # pylint: disable=missing-function-docstring
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--calls", type=int, default=200)
+    parser.add_argument(
+        "--handshake-delay",
+        type=float,
+        default=0.02,
+        help="Emulated cost of a TCP/TLS handshake in seconds.",
+    )
+    parser.add_argument("--latency", type=float, default=0.0)
+    args = parser.parse_args()
+
+    with StubBackend(args.latency, args.handshake_delay) as backend:
+        backend.add_box(BOX_ID, PASSWORD)
+        backend.add_order(BOX_ID, TOKEN)
+
+        # Previous implementation: module-level requests, a new connection per call
+        jwt = req.post(
+            backend.url + "/auth/jwe/box",
+            json={"username": BOX_ID, "password": PASSWORD},
+            timeout=TIMEOUT,
+        ).cookies
+        url = backend.url + "/order/list/{}?token={}".format(BOX_ID, TOKEN)
+        before_conns = backend.stats["connections"]
+        before = _measure(
+            lambda: req.get(url, cookies=jwt, verify=False, timeout=TIMEOUT),
+            args.calls,
+        )
+        before_conns = backend.stats["connections"] - before_conns
+
+        # Caching disabled, every call goes to the backend
+        authenticator = Authenticator(backend.url, auth_cache=AuthCache(max_size=0))
+        authenticator.login(BOX_ID, PASSWORD)
+        after_conns = backend.stats["connections"]
+        after = _measure(lambda: authenticator.auth(BOX_ID, TOKEN), args.calls)
+        after_conns = backend.stats["connections"] - after_conns
+        authenticator.close()
+
+    print(
+        "{} auth calls, handshake delay {} s".format(args.calls, args.handshake_delay)
+    )
+    _report("before", before)
+    _report("after", after)
+    print("new connections: before {}, after {}".format(before_conns, after_conns))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+"""Measures cold-start-to-ready time of the backend bootstrap against the local
+stub backend:
+
+- sequential: the previous four blocking GETs followed by login
+- parallel: concurrent bootstrap, then login
+- parallel+cache: as above with the public keys served from the disk cache
+- background: time until the hardware loop may start, bootstrap continues
+
+Usage: python -m benchmarks.bench_bootstrap [--latency S] [--runs N]
+"""
+
+import argparse
+import os
+import statistics
+import tempfile
+import time
+from typing import Callable, List
+
+import requests as req
+
+from benchmarks.stub_backend import StubBackend
+from utils.authenticator import Authenticator
+from utils.singleton import Singleton
+
+BOX_ID = "bench-box"
+PASSWORD = "bench-password"
+
+
+def _new_authenticator(url: str, cache_path: str = None) -> Authenticator:
+    # Authenticator is a process wide singleton, drop it to measure a cold start
+    Singleton._instances.pop(Authenticator, None)  # pylint: disable=protected-access
+    return Authenticator(url, bootstrap_cache_path=cache_path)
+
+
+def _measure(run: Callable[[], None], runs: int) -> List[float]:
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        run()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def main():  # pylint: disable=missing-function-docstring
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--runs", type=int, default=10)
+    args = parser.parse_args()
+
+    with StubBackend(
+        latency=args.latency
+    ) as backend, tempfile.TemporaryDirectory() as directory:
+        backend.add_box(BOX_ID, PASSWORD)
+        url = backend.url
+        cache_path = os.path.join(directory, "bootstrap_cache.json")
+
+        def sequential():
+            session = req.Session()
+            csrf = session.get(url + "/auth/csrf")
+            for path in ("/auth/pkey", "/auth/pem", "/delivery/csrf"):
+                session.get(url + path)
+            session.post(
+                url + "/auth/jwe/box",
+                json={"username": BOX_ID, "password": PASSWORD},
+                cookies=csrf.cookies,
+            )
+            session.close()
+
+        def parallel(path=None):
+            authenticator = _new_authenticator(url, path)
+            authenticator.login(BOX_ID, PASSWORD)
+            authenticator.wait_bootstrap()
+            authenticator.close()
+
+        def background():
+            authenticator = _new_authenticator(url, cache_path)
+            samples_ready.append(time.perf_counter())
+            authenticator.wait_bootstrap()
+            authenticator.close()
+
+        results = {
+            "sequential": _measure(sequential, args.runs),
+            "parallel": _measure(parallel, args.runs),
+        }
+        parallel(cache_path)  # Fills the cache
+        results["parallel+cache"] = _measure(lambda: parallel(cache_path), args.runs)
+
+        samples_ready: List[float] = []
+        starts = []
+        for _ in range(args.runs):
+            starts.append(time.perf_counter())
+            background()
+        results["background"] = [r - s for r, s in zip(samples_ready, starts)]
+
+    print("backend latency {} s, {} runs".format(args.latency, args.runs))
+    for name, samples in results.items():
+        print(
+            "{:<16} mean {:8.1f} ms  max {:8.1f} ms".format(
+                name, statistics.mean(samples) * 1e3, max(samples) * 1e3
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
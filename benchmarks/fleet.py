@@ -0,0 +1,292 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+"""Fleet load generator: many virtual boxes in one process against a backend.
+
+Every virtual box is an independent `Authenticator` (not the process wide
+singleton) with its own keep-alive session, doing what a `BoxManager` does at
+the backend: log in, authorize tapped tokens and report pickups.
+
+All boxes log in (spread over --ramp seconds), then customers arrive as a
+Poisson process whose fleet wide rate follows --profile, a list of
+"second:arrivals per second" steps. Each arrival taps a token at a random box
+and, if authorized, reports the pickup after --hold seconds.
+
+Without --backend-url a local stub backend is started, the boxes and orders
+are registered on it and --hit-ratio of the arrivals carry a token with a
+pending order. Against a real backend the boxes must exist with --password.
+
+The in-process stub shares the interpreter with the load generator and
+saturates at a few hundred requests per second; for higher loads run it
+separately, e.g. `python -m benchmarks.stub_backend --port 8081 --open-login`,
+and pass --backend-url http://127.0.0.1:8081.
+
+Latencies are measured from the scheduled time of each operation, so they
+include queueing when the workers fall behind the offered load.
+
+Usage: python -m benchmarks.fleet [--boxes N] [--profile 0:20,30:100] ...
+"""
+
+import argparse
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+import requests as req
+
+from benchmarks.stub_backend import StubBackend
+from utils.auth_cache import AuthCache
+from utils.authenticator import Authenticator
+
+
+class _Recorder:
+    """Collects latencies and errors per operation."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies: Dict[str, List[float]] = {}
+        self.errors: Dict[str, int] = {}
+
+    def record(
+        self, op: str, latency: float, error: bool = False
+    ):  # pylint: disable=missing-function-docstring
+        with self._lock:
+            self.latencies.setdefault(op, []).append(latency)
+            if error:
+                self.errors[op] = self.errors.get(op, 0) + 1
+
+
+def _parse_profile(profile: str) -> List[Tuple[float, float]]:
+    steps = []
+    for step in profile.split(","):
+        start, rate = step.split(":")
+        steps.append((float(start), float(rate)))
+    return sorted(steps)
+
+
+def _arrivals(
+    steps: List[Tuple[float, float]], duration: float, rng: random.Random
+) -> List[float]:
+    """Returns the arrival times of a piecewise constant rate Poisson process."""
+    times = []
+    bounds = [start for start, _ in steps[1:]] + [duration]
+    for (start, rate), end in zip(steps, bounds):
+        end = min(end, duration)
+        t = start
+        while rate > 0:
+            # Memoryless, so each step can be sampled on its own
+            t += rng.expovariate(rate)
+            if t >= end:
+                break
+            times.append(t)
+    return times
+
+
+def _percentile(samples: List[float], q: float) -> float:
+    return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+
+class Fleet:
+    """Virtual boxes sharing one worker pool.
+
+    Args:
+        backend_url (str): backend to load
+        box_ids (List[str]): ids of the virtual boxes
+        password (str): password of all boxes
+        workers (int): max. concurrent backend operations
+    """
+
+    def __init__(
+        self, backend_url: str, box_ids: List[str], password: str, workers: int
+    ):
+        self.backend_url = backend_url
+        self.box_ids = box_ids
+        self.password = password
+        self.recorder = _Recorder()
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="box")
+        self._bootstrap = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="bootstrap"
+        )
+        self.boxes: Dict[str, Authenticator] = {}
+
+    def _run_at(self, when: float, func, *args):
+        delay = when - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        return self.pool.submit(func, when, *args)
+
+    def login(self, scheduled: float, box_id: str):
+        """Cold start of one box: bootstrap and log in."""
+        # Independent of the process wide singleton, see `Singleton.create`
+        authenticator = Authenticator.create(
+            self.backend_url,
+            auth_cache=AuthCache(max_size=0),
+            executor=self._bootstrap,
+        )
+        self.boxes[box_id] = authenticator
+        try:
+            ok = authenticator.login(box_id, self.password)
+        except req.RequestException:
+            ok = False
+        self.recorder.record("login", time.perf_counter() - scheduled, not ok)
+
+    def customer(
+        self,
+        scheduled: float,
+        box_id: str,
+        token: str,
+        hit: Optional[bool],
+        hold: float,
+    ):
+        """One customer: authorize, hold the lid open, report the pickup.
+
+        Args:
+            scheduled (float): arrival time
+            box_id (str): box the tag is tapped at
+            token (str): tag token
+            hit (Optional[bool]): whether the token has an order, None if unknown
+            hold (float): seconds between authorization and report
+        """
+        authenticator = self.boxes[box_id]
+        try:
+            granted = authenticator.auth(box_id, token)
+            error = hit is not None and granted != hit
+        except req.RequestException:
+            granted, error = False, True
+        self.recorder.record("auth", time.perf_counter() - scheduled, error)
+        if granted:
+            if hold > 0:
+                time.sleep(hold)
+            started = time.perf_counter()
+            try:
+                ok = authenticator.update_box(box_id, token)
+            except req.RequestException:
+                ok = False
+            self.recorder.record("report", time.perf_counter() - started, not ok)
+        self.recorder.record("customer", time.perf_counter() - scheduled, error)
+
+    def run_logins(self, ramp: float):
+        """Logs in all boxes, spread evenly over `ramp` seconds."""
+        start = time.perf_counter()
+        step = ramp / len(self.box_ids)
+        futures = [
+            self._run_at(start + i * step, self.login, box_id)
+            for i, box_id in enumerate(self.box_ids)
+        ]
+        for future in futures:
+            future.result()
+
+    def run_customers(
+        self, arrivals: List[Tuple[float, str, str, Optional[bool]]], hold: float
+    ):
+        """Replays `arrivals` as (offset, box id, token, hit) at their offsets."""
+        start = time.perf_counter()
+        futures = [
+            self._run_at(start + offset, self.customer, box_id, token, hit, hold)
+            for offset, box_id, token, hit in arrivals
+        ]
+        for future in futures:
+            future.result()
+
+    def close(self):  # pylint: disable=missing-function-docstring
+        self.pool.shutdown()
+        for authenticator in self.boxes.values():
+            authenticator.close()
+        self._bootstrap.shutdown()
+
+
+def _report(recorder: _Recorder, elapsed: Dict[str, float]):
+    print(
+        "{:<9}{:>8}{:>8}{:>9}{:>9}{:>9}{:>9}{:>9}".format(
+            "op", "count", "errors", "ops/s", "p50 ms", "p90 ms", "p99 ms", "max ms"
+        )
+    )
+    for op in ("login", "auth", "report", "customer"):
+        samples = sorted(recorder.latencies.get(op, []))
+        if not samples:
+            continue
+        print(
+            "{:<9}{:>8}{:>7.1f}%{:>9.1f}{:>9.1f}{:>9.1f}{:>9.1f}{:>9.1f}".format(
+                op,
+                len(samples),
+                recorder.errors.get(op, 0) / len(samples) * 100,
+                len(samples) / elapsed["login" if op == "login" else "customers"],
+                _percentile(samples, 0.5) * 1e3,
+                _percentile(samples, 0.9) * 1e3,
+                _percentile(samples, 0.99) * 1e3,
+                samples[-1] * 1e3,
+            )
+        )
+
+
+def main():  # pylint: disable=missing-function-docstring,too-many-locals
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--boxes", type=int, default=200)
+    parser.add_argument("--workers", type=int, default=64)
+    parser.add_argument("--profile", default="0:20", help="second:rate,... steps")
+    parser.add_argument("--duration", type=float, default=30.0)
+    parser.add_argument("--ramp", type=float, default=5.0, help="Login ramp-up.")
+    parser.add_argument("--hold", type=float, default=0.0, help="Lid open seconds.")
+    parser.add_argument("--hit-ratio", type=float, default=0.8)
+    parser.add_argument("--backend-url", default=None)
+    parser.add_argument("--box-prefix", default="fleet-")
+    parser.add_argument("--password", default="fleet-password")
+    parser.add_argument("--latency", type=float, default=0.0, help="Stub latency.")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    rng = random.Random(args.seed)
+    box_ids = ["{}{}".format(args.box_prefix, i) for i in range(args.boxes)]
+    stub = None
+    if args.backend_url is None:
+        stub = StubBackend(latency=args.latency).start()
+        for box_id in box_ids:
+            stub.add_box(box_id, args.password)
+    url = args.backend_url or stub.url
+
+    arrivals = []
+    for i, offset in enumerate(
+        _arrivals(_parse_profile(args.profile), args.duration, rng)
+    ):
+        box_id = rng.choice(box_ids)
+        token = "fleet-token-{}".format(i)
+        hit = None
+        if stub is not None:
+            hit = rng.random() < args.hit_ratio
+            if hit:
+                stub.add_order(box_id, token)
+        arrivals.append((offset, box_id, token, hit))
+
+    fleet = Fleet(url, box_ids, args.password, args.workers)
+    elapsed = {}
+    try:
+        started = time.perf_counter()
+        fleet.run_logins(args.ramp)
+        elapsed["login"] = time.perf_counter() - started
+        started = time.perf_counter()
+        fleet.run_customers(arrivals, args.hold)
+        elapsed["customers"] = time.perf_counter() - started
+    finally:
+        fleet.close()
+        if stub is not None:
+            stub.stop()
+
+    print(
+        "{} boxes, {} workers, {} arrivals in {:.1f} s ({:.1f} offered/s)".format(
+            args.boxes,
+            args.workers,
+            len(arrivals),
+            elapsed["customers"],
+            len(arrivals) / args.duration,
+        )
+    )
+    _report(fleet.recorder, elapsed)
+
+
+if __name__ == "__main__":
+    main()
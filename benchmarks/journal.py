@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+"""Fills an `EventJournal` with months of synthetic box events and times appends
+and typical queries against it, with the indexes and with a full scan.
+
+Usage: python -m benchmarks.journal [--days N] [--events-per-day N]
+"""
+
+import argparse
+import random
+import shutil
+import statistics
+import tempfile
+import time
+from typing import Callable, List
+
+from utils.journal import EventJournal, EventKind
+
+
+def _time(func: Callable[[], object], repeat: int) -> List[float]:
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - started)
+    return samples
+
+
+def main():  # pylint: disable=missing-function-docstring,too-many-locals
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--days", type=int, default=180)
+    parser.add_argument("--events-per-day", type=int, default=300)
+    parser.add_argument("--tokens", type=int, default=2000)
+    parser.add_argument("--segment-size", type=int, default=1024 * 1024)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    directory = tempfile.mkdtemp()
+    now = time.time()
+    start = now - args.days * 86400
+    total = args.days * args.events_per_day
+    kinds = [EventKind.AUTH_GRANTED, EventKind.OPENED, EventKind.CLOSED]
+    try:
+        journal = EventJournal(
+            directory, args.segment_size, retention_days=args.days + 1
+        )
+        appends = []
+        recent_token = None
+        for i in range(total):
+            token = "token-{}".format(rng.randrange(args.tokens))
+            timestamp = start + i * 86400 / args.events_per_day
+            started = time.perf_counter()
+            journal.append(
+                kinds[i % 3], "group13", 1000 + i % 500, token, "", timestamp
+            )
+            appends.append(time.perf_counter() - started)
+            if kinds[i % 3] == EventKind.OPENED:
+                recent_token = token
+        journal.close()
+        appends.sort()
+        stats = EventJournal(directory, read_only=True).stats()
+        print(
+            "{} events in {} segments, {:.1f} MiB, {:.0f} bytes/event".format(
+                stats["events"],
+                stats["segments"],
+                stats["bytes"] / 2**20,
+                stats["bytes"] / stats["events"],
+            )
+        )
+        print(
+            "append: mean {:.1f} us  p99 {:.1f} us  max {:.1f} us".format(
+                statistics.mean(appends) * 1e6,
+                appends[int(len(appends) * 0.99)] * 1e6,
+                appends[-1] * 1e6,
+            )
+        )
+
+        reader = EventJournal(directory, read_only=True)
+        week = now - 7 * 86400
+        # A customer of the last days
+        token = recent_token
+        queries = [
+            (
+                "token, opens, 7 days",
+                lambda: list(reader.query(week, None, [EventKind.OPENED], token)),
+            ),
+            ("all events, 7 days", lambda: list(reader.query(week))),
+            ("token, all time", lambda: list(reader.query(token=token))),
+            (
+                "token, full scan",
+                lambda: [e for e in reader.query() if e.token_hash == token_hash_hex],
+            ),
+        ]
+        token_hash_hex = next(reader.query(token=token)).token_hash
+        opened = _time(
+            lambda: EventJournal(directory, read_only=True).stats(), args.repeat
+        )
+        print("open + load indexes: {:8.2f} ms".format(statistics.median(opened) * 1e3))
+        for name, query in queries:
+            samples = _time(query, args.repeat)
+            print(
+                "{:<22} {:8.2f} ms  ({} events)".format(
+                    name, statistics.median(samples) * 1e3, len(query())
+                )
+            )
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()
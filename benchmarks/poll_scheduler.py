@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+"""Compares fixed rate polling with the adaptive `PollScheduler` on the hardware
+simulator, running the full `BoxManager` flow against the local stub backend.
+
+Customers arrive with exponentially distributed idle gaps between them; each one
+taps a tag, opens the lid on the green LED and closes it again. The same
+customer script is replayed for every mode. Reported per mode, in simulated
+time:
+
+- wake-ups per second of the polling loop,
+- tap detection latency, from the tag touching the antenna until the reader
+  reports it, mean and worst case,
+- the projected duty cycle on real hardware (time scale 1), i.e. the measured
+  work per wake-up times the wake-ups per second.
+
+The CPU budget of the scheduler is measured in real time, which is compressed by
+the time scale here, so it is disabled unless --cpu-budget is given.
+
+Usage: python -m benchmarks.poll_scheduler [--customers-per-hour N] [--duration S]
+"""
+
+import argparse
+import random
+import statistics
+import tempfile
+import threading
+import time
+from typing import Dict, List, Tuple
+
+import yaml
+
+from benchmarks.sim_session import _write_config
+from benchmarks.stub_backend import StubBackend
+from box_manager.box_manager import BoxManager
+from box_manager.led_manager import PIN_LED_GREEN
+from box_manager.poll_scheduler import PollScheduler
+from hardware.backend import select_backend
+from hardware.sim_mfrc522 import tag_uid
+from utils import clock
+
+
+def _customers(rate: float, duration: float, seed: int) -> List[float]:
+    """Returns the idle gaps before each customer, in simulated seconds."""
+    rng = random.Random(seed)
+    gaps: List[float] = []
+    total = 0.0
+    while True:
+        gap = rng.expovariate(rate)
+        total += gap
+        if total >= duration:
+            return gaps
+        gaps.append(gap)
+
+
+class _Probe:
+    """Runs the threaded main loop and records wake-ups, work and detections."""
+
+    def __init__(self, manager: BoxManager):
+        self.manager = manager
+        self.works: List[float] = []
+        self.detected: Dict[int, float] = {}
+        self._running = True
+        read_tag = manager.read_tag
+
+        def probed_read_tag():
+            uid, token = read_tag()
+            if uid is not None:
+                self.detected.setdefault(uid, clock.monotonic())
+            return uid, token
+
+        # Patches the instance; mypy rejects assigning to a method
+        setattr(manager, "read_tag", probed_read_tag)
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+
+    def _loop(self):
+        while self._running:
+            scheduler = self.manager.poll_scheduler
+            started = time.perf_counter()
+            self.manager.routine_loop()
+            work = time.perf_counter() - started
+            scheduler.record(work)
+            self.works.append(work)
+            clock.sleep(scheduler.interval())
+
+    def stop(self):  # pylint: disable=missing-function-docstring
+        self._running = False
+        self._thread.join()
+
+
+def _run(  # pylint: disable=too-many-arguments,too-many-locals
+    sim,
+    backend: StubBackend,
+    manager: BoxManager,
+    probe: _Probe,
+    gaps: List[float],
+    hold: float,
+    first_uid: int,
+) -> Tuple[float, List[float]]:
+    box_id = manager.compartments[0].id
+    latencies = []
+    probe.works.clear()
+    wakeups = manager.poll_scheduler.wakeups
+    started = clock.monotonic()
+    for i, gap in enumerate(gaps):
+        clock.sleep(gap)
+        uid, token = tag_uid(first_uid + i), "poll-token-{}".format(first_uid + i)
+        backend.add_order(box_id, token)
+        tapped = clock.monotonic()
+        sim.present_tag(uid, token)
+        if not sim.wait_until(lambda uid=uid: uid in probe.detected, 30):
+            print("customer {}: tag not detected".format(i))
+            sim.remove_tag()
+            continue
+        latencies.append(probe.detected[uid] - tapped)
+        if sim.wait_until(
+            lambda tapped=tapped: sim.first_led_change(PIN_LED_GREEN, 1, tapped)
+            is not None,
+            10,
+        ):
+            sim.open_lid()
+            clock.sleep(hold)
+            sim.close_lid()
+        sim.remove_tag()
+        sim.wait_until(manager.idle, 30)
+    elapsed = clock.monotonic() - started
+    return (manager.poll_scheduler.wakeups - wakeups) / elapsed, latencies
+
+
+def main():  # pylint: disable=missing-function-docstring,too-many-locals
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--customers-per-hour", type=float, default=12.0)
+    parser.add_argument("--duration", type=float, default=3600.0)
+    parser.add_argument("--time-scale", type=float, default=50.0)
+    parser.add_argument("--hold", type=float, default=3.0, help="Lid open seconds.")
+    parser.add_argument("--cpu-budget", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    sim = select_backend("sim", time_scale=args.time_scale)
+    gaps = _customers(args.customers_per_hour / 3600, args.duration, args.seed)
+
+    with StubBackend() as backend, tempfile.TemporaryDirectory() as directory:
+        config_path = _write_config(directory, backend.url)
+        with open(config_path, "r", encoding="utf-8") as config_file:
+            config = yaml.safe_load(config_file)
+        backend.add_box(config["id"], config["password"])
+
+        manager = BoxManager(config_path)
+        manager.start(background=False)
+        adaptive = PollScheduler(
+            config.get("poll_active_rate"),
+            config.get("poll_idle_rate"),
+            config.get("poll_active_hold"),
+            config.get("poll_backoff_time"),
+            args.cpu_budget,
+        )
+        modes = [
+            ("fixed", PollScheduler.fixed(config["box_status_refresh_rate"])),
+            ("adaptive", adaptive),
+        ]
+        probe = _Probe(manager)
+        results = []
+        for index, (name, scheduler) in enumerate(modes):
+            manager.poll_scheduler = scheduler
+            wakeups, latencies = _run(
+                sim, backend, manager, probe, gaps, args.hold, 1000 * (index + 1)
+            )
+            results.append((name, scheduler, wakeups, latencies, list(probe.works)))
+        probe.stop()
+        manager.__exit__(None, None, None)
+
+    print(
+        "{} customers in {:.0f} simulated s per mode".format(len(gaps), args.duration)
+    )
+    print(
+        "{:<10}{:>11}{:>13}{:>13}{:>13}{:>12}".format(
+            "mode", "wakeups/s", "detect mean", "detect max", "bound", "duty cycle"
+        )
+    )
+    for name, scheduler, wakeups, latencies, works in results:
+        print(
+            "{:<10}{:>11.2f}{:>10.0f} ms{:>10.0f} ms{:>10.0f} ms{:>11.3f}%".format(
+                name,
+                wakeups,
+                statistics.mean(latencies) * 1e3 if latencies else float("nan"),
+                max(latencies) * 1e3 if latencies else float("nan"),
+                scheduler.idle_interval * 1e3,
+                statistics.mean(works) * wakeups * 100 if works else float("nan"),
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
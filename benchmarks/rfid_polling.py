@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+"""Compares the "classic" and "uid_first" read modes of `RfidReader` on the
+simulated MFRC522 register model.
+
+Per poll tick, for each scenario:
+
+- empty: no tag on the reader
+- arrival: a tag is placed on the reader, the first tick that sees it
+- resting: the tag stays on the reader
+
+it reports SPI transactions and bytes, the bus time they take on a Raspberry
+Pi as modelled by the simulated chip, the host CPU time of the tick and the
+fraction of ticks that did not see a tag on the reader.
+
+Usage: python -m benchmarks.rfid_polling [--ticks N]
+"""
+
+import argparse
+import time
+from typing import Dict, List, cast
+
+from hardware.backend import select_backend
+from hardware.sim_mfrc522 import tag_uid
+from hardware.simulator import Simulator
+from rfid_manager.reader import READ_MODES, RfidReader
+
+COLUMNS = ["xfers", "bytes", "bus ms", "cpu us", "missed"]
+
+
+def _ticks(reader: RfidReader, chip, ticks: int) -> List[float]:
+    transactions, sent = reader.spi.transactions, reader.spi.bytes
+    bus = chip.now
+    missed = 0
+    started = time.perf_counter()
+    for _ in range(ticks):
+        uid, _ = reader.read()
+        missed += uid is None
+    cpu = time.perf_counter() - started
+    return [
+        (reader.spi.transactions - transactions) / ticks,
+        (reader.spi.bytes - sent) / ticks,
+        (chip.now - bus) / ticks * 1e3,
+        cpu / ticks * 1e6,
+        missed / ticks,
+    ]
+
+
+def _run(mode: str, ticks: int) -> Dict[str, List[float]]:
+    sim = cast(Simulator, select_backend("sim"))
+    reader = RfidReader.create(mode=mode)
+    chip = sim.reader.chip
+    results = {"empty": _ticks(reader, chip, ticks)}
+    arrivals = [0.0] * len(COLUMNS)
+    for serial in range(ticks):
+        sim.present_tag(tag_uid(serial), "token-{}".format(serial))
+        arrivals = [a + b / ticks for a, b in zip(arrivals, _ticks(reader, chip, 1))]
+        sim.remove_tag()
+        reader.read()
+    results["arrival"] = arrivals
+    sim.present_tag(tag_uid(0))
+    reader.read()
+    results["resting"] = _ticks(reader, chip, ticks)
+    sim.remove_tag()
+    return results
+
+
+def main():  # pylint: disable=missing-function-docstring
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--ticks", type=int, default=200)
+    args = parser.parse_args()
+
+    results = {mode: _run(mode, args.ticks) for mode in READ_MODES}
+    print("{:<18}".format("per tick") + "".join("{:>10}".format(c) for c in COLUMNS))
+    for scenario in ["empty", "arrival", "resting"]:
+        for mode in READ_MODES:
+            print(
+                "{:<18}".format("{} {}".format(scenario, mode))
+                + "".join(
+                    "{:>10.2f}".format(value) for value in results[mode][scenario]
+                )
+            )
+
+
+if __name__ == "__main__":
+    main()
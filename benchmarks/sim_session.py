@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+"""Runs the full `BoxManager` customer flow on the hardware simulator against the
+local stub backend, at accelerated simulated time.
+
+Each cycle presents a tag, waits for the green LED, opens and closes the lid and
+waits for the box to return to STANDBY. Reports tap-to-green latency and cycle
+throughput in simulated time.
+
+Usage: python -m benchmarks.sim_session [--cycles N] [--time-scale X]
+"""
+
+import argparse
+import os
+import statistics
+import tempfile
+import threading
+
+import yaml
+
+from benchmarks.stub_backend import StubBackend
+from box_manager.box_manager import BoxManager
+from box_manager.led_manager import PIN_LED_GREEN
+from hardware.backend import select_backend
+from hardware.sim_mfrc522 import tag_uid
+from utils import clock
+
+
+def _write_config(directory: str, backend_url: str, **overrides) -> str:
+    with open(
+        "config.yaml", "r", encoding="utf-8"
+    ) as f:  # pylint: disable=invalid-name
+        config = yaml.safe_load(f)
+    config.update(
+        {
+            "hardware": "sim",
+            "backend_url": backend_url,
+            "outbox_path": os.path.join(directory, "outbox.log"),
+            "grant_index_path": os.path.join(directory, "grants.json"),
+            "command_cursor_path": os.path.join(directory, "command_cursor"),
+            "journal_path": os.path.join(directory, "journal"),
+        }
+    )
+    config.update(overrides)
+    path = os.path.join(directory, "config.yaml")
+    with open(path, "w", encoding="utf-8") as f:  # pylint: disable=invalid-name
+        yaml.safe_dump(config, f)
+    return path
+
+
+def main():  # pylint: disable=missing-function-docstring,too-many-locals
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--cycles", type=int, default=20)
+    parser.add_argument("--time-scale", type=float, default=20.0)
+    parser.add_argument("--hold", type=float, default=1.0, help="Lid open seconds.")
+    args = parser.parse_args()
+
+    sim = select_backend("sim", time_scale=args.time_scale)
+
+    with StubBackend() as backend, tempfile.TemporaryDirectory() as directory:
+        config_path = _write_config(directory, backend.url)
+        with open(
+            config_path, "r", encoding="utf-8"
+        ) as f:  # pylint: disable=invalid-name
+            config = yaml.safe_load(f)
+        backend.add_box(config["id"], config["password"])
+
+        manager = BoxManager(config_path)
+        manager.start(background=False)
+        running = True
+
+        def loop():
+            while running:
+                manager.routine_loop()
+                clock.sleep(0.2)
+
+        thread = threading.Thread(target=loop, daemon=True)
+        thread.start()
+
+        latencies = []
+        started = clock.monotonic()
+        for cycle in range(args.cycles):
+            token = "token-{}".format(cycle)
+            backend.add_order(config["id"], token)
+            tapped = clock.monotonic()
+            sim.present_tag(tag_uid(1000 + cycle), token)
+            if not sim.wait_until(
+                lambda tapped=tapped: sim.first_led_change(PIN_LED_GREEN, 1, tapped)
+                is not None,
+                10,
+            ):
+                print("cycle {}: no green LED".format(cycle))
+                continue
+            latencies.append(sim.first_led_change(PIN_LED_GREEN, 1, tapped) - tapped)
+            sim.remove_tag()
+            sim.open_lid()
+            clock.sleep(args.hold)
+            sim.close_lid()
+            sim.wait_until(manager.idle, 10)
+        elapsed = clock.monotonic() - started
+        running = False
+        thread.join()
+        manager.__exit__(None, None, None)
+
+    print(
+        "{} cycles in {:.1f} simulated s ({:.1f} real s), {:.1f} cycles/min".format(
+            args.cycles,
+            elapsed,
+            clock.to_real(elapsed),
+            args.cycles / elapsed * 60,
+        )
+    )
+    if latencies:
+        print(
+            "tap-to-green: mean {:.0f} ms  max {:.0f} ms (simulated)".format(
+                statistics.mean(latencies) * 1e3, max(latencies) * 1e3
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+"""Compares the in-tree `StateMachine` with the `transitions.LockedMachine`
+it replaced, on the `BoxManager` transition table with a no-op transition hook.
+
+Timed per operation:
+
+- trigger: one transition, cycling STANDBY -> ERROR -> STOPPED -> STARING ->
+  STANDBY. LockedMachine is measured as it was used, i.e. with the extra RLock
+  of `BoxManager` taken around every trigger.
+- state check: whether the machine is in STANDBY.
+- contended: the trigger cycle run by --threads threads at once.
+
+The LockedMachine columns are skipped if the transitions package is not
+installed.
+
+Usage: python -m benchmarks.state_machine [--cycles N] [--threads N]
+"""
+
+import argparse
+import statistics
+import threading
+import time
+from typing import Callable, List, Optional
+
+from box_manager.box_manager import BoxManager
+from utils.state_machine import StateMachine
+
+LockedMachine: Optional[type]
+try:
+    from transitions.extensions import LockedMachine
+except ImportError:
+    LockedMachine = None
+
+States = BoxManager.States
+CYCLE = ["error", "reset", "start", "start_success"]
+
+
+def _ns_per_call(func: Callable[[], object], count: int, rounds: int = 5) -> float:
+    medians = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        for _ in range(count):
+            func()
+        medians.append((time.perf_counter() - started) / count)
+    return statistics.median(medians) * 1e9
+
+
+def _contended(cycle: Callable[[], object], count: int, threads: int) -> float:
+    workers = [
+        threading.Thread(target=lambda: [cycle() for _ in range(count)])
+        for _ in range(threads)
+    ]
+    started = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return (time.perf_counter() - started) / (count * threads * len(CYCLE)) * 1e9
+
+
+def _state_machine():
+    machine = StateMachine(BoxManager.transitions, States.STANDBY, lambda t: None)
+
+    def cycle():
+        for trigger in CYCLE:
+            machine.trigger(trigger)
+
+    def contended_cycle():
+        # Other threads interleave, only take what is valid
+        for trigger in CYCLE:
+            machine.try_trigger(trigger)
+
+    return cycle, contended_cycle, lambda: machine.state is States.STANDBY
+
+
+def _locked_machine():
+    lock = threading.RLock()
+    machine = LockedMachine(
+        states=States,
+        transitions=[
+            ["start", States.STOPPED, States.STARING],
+            ["stop", [States.STANDBY, States.ERROR], States.STOPPED],
+            ["reset", States.ERROR, States.STOPPED],
+            ["start_success", States.STARING, States.STANDBY],
+            ["error", "*", States.ERROR],
+        ],
+        initial=States.STANDBY,
+        send_event=True,
+        after_state_change=lambda event: None,
+    )
+    triggers = [getattr(machine, trigger) for trigger in CYCLE]
+
+    def cycle():
+        for trigger in triggers:
+            with lock:
+                trigger()
+
+    def contended_cycle():
+        for name, trigger in zip(CYCLE, triggers):
+            with lock:
+                if machine.may_trigger(name):
+                    trigger()
+
+    return cycle, contended_cycle, machine.is_STANDBY
+
+
+def main():  # pylint: disable=missing-function-docstring
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--cycles", type=int, default=20000)
+    parser.add_argument("--threads", type=int, default=4)
+    args = parser.parse_args()
+
+    rows: List[List[Optional[float]]] = []
+    machines = [("StateMachine", _state_machine)]
+    if LockedMachine is not None:
+        machines.append(("LockedMachine", _locked_machine))
+    for _, factory in machines:
+        cycle, contended_cycle, is_standby = factory()
+        rows.append(
+            [
+                _ns_per_call(cycle, args.cycles) / len(CYCLE),
+                _ns_per_call(is_standby, args.cycles * len(CYCLE)),
+                _contended(contended_cycle, args.cycles // args.threads, args.threads),
+            ]
+        )
+    if LockedMachine is None:
+        print("transitions is not installed, LockedMachine skipped.")
+
+    print(
+        "{:<14}".format("ns per op")
+        + "".join("{:>14}".format(name) for name, _ in machines)
+    )
+    for index, name in enumerate(["trigger", "state check", "contended"]):
+        values = [row[index] for row in rows]
+        line = "{:<14}".format(name) + "".join(
+            "{:>14.0f}".format(value) for value in values
+        )
+        if len(values) > 1:
+            line += "  ({:.1f}x)".format(values[1] / values[0])
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
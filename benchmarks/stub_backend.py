@@ -0,0 +1,327 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+"""Minimal in-process stand-in for the delivery backend.
+
+Implements just the endpoints used by `utils.authenticator.Authenticator` and
+speaks HTTP/1.1 with keep-alive, so it can be used to compare connection reuse
+against one-connection-per-request clients.
+"""
+
+import base64
+import json
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Tuple
+from urllib.parse import parse_qs, urlparse
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ed25519
+
+from utils.grants import grant_payload
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: "_Server"
+
+    def setup(self):
+        super().setup()
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        with self.server.stats_lock:
+            self.server.stats["connections"] += 1
+        # Emulates the extra round trips of a TCP/TLS handshake on a new connection
+        if self.server.backend.handshake_delay > 0:
+            time.sleep(self.server.backend.handshake_delay)
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        pass
+
+    def _reply(self, code: int, body: str = "", cookies: Dict[str, str] = None):
+        payload = body.encode("utf-8")
+        if self.server.backend.latency > 0:
+            time.sleep(self.server.backend.latency)
+        self.send_response(code)
+        for name, value in (cookies or {}).items():
+            self.send_header("Set-Cookie", "{}={}; Path=/".format(name, value))
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(payload)
+        with self.server.stats_lock:
+            self.server.stats["requests"] += 1
+
+    def _drain_body(self):
+        length = int(self.headers.get("Content-Length", 0))
+        return self.rfile.read(length) if length else b""
+
+    def _stream_commands(self, box_id: str):
+        """Serves the commands of `box_id` as server-sent events until the client
+        disconnects, the streams are dropped or the server stops.
+        """
+        backend = self.server.backend
+        cursor = int(self.headers.get("Last-Event-ID") or 0)
+        self.close_connection = True
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        with backend.commands_cond:
+            generation = backend.stream_generation
+        try:
+            while True:
+                with backend.commands_cond:
+                    backend.commands_cond.wait_for(
+                        lambda: len(backend.commands.get(box_id, [])) > cursor
+                        or backend.stream_generation != generation,
+                        backend.heartbeat,
+                    )
+                    if backend.stream_generation != generation:
+                        return
+                    pending = backend.commands.get(box_id, [])[cursor:]
+                if not pending:
+                    self.wfile.write(b": heartbeat\n\n")
+                for command in pending:
+                    cursor += 1
+                    self.wfile.write(
+                        "id: {}\nevent: command\ndata: {}\n\n".format(
+                            cursor, json.dumps(command)
+                        ).encode("utf-8")
+                    )
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            return
+
+    def do_HEAD(self):  # pylint: disable=invalid-name,missing-function-docstring
+        self._reply(200)
+
+    def do_GET(self):  # pylint: disable=invalid-name,missing-function-docstring
+        backend = self.server.backend
+        url = urlparse(self.path)
+        parts = url.path.strip("/").split("/")
+        if url.path == "/auth/csrf":
+            self._reply(200, cookies={"XSRF-TOKEN": "stub-csrf"})
+        elif url.path == "/delivery/csrf":
+            self._reply(200, cookies={"XSRF-TOKEN-DELIVERY": "stub-csrf-delivery"})
+        elif url.path == "/auth/pkey":
+            self._reply(200, backend.pkey)
+        elif url.path == "/auth/pem":
+            self._reply(200, backend.pem)
+        elif parts[:2] == ["order", "grants"] and len(parts) == 3:
+            if "jwt" not in self.headers.get("Cookie", ""):
+                self._reply(401)
+                return
+            self._reply(200, json.dumps(backend.signer.grants_for(parts[2], backend)))
+        elif parts[:2] == ["box", "commands"] and len(parts) == 3:
+            if "jwt" not in self.headers.get("Cookie", ""):
+                self._reply(401)
+                return
+            self._stream_commands(parts[2])
+        elif parts[:2] == ["order", "list"] and len(parts) == 3:
+            token = parse_qs(url.query).get("token", [""])[0]
+            if "jwt" not in self.headers.get("Cookie", ""):
+                self._reply(401)
+                return
+            self._reply(200, json.dumps(backend.orders.get((parts[2], token), [])))
+        else:
+            self._reply(404)
+
+    def do_POST(self):  # pylint: disable=invalid-name,missing-function-docstring
+        body = self._drain_body()
+        if self.path == "/auth/jwe/box":
+            credentials = json.loads(body or b"{}")
+            backend = self.server.backend
+            if backend.open_login or backend.accounts.get(
+                credentials.get("username")
+            ) == credentials.get("password"):
+                self._reply(200, "ok", cookies={"jwt": "stub-jwt"})
+            else:
+                self._reply(401)
+        else:
+            self._reply(404)
+
+    def do_PUT(self):  # pylint: disable=invalid-name,missing-function-docstring
+        self._drain_body()
+        parts = urlparse(self.path).path.strip("/").split("/")
+        if parts[:2] == ["order", "change-status"] and len(parts) == 4:
+            orders = self.server.backend.orders.get((parts[2], parts[3]))
+            if orders:
+                orders.pop(0)
+                self._reply(200, "ok")
+            else:
+                self._reply(404)
+        else:
+            self._reply(404)
+
+
+class StubSigner:
+    """Signs pickup grants like the backend, with a throwaway Ed25519 key.
+
+    Args:
+        lifetime (float, optional): grant validity in seconds. Defaults to 3600.
+    """
+
+    def __init__(self, lifetime: float = 3600.0):
+        self.lifetime = lifetime
+        self._key = ed25519.Ed25519PrivateKey.generate()
+
+    @property
+    def public_pem(self) -> str:  # pylint: disable=missing-function-docstring
+        return (
+            self._key.public_key()
+            .public_bytes(
+                serialization.Encoding.PEM,
+                serialization.PublicFormat.SubjectPublicKeyInfo,
+            )
+            .decode("utf-8")
+        )
+
+    def sign(self, box_id: str, token: str, expires: int) -> dict:
+        """Returns a grant for `token` at `box_id`."""
+        signature = self._key.sign(grant_payload(box_id, token, expires))
+        return {
+            "token": token,
+            "expires": expires,
+            "signature": base64.b64encode(signature).decode("ascii"),
+        }
+
+    def grants_for(self, box_id: str, backend: "StubBackend") -> List[dict]:
+        """Returns grants for all pending orders at `box_id`."""
+        expires = int(time.time() + self.lifetime)
+        return [
+            self.sign(box_id, token, expires)
+            for (box, token), orders in list(backend.orders.items())
+            if box == box_id and orders
+        ]
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    # Fleet simulations open hundreds of connections at once
+    request_queue_size = 1024
+    backend: "StubBackend"
+    stats: Dict[str, int]
+    stats_lock: threading.Lock
+
+
+class StubBackend:
+    """Local stub backend running in a background thread.
+
+    Args:
+        latency (float, optional): server side processing time of each request
+            in seconds. Defaults to 0.0.
+        handshake_delay (float, optional): extra delay in seconds paid once per new
+            connection. Defaults to 0.0.
+        port (int, optional): port to listen on, 0 picks a free one. Defaults to 0.
+        heartbeat (float, optional): seconds between heartbeats on idle command
+            streams. Defaults to 15.0.
+    """
+
+    def __init__(
+        self,
+        latency: float = 0.0,
+        handshake_delay: float = 0.0,
+        port=0,
+        heartbeat: float = 15.0,
+    ):
+        self.latency = latency
+        self.handshake_delay = handshake_delay
+        self.heartbeat = heartbeat
+        self.signer = StubSigner()
+        self.pkey = "stub-pkey"
+        self.pem = self.signer.public_pem
+        self.accounts: Dict[str, str] = {}
+        # Accepts any credentials, e.g. for a fleet of unregistered boxes
+        self.open_login = False
+        self.orders: Dict[Tuple[str, str], List[str]] = {}
+        self.commands: Dict[str, List[dict]] = {}
+        self.commands_cond = threading.Condition()
+        self.stream_generation = 0
+
+        self._server = _Server(("127.0.0.1", port), _Handler)
+        self._server.backend = self
+        self._server.stats = {"connections": 0, "requests": 0}
+        self._server.stats_lock = threading.Lock()
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, name="stub-backend", daemon=True
+        )
+
+    @property
+    def url(self) -> str:  # pylint: disable=missing-function-docstring
+        return "http://127.0.0.1:{}".format(self._server.server_port)
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        """Returns number of accepted connections and served requests."""
+        with self._server.stats_lock:
+            return dict(self._server.stats)
+
+    def add_box(self, box_id: str, password: str):
+        """Registers a box account that may log in."""
+        self.accounts[box_id] = password
+
+    def add_order(self, box_id: str, token: str, order: str = "order"):
+        """Adds a pending order for `token` at box `box_id`."""
+        self.orders.setdefault((box_id, token), []).append(order)
+
+    def push_command(self, box_id: str, command: dict) -> int:
+        """Queues a command for box `box_id`.
+
+        Returns:
+            int: event id of the command
+        """
+        with self.commands_cond:
+            queue = self.commands.setdefault(box_id, [])
+            queue.append(command)
+            self.commands_cond.notify_all()
+            return len(queue)
+
+    def drop_streams(self):
+        """Closes all open command streams, clients have to reconnect."""
+        with self.commands_cond:
+            self.stream_generation += 1
+            self.commands_cond.notify_all()
+
+    def start(self) -> "StubBackend":  # pylint: disable=missing-function-docstring
+        self._thread.start()
+        return self
+
+    def stop(self):  # pylint: disable=missing-function-docstring
+        self.drop_streams()
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+
+def main():
+    """Runs the stub backend in the foreground."""
+    import argparse  # pylint: disable=import-outside-toplevel
+
+    parser = argparse.ArgumentParser(description="Stub delivery backend")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--handshake-delay", type=float, default=0.0)
+    parser.add_argument(
+        "--open-login", action="store_true", help="Accept any box credentials."
+    )
+    args = parser.parse_args()
+
+    with StubBackend(args.latency, args.handshake_delay, args.port) as backend:
+        backend.open_login = args.open_login
+        print("Stub backend listening on {}".format(backend.url))
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,314 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+"""Regression benchmark suite of the box control path.
+
+Runs on the simulated hardware backend (in place of RPi.GPIO and mfrc522)
+against the local stub backend, and compares the median of every case with a
+stored baseline:
+
+- routine_loop: one `BoxManager.routine_loop` iteration without a tag, with
+  the "uid_first" reader
+- routine_loop_classic: the same with the "classic" reader, whose empty poll
+  waits out the REQA timeout on the chip, about 250 SPI transactions
+- transitions: one `BoxManager` state machine transition, incl. callbacks
+- auth: one `Authenticator.auth` call, uncached
+- config_load: reading and validating config.yaml with `ConfigureReader`
+- open_box: tap to green LED, `BoxManager.open_box` with an order
+- cycle: tap, open and close the lid, until the box is idle again
+
+Every case runs --rounds times, interleaved with the others; its median is the
+lowest median of a round, which filters out rounds disturbed by other load on
+the machine. A case regresses if its median exceeds the baseline by more than
+--threshold; the exit code is then 1. Results are printed and, with --json,
+written as
+
+    {"environment": {...}, "threshold": 0.25, "regressions": [names],
+     "results": {name: {"unit": "s", "median": ..., "p90": ..., "samples": n,
+                        "baseline": ..., "change": ..., "regression": bool}}}
+
+Baselines are machine specific, refresh them with --update-baseline after
+an intended change or on new hardware.
+
+Usage: python -m benchmarks.suite [--only a,b] [--json PATH] [--update-baseline]
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+import yaml
+
+from benchmarks.sim_session import _write_config
+from benchmarks.stub_backend import StubBackend
+from box_manager.box_manager import BoxManager
+from hardware.backend import select_backend
+from rfid_manager.reader import READ_MODE_UID_FIRST
+from utils import clock
+from utils.auth_cache import AuthCache
+from utils.authenticator import Authenticator
+from utils.configure_reader import ConfigureReader
+
+DEFAULT_BASELINE_PATH = os.path.join(os.path.dirname(__file__), "baseline.json")
+DEFAULT_THRESHOLD = 0.25
+TIME_SCALE = 1000.0
+
+
+class _Environment:
+    """Simulated box with a running `BoxManager` and a stub backend."""
+
+    def __init__(self):
+        self.sim = select_backend("sim", time_scale=TIME_SCALE)
+        self.backend = StubBackend().start()
+        self.directory = tempfile.mkdtemp()
+        self.config_path = _write_config(
+            self.directory, self.backend.url, rfid_read_mode=READ_MODE_UID_FIRST
+        )
+        with open(self.config_path, "r", encoding="utf-8") as config_file:
+            self.config = yaml.safe_load(config_file)
+        self.box_id = self.config["id"]
+        self.backend.add_box(self.box_id, self.config["password"])
+        self.manager = BoxManager(self.config_path)
+        self.manager.start(background=False)
+        self._uid = 0
+
+    def next_tag(self):
+        """Returns a fresh (uid, token) with a pending order."""
+        self._uid += 1
+        token = "suite-token-{}".format(self._uid)
+        self.backend.add_order(self.box_id, token)
+        return self._uid, token
+
+    def close(self):  # pylint: disable=missing-function-docstring
+        self.manager.__exit__(None, None, None)
+        self.backend.stop()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+def _repeat(func: Callable[[], object], count: int) -> List[float]:
+    samples = []
+    for _ in range(count):
+        started = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - started)
+    return samples
+
+
+def bench_routine_loop(env: _Environment, scale: int) -> List[float]:
+    # pylint: disable=missing-function-docstring
+    return _repeat(env.manager.routine_loop, 2000 * scale)
+
+
+def bench_routine_loop_classic(env: _Environment, scale: int) -> List[float]:
+    """Polls through the reader in the "classic" mode."""
+    # pylint: disable=protected-access
+    reader = env.manager._reader
+    driver = reader._driver
+    # The reader is a singleton; without its driver it reads like
+    # `mfrc522.SimpleMFRC522`, with the chip timeout restored by `init`. The
+    # driver shortens it again on its next poll.
+    driver.init()
+    reader._driver = None
+    try:
+        return _repeat(env.manager.routine_loop, 200 * scale)
+    finally:
+        reader._driver = driver
+
+
+def bench_transitions(env: _Environment, scale: int) -> List[float]:
+    """Cycles STANDBY -> ERROR -> STOPPED -> STARING -> STANDBY."""
+    machine = env.manager._machine  # pylint: disable=protected-access
+    triggers = ["error", "reset", "start", "start_success"]
+    samples = []
+    for _ in range(250 * scale):
+        for trigger in triggers:
+            started = time.perf_counter()
+            machine.trigger(trigger)
+            samples.append(time.perf_counter() - started)
+    return samples
+
+
+def bench_auth(env: _Environment, scale: int) -> List[float]:
+    # pylint: disable=missing-function-docstring
+    authenticator = Authenticator.create(
+        env.backend.url, auth_cache=AuthCache(max_size=0)
+    )
+    try:
+        authenticator.login(env.box_id, env.config["password"])
+        _, token = env.next_tag()
+        return _repeat(lambda: authenticator.auth(env.box_id, token), 200 * scale)
+    finally:
+        authenticator.close()
+
+
+def bench_config_load(env: _Environment, scale: int) -> List[float]:
+    # pylint: disable=missing-function-docstring
+    return _repeat(lambda: ConfigureReader(env.config_path), 100 * scale)
+
+
+def bench_open_box(env: _Environment, scale: int) -> List[float]:
+    # pylint: disable=missing-function-docstring
+    samples = []
+    for _ in range(30 * scale):
+        uid, token = env.next_tag()
+        started = time.perf_counter()
+        if not env.manager.open_box(uid, token):
+            raise RuntimeError("open_box failed")
+        samples.append(time.perf_counter() - started)
+        # Pick up, so that the compartment is idle for the next tap
+        env.sim.open_lid()
+        env.sim.close_lid()
+        env.sim.wait_until(env.manager.idle, 30)
+    return samples
+
+
+def bench_cycle(env: _Environment, scale: int) -> List[float]:
+    # pylint: disable=missing-function-docstring
+    def cycle():
+        uid, token = env.next_tag()
+        env.manager.open_box(uid, token)
+        env.sim.open_lid()
+        # Longer than the lid debounce, so that the opening is seen
+        clock.sleep(0.1)
+        env.sim.close_lid()
+        if not env.sim.wait_until(env.manager.idle, 30):
+            raise RuntimeError("box did not return to idle")
+
+    return _repeat(cycle, 30 * scale)
+
+
+CASES: Dict[str, Callable[[_Environment, int], List[float]]] = {
+    "routine_loop": bench_routine_loop,
+    "routine_loop_classic": bench_routine_loop_classic,
+    "transitions": bench_transitions,
+    "auth": bench_auth,
+    "config_load": bench_config_load,
+    "open_box": bench_open_box,
+    "cycle": bench_cycle,
+}
+
+
+def _summary(rounds: List[List[float]], baseline: Optional[float], threshold: float):
+    median = min(statistics.median(samples) for samples in rounds)
+    samples = sorted(sample for samples in rounds for sample in samples)
+    result: Dict[str, Any] = {
+        "unit": "s",
+        "median": median,
+        "p90": samples[int(len(samples) * 0.9)],
+        "samples": len(samples),
+        "baseline": baseline,
+        "change": None,
+        "regression": False,
+    }
+    if baseline:
+        result["change"] = median / baseline - 1
+        result["regression"] = result["change"] > threshold
+    return result
+
+
+def _load_baseline(path: str) -> Dict[str, float]:
+    try:
+        with open(path, "r", encoding="utf-8") as baseline_file:
+            return json.load(baseline_file)["medians"]
+    except (OSError, ValueError, KeyError):
+        return {}
+
+
+def main():  # pylint: disable=missing-function-docstring,too-many-locals
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--only", help="Comma separated cases.")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE_PATH)
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD)
+    parser.add_argument("--scale", type=int, default=1, help="Sample multiplier.")
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--json", help="Writes the results to this file.")
+    parser.add_argument("--update-baseline", action="store_true")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.CRITICAL)
+
+    names = args.only.split(",") if args.only else list(CASES)
+    unknown = [name for name in names if name not in CASES]
+    if unknown:
+        parser.error("unknown cases: {}".format(", ".join(unknown)))
+    baseline = _load_baseline(args.baseline)
+
+    env = _Environment()
+    results = {}
+    try:
+        # Interleaved, so that a disturbance does not hit all rounds of a case
+        rounds: Dict[str, List[List[float]]] = {name: [] for name in names}
+        for _ in range(args.rounds):
+            for name in names:
+                rounds[name].append(CASES[name](env, args.scale))
+        for name in names:
+            results[name] = _summary(rounds[name], baseline.get(name), args.threshold)
+    finally:
+        env.close()
+
+    print(
+        "{:<22}{:>12}{:>12}{:>12}{:>9}".format(
+            "case", "median us", "p90 us", "baseline", "change"
+        )
+    )
+    for name, result in results.items():
+        print(
+            "{:<22}{:>12.1f}{:>12.1f}{:>12}{:>9}{}".format(
+                name,
+                result["median"] * 1e6,
+                result["p90"] * 1e6,
+                (
+                    "-"
+                    if result["baseline"] is None
+                    else "{:.1f}".format(result["baseline"] * 1e6)
+                ),
+                "-" if result["change"] is None else "{:+.0%}".format(result["change"]),
+                "  REGRESSION" if result["regression"] else "",
+            )
+        )
+
+    regressions = [name for name, result in results.items() if result["regression"]]
+    report = {
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "machine": platform.machine(),
+        },
+        "threshold": args.threshold,
+        "regressions": regressions,
+        "results": results,
+    }
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as json_file:
+            json.dump(report, json_file, indent=2)
+    if args.update_baseline:
+        baseline.update({name: result["median"] for name, result in results.items()})
+        with open(args.baseline, "w", encoding="utf-8") as baseline_file:
+            json.dump(
+                {"environment": report["environment"], "medians": baseline},
+                baseline_file,
+                indent=2,
+                sort_keys=True,
+            )
+            baseline_file.write("\n")
+        print("Baseline {} updated.".format(args.baseline))
+        return
+    if regressions:
+        print(
+            "Regressions beyond {:.0%}: {}".format(
+                args.threshold, ", ".join(regressions)
+            )
+        )
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
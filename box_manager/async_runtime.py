@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import Awaitable, Callable, List, Optional
+import logging
+import time
+from box_manager.box_manager import BoxManager
+from utils import clock
+from utils.metrics import LoopMonitor
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncRuntime:
+    """Runs a `BoxManager` on an asyncio event loop.
+
+    RFID polling and lid monitoring run as concurrent tasks, so neither stalls
+    while a customer session (backend requests, waiting for the lid, LED
+    feedback) is in progress. Blocking hardware calls are offloaded to a
+    single-threaded executor, which keeps SPI/GPIO access serialized; tag
+    authorization (`BoxManager.open_box`) runs on a separate executor, and the
+    compartment sessions it starts run concurrently within the `BoxManager`.
+    The state machines stay in charge of all transitions.
+
+    Args:
+        manager (BoxManager): box manager to drive
+        interval (Optional[float], optional): fixed polling interval in seconds.
+            Defaults to None, which follows the adaptive
+            `BoxManager.poll_scheduler`.
+    """
+
+    def __init__(self, manager: BoxManager, interval: Optional[float] = None):
+        self._manager = manager
+        self._fixed_interval = interval
+        self._hw_executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="hardware"
+        )
+        self._session_executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="session"
+        )
+        self._session: Optional[asyncio.Future] = None
+        self.loop_monitor = LoopMonitor(self._interval)
+        self._extra_tasks: List[Callable[[], Awaitable[None]]] = []
+        # Lid check time since the last tick, recorded with the reader poll
+        self._lid_work = 0.0
+
+    @property
+    def _interval(self) -> float:
+        if self._fixed_interval is not None:
+            return self._fixed_interval
+        return self._manager.poll_scheduler.interval()
+
+    def add_task(self, factory: Callable[[], Awaitable[None]]):
+        """Registers an additional coroutine to run alongside the built-in tasks.
+
+        Args:
+            factory (Callable[[], Awaitable[None]]): called once in `run` to
+                create the coroutine
+        """
+        self._extra_tasks.append(factory)
+
+    def session_active(self) -> bool:
+        """Returns whether a customer session is in progress."""
+        return (
+            self._session is not None and not self._session.done()
+        ) or not self._manager.idle()
+
+    async def _hardware(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(
+            self._hw_executor, func, *args
+        )
+
+    async def _poll_reader(self):
+        scheduler = self._manager.poll_scheduler
+        while True:
+            with self.loop_monitor.iteration():
+                await self._poll_reader_once()
+            # Both tasks poll at the scheduler's interval, one wake-up per tick
+            scheduler.record(self.loop_monitor.last_duration + self._lid_work)
+            self._lid_work = 0.0
+            interval = self._interval
+            self.loop_monitor.interval = interval
+            await asyncio.sleep(clock.to_real(interval))
+
+    async def _poll_reader_once(self):
+        uid, token = await self._hardware(self._manager.read_tag)
+        if uid is not None:
+            # Tags are authorized one at a time; the compartment sessions they
+            # start run in the background within the box manager.
+            self._session = asyncio.get_running_loop().run_in_executor(
+                self._session_executor, self._manager.open_box, uid, token
+            )
+            self._session.add_done_callback(self._on_session_done)
+
+    @staticmethod
+    def _on_session_done(future: asyncio.Future):
+        if not future.cancelled() and future.exception() is not None:
+            logger.error(
+                "Session failed: {}".format(  # pylint: disable=logging-format-interpolation
+                    future.exception()
+                )
+            )
+
+    async def _watch_lid(self):
+        while True:
+            # Open compartments are supervised by their sessions
+            started = time.perf_counter()
+            await self._hardware(self._manager.check_lid)
+            self._lid_work += time.perf_counter() - started
+            await asyncio.sleep(clock.to_real(self._interval))
+
+    async def run(self):
+        """Starts the box manager and runs all tasks until cancelled."""
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self._session_executor, self._manager.start)
+        tasks = [
+            asyncio.create_task(self._poll_reader(), name="rfid"),
+            asyncio.create_task(self._watch_lid(), name="lid"),
+        ]
+        tasks += [asyncio.create_task(factory()) for factory in self._extra_tasks]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+            self._hw_executor.shutdown(wait=False)
+            self._session_executor.shutdown(wait=False)
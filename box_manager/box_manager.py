@@ -1,20 +1,125 @@
 import enum
+import os
 import traceback
 import time
-from threading import RLock
+from concurrent.futures import ThreadPoolExecutor
+from threading import Thread
 import logging
-from transitions.extensions import LockedMachine
-from box_manager.led_manager import LedManager
-from box_manager.photo_resistor import PhotoResistor
-from rfid_manager.reader import RfidReader
-from utils.configure_reader import BOX_STATUS_REFRESH_INTERVAL
+from typing import Any, Dict, List, Optional, Set, Tuple, cast
+from hardware.backend import get_backend, DEFAULT_BACKEND
+from box_manager.compartment import Compartment, DEFAULT_LID_TIMEOUT
+from box_manager.photo_resistor import DEFAULT_DEBOUNCE
+from box_manager.poll_scheduler import (
+    PollScheduler,
+    DEFAULT_ACTIVE_RATE,
+    DEFAULT_IDLE_RATE,
+    DEFAULT_ACTIVE_HOLD,
+    DEFAULT_BACKOFF_TIME,
+    DEFAULT_CPU_BUDGET,
+)
+from rfid_manager.reader import RfidReader, DEFAULT_READ_MODE
+from rfid_manager.presence import (
+    TagPresenceTracker,
+    TagEventKind,
+    DEFAULT_COOLDOWN,
+    DEFAULT_ABSENCE_GRACE,
+)
+from utils import clock
 from utils.manager_base import ManagerBase
-from utils.authenticator import Authenticator
-from utils.configure_reader import ConfigureReader
-
+from utils.authenticator import (
+    Authenticator,
+    DEFAULT_POOL_SIZE,
+    DEFAULT_CONNECT_TIMEOUT,
+    DEFAULT_READ_TIMEOUT,
+)
+from utils.auth_cache import (
+    AuthCache,
+    DEFAULT_CACHE_SIZE,
+    DEFAULT_POSITIVE_TTL,
+    DEFAULT_NEGATIVE_TTL,
+)
+from utils.configure_reader import (
+    ConfigureReader,
+    ConfigSnapshot,
+    DEFAULT_WATCH_INTERVAL,
+)
+from utils.outbox import Outbox, DEFAULT_OUTBOX_PATH
+from utils.journal import (
+    EventJournal,
+    EventKind,
+    DEFAULT_JOURNAL_PATH,
+    DEFAULT_SEGMENT_SIZE,
+    DEFAULT_RETENTION_DAYS,
+)
+from utils.grants import (
+    GrantIndex,
+    GrantSync,
+    DEFAULT_GRANT_INDEX_PATH,
+    DEFAULT_SYNC_INTERVAL,
+)
+from utils.command_channel import (
+    CommandChannel,
+    DEFAULT_COMMAND_CURSOR_PATH,
+    DEFAULT_STREAM_TIMEOUT,
+)
+from utils.session_manager import (
+    SessionManager,
+    DEFAULT_SESSION_LIFETIME,
+    DEFAULT_REFRESH_MARGIN,
+)
+from utils.metrics import REGISTRY
+from utils.startup import STARTUP
+from utils.state_machine import StateMachine, Transition, TransitionTable
 
 logger = logging.getLogger(__name__)
 
+_OPEN_BOX_SECONDS = REGISTRY.histogram(
+    "box_open_box_seconds",
+    "Duration of open_box, from tag read to compartments unlocked.",
+)
+_TRANSITIONS = REGISTRY.counter(
+    "box_state_transitions_total",
+    "State machine transitions.",
+    ["trigger", "source", "dest"],
+)
+_STATE_SECONDS = REGISTRY.histogram(
+    "box_state_duration_seconds", "Time spent in a state before leaving it.", ["state"]
+)
+
+# Entries bound to hardware or to long-lived connections, only applied on restart
+_RESTART_ENTRIES = (
+    "id",
+    "backend_url",
+    "backend_pool_size",
+    "hardware",
+    "compartments",
+    "lid_edge_triggered",
+    "outbox_path",
+    "journal_path",
+    "journal_segment_size",
+    "journal_retention_days",
+    "offline_grants",
+    "grant_index_path",
+    "command_channel",
+    "command_cursor_path",
+)
+
+
+def _poll_settings(config: ConfigSnapshot) -> Dict[str, float]:
+    if not config.get("adaptive_polling", True):
+        return {
+            "active_rate": config.refresh_rate,
+            "idle_rate": config.refresh_rate,
+            "cpu_budget": 0,
+        }
+    return {
+        "active_rate": config.get("poll_active_rate", DEFAULT_ACTIVE_RATE),
+        "idle_rate": config.get("poll_idle_rate", DEFAULT_IDLE_RATE),
+        "active_hold": config.get("poll_active_hold", DEFAULT_ACTIVE_HOLD),
+        "backoff_time": config.get("poll_backoff_time", DEFAULT_BACKOFF_TIME),
+        "cpu_budget": config.get("poll_cpu_budget", DEFAULT_CPU_BUDGET),
+    }
+
 
 class BoxManagerError(Exception):  # pylint: disable=missing-class-docstring
     pass
@@ -28,7 +133,13 @@ class Roles(enum.Enum):
 
 
 class BoxManager(ManagerBase):
-    """Singleton, manage box manager life cycle"""
+    """Singleton, manage box manager life cycle
+
+    The box consists of one or more compartments (`compartments` in config.yaml),
+    sharing the reader and the backend session. A tag opens every idle
+    compartment it is authorized for; customers at different compartments are
+    served concurrently.
+    """
 
     class States(enum.Enum):
         """State of SFM"""
@@ -40,192 +151,534 @@ class BoxManager(ManagerBase):
         OPEN = 3
         READER = 4
 
-    transitions = [
-        ["start", States.STOPPED, States.STARING],
-        ["stop", [States.STANDBY, States.ERROR], States.STOPPED],
-        ["reset", States.ERROR, States.STOPPED],
-        ["start_success", States.STARING, States.STANDBY],
-        ["error", "*", States.ERROR],
-        ["opened", States.STANDBY, States.OPEN],
-        ["closed", States.OPEN, States.STANDBY],
-    ]
-
-    def __init__(self):
-        self._lock = RLock()
-        self._machine = LockedMachine(
-            states=self.States,
-            transitions=self.transitions,
-            initial=self.States.STOPPED,
+    transitions = TransitionTable(
+        States,
+        [
+            ["start", States.STOPPED, States.STARING],
+            ["stop", [States.STANDBY, States.ERROR], States.STOPPED],
+            ["reset", States.ERROR, States.STOPPED],
+            ["start_success", States.STARING, States.STANDBY],
+            ["error", "*", States.ERROR],
+        ],
+    )
+
+    def __init__(self, config_path: str = "config.yaml"):
+        self._journal: Optional[EventJournal] = None
+        self._machine = StateMachine(
+            self.transitions, self.States.STOPPED, self._on_transition
         )
+        self._state_entered = time.perf_counter()
+
+        with STARTUP.phase("config"):
+            self._config = ConfigureReader(config_path)
+        # Hardware first, the box is usable offline before the backend is up
+        with STARTUP.phase("gpio setup"):
+            get_backend(self._config.get("hardware", DEFAULT_BACKEND))
+            self.compartments: List[Compartment] = [
+                Compartment.from_config(
+                    entry,
+                    self._config.get("id"),
+                    edge_triggered=self._config.get("lid_edge_triggered", False),
+                    debounce=self._config.get("lid_debounce", DEFAULT_DEBOUNCE),
+                    # A lid wait means someone is at the box
+                    poll_interval=1.0
+                    / self._config.get("poll_active_rate", DEFAULT_ACTIVE_RATE),
+                    lid_timeout=self._config.get("lid_timeout", DEFAULT_LID_TIMEOUT),
+                )
+                for entry in self._config.get("compartments", None) or [{}]
+            ]
+        with STARTUP.phase("reader init"):
+            self._reader = RfidReader(
+                mode=self._config.get("rfid_read_mode", DEFAULT_READ_MODE)
+            )
+            self._presence = TagPresenceTracker(
+                self._reader,
+                cooldown=self._config.get("rfid_cooldown", DEFAULT_COOLDOWN),
+                absence_grace=self._config.get(
+                    "rfid_absence_grace", DEFAULT_ABSENCE_GRACE
+                ),
+            )
+        with STARTUP.phase("backend bootstrap"):
+            # One session thread per compartment, so no door waits for another
+            self._sessions = ThreadPoolExecutor(
+                max_workers=len(self.compartments), thread_name_prefix="compartment"
+            )
+            # Authorizes all compartments in parallel, on threads of its own so
+            # that running sessions cannot hold up a tag
+            self._auth_pool = ThreadPoolExecutor(
+                max_workers=len(self.compartments), thread_name_prefix="auth"
+            )
 
-        self._reader = RfidReader()
-        self._led = LedManager()
-        self._sensor = PhotoResistor()
-        self._config = ConfigureReader()
-
-        self._authencator = Authenticator(self._config.get("backend_url"))
+            self._authencator = Authenticator(
+                self._config.get("backend_url"),
+                pool_size=self._config.get("backend_pool_size", DEFAULT_POOL_SIZE),
+                timeout=(
+                    self._config.get(
+                        "backend_connect_timeout", DEFAULT_CONNECT_TIMEOUT
+                    ),
+                    self._config.get("backend_read_timeout", DEFAULT_READ_TIMEOUT),
+                ),
+                auth_cache=AuthCache(
+                    self._config.get("auth_cache_size", DEFAULT_CACHE_SIZE),
+                    self._config.get("auth_cache_ttl", DEFAULT_POSITIVE_TTL),
+                    self._config.get("auth_cache_negative_ttl", DEFAULT_NEGATIVE_TTL),
+                ),
+                bootstrap_cache_path=self._config.get("bootstrap_cache_path", None),
+            )
+            self._outbox = Outbox(
+                self._authencator.update_box,
+                self._config.get("outbox_path", DEFAULT_OUTBOX_PATH),
+            )
+            self._session = SessionManager(
+                self._authencator,
+                default_lifetime=self._config.get(
+                    "session_lifetime", DEFAULT_SESSION_LIFETIME
+                ),
+                refresh_margin=self._config.get(
+                    "session_refresh_margin", DEFAULT_REFRESH_MARGIN
+                ),
+            )
+            journal_path = self._config.get("journal_path", DEFAULT_JOURNAL_PATH)
+            if journal_path:
+                self._journal = EventJournal(
+                    journal_path,
+                    self._config.get("journal_segment_size", DEFAULT_SEGMENT_SIZE),
+                    self._config.get("journal_retention_days", DEFAULT_RETENTION_DAYS),
+                )
+            # Compartments with an open lid reported as unexpected, see `check_lid`
+            self._unexpected_open: Set[str] = set()
+            self.poll_scheduler = PollScheduler(**_poll_settings(self._config.snapshot))
+            self._grants: Dict[str, GrantIndex] = {}
+            self._grant_syncs: List[GrantSync] = []
+            if self._config.get("offline_grants", False):
+                self._init_grants()
+            self._commands: Optional[CommandChannel] = None
+            if self._config.get("command_channel", False):
+                self._commands = CommandChannel(
+                    lambda cursor: self._authencator.open_command_stream(
+                        self._config.get("id"),
+                        cursor,
+                        self._config.get(
+                            "command_stream_timeout", DEFAULT_STREAM_TIMEOUT
+                        ),
+                    ),
+                    self.handle_command,
+                    self._config.get(
+                        "command_cursor_path", DEFAULT_COMMAND_CURSOR_PATH
+                    ),
+                )
+        self._config.subscribe(self._on_config_change)
+        watch_interval = self._config.get(
+            "config_watch_interval", DEFAULT_WATCH_INTERVAL
+        )
+        if watch_interval > 0:
+            self._config.watch(watch_interval)
         logger.info("Successfully initialized box manager")
 
+    def _init_grants(self):
+        path = self._config.get("grant_index_path", DEFAULT_GRANT_INDEX_PATH)
+        for compartment in self.compartments:
+            if len(self.compartments) > 1:
+                root, ext = os.path.splitext(path)
+                compartment_path = "{}-{}{}".format(root, compartment.id, ext)
+            else:
+                compartment_path = path
+            index = GrantIndex(
+                compartment.id, self._authencator.grant_verifier, compartment_path
+            )
+            self._grants[compartment.id] = index
+            self._grant_syncs.append(
+                GrantSync(
+                    index,
+                    lambda box_id=compartment.id: self._authencator.fetch_grants(
+                        box_id
+                    ),
+                    self._config.get("grant_sync_interval", DEFAULT_SYNC_INTERVAL),
+                )
+            )
+
+    @property
+    def state(self) -> "BoxManager.States":
+        """Returns the current state of the state machine."""
+        return cast(BoxManager.States, self._machine.state)
+
+    @property
+    def state_seconds(self) -> float:
+        """Returns the seconds since the last state change."""
+        return time.perf_counter() - self._state_entered
+
+    def status(self) -> Dict[str, Any]:
+        """Returns the state of the box and its compartments, for diagnostics."""
+        return {
+            "state": self.state.name,
+            "state_seconds": self.state_seconds,
+            "compartments": {
+                c.id: {"state": c.state.name, "state_seconds": c.state_seconds}
+                for c in self.compartments
+            },
+            "poll_wakeups": self.poll_scheduler.wakeups,
+            "poll_duty_cycle": self.poll_scheduler.duty_cycle,
+        }
+
+    @property
+    def refresh_interval(self) -> float:
+        """Returns the nominal main loop period in seconds. The polling loops
+        sleep for `poll_scheduler.interval()` instead.
+        """
+        return self._config.snapshot.refresh_interval
+
+    def _on_config_change(self, old: ConfigSnapshot, new: ConfigSnapshot):
+        # In-flight sessions keep running, new values apply to the next one
+        for compartment in self.compartments:
+            compartment.lid_timeout = new.get("lid_timeout", DEFAULT_LID_TIMEOUT)
+        self._authencator.timeout = (
+            new.get("backend_connect_timeout", DEFAULT_CONNECT_TIMEOUT),
+            new.get("backend_read_timeout", DEFAULT_READ_TIMEOUT),
+        )
+        self.poll_scheduler.configure(**_poll_settings(new))
+        changed = [
+            key for key in _RESTART_ENTRIES if old.get(key, None) != new.get(key, None)
+        ]
+        if changed:
+            logger.warning(
+                "Changes to {} take effect after a restart.".format(  # pylint: disable=logging-format-interpolation
+                    ", ".join(changed)
+                )
+            )
+
+    def idle(self) -> bool:
+        """Returns whether no customer session is in progress."""
+        return all(c.is_idle() for c in self.compartments)
+
+    def _on_transition(self, transition: Transition):
+        now = time.perf_counter()
+        source, dest = transition.source.name, transition.dest.name
+        _TRANSITIONS.labels(transition.trigger, source, dest).inc()
+        _STATE_SECONDS.labels(source).observe(now - self._state_entered)
+        self._state_entered = now
+        self._record(
+            EventKind.TRANSITION,
+            detail="{}: {} -> {}".format(transition.trigger, source, dest),
+        )
+
+    def _record(  # pylint: disable=too-many-arguments
+        self,
+        kind: EventKind,
+        compartment: str = "",
+        uid: Optional[int] = None,
+        token: Optional[str] = None,
+        detail: str = "",
+    ):
+        if self._journal is None:
+            return
+        try:
+            self._journal.append(kind, compartment, uid, token, detail)
+        except (OSError, ValueError) as error:
+            # A full or failing SD card must not stop the box
+            logger.error("Journal append failed: %s", error)
+
     def reset(self):
         """Resets box manager state machine."""
-        if not self._machine.is_ERROR():
+        if self._machine.try_trigger("reset") is None:
             raise BoxManagerError(
                 "cannot reset box manager when status {} != ERROR".format(
                     self._machine.state
                 )
             )
-        with self._lock:
-            try:
-                pass
-            finally:
-                self._machine.reset()
 
-    def start(self, timeout: int = 60) -> bool:
-        """Try to start box manager with given parameters; will block the thread until return."""
-        with self._lock:
+    def _login(self) -> bool:
+        with STARTUP.phase("login"):
+            logged_in = self._authencator.login(
+                self._config.get("id"), self._config.get("password")
+            )
+        if logged_in:
+            self._machine.trigger("start_success")
+            self._outbox.start()
+            self._session.start()
+            for grant_sync in self._grant_syncs:
+                grant_sync.start()
+            if self._commands is not None:
+                self._commands.start()
+            logger.info("Successfully started box manager")
+            STARTUP.finish()
+            return True
+        logger.error("Fail to register delivery box to backend!!")
+        return False
+
+    def _login_until_ready(self, max_backoff: float = 60.0):
+        backoff = 1.0
+        while True:
             try:
-                if not self._machine.is_STOPPED():
-                    return True
-                self._machine.start()
-                # TODO start the reader and other tasks
-            except Exception as e:  # pylint: disable=invalid-name
+                if self._login():
+                    return
+            except Exception as e:  # pylint: disable=invalid-name,broad-except
                 logger.error(
-                    "Start error: {}".format(
+                    "Backend bootstrap failed: {}".format(  # pylint: disable=logging-format-interpolation
                         e
-                    )  # pylint: disable=logging-format-interpolation
+                    )
                 )
-                logger.error(traceback.format_exc())
-                self._machine.error()
-                raise e
-
-            if self._authencator.login(
-                self._config.get("id"), self._config.get("password")
-            ):
-                self._machine.start_success()
-                logger.info("Successfully started box manager")
-                return True
-            else:
-                logger.error("Fail to register delivery box to backend!!")
-                return False
+            clock.sleep(backoff)
+            backoff = min(max_backoff, backoff * 2)
 
-    @staticmethod
-    def _check_closed_timeout(start_time: float, timeout: float = 10.0) -> bool:
-        """Checks if the box is closed within time.
+    def start(self, background: Optional[bool] = None) -> bool:
+        """Try to start box manager with given parameters; will block the thread until return.
 
         Args:
-            timeout (float, optional): Timeout. Defaults to 10.0.
+            background (Optional[bool], optional): return right after the hardware
+                is up and log in to the backend in the background, retrying until it
+                succeeds. Defaults to the `backend_bootstrap_background` config entry.
 
         Returns:
-            bool: result
+            bool: whether the box manager started (or is starting in background)
         """
-        return time.time() >= (start_time + timeout)
+        if background is None:
+            background = self._config.get("backend_bootstrap_background", False)
+        try:
+            # Atomic, a concurrent start() finds the box STARING and returns
+            if self._machine.try_trigger("start") is None:
+                return True
+            # TODO start the reader and other tasks
+        except Exception as e:  # pylint: disable=invalid-name
+            logger.error(
+                "Start error: {}".format(
+                    e
+                )  # pylint: disable=logging-format-interpolation
+            )
+            logger.error(traceback.format_exc())
+            self._machine.trigger("error")
+            raise e
+
+        if background:
+            Thread(
+                target=self._login_until_ready, name="bootstrap", daemon=True
+            ).start()
+            return True
+        return self._login()
+
+    def _auth_error(self, compartments: List[Compartment]):
+        # Played by the LED engine, the caller goes back to polling at once
+        for compartment in compartments:
+            compartment.flash_red()
+
+    def _authorize(self, compartment: Compartment, token: str) -> bool:
+        # A valid local grant authorizes without the backend
+        grants = self._grants.get(compartment.id)
+        flag = grants.lookup(token) if grants is not None else None
+        if flag is None:
+            flag = self._authencator.auth(compartment.id, token)
+        return flag
+
+    def _run_session(
+        self, compartment: Compartment, uid: Optional[int], token: Optional[str]
+    ):
+        def on_event(event: str):
+            self._record(EventKind[event.upper()], compartment.id, uid, token)
+
+        # Remote opens carry no token, there is no pickup to report
+        if compartment.block_until_closed(on_event) and token is not None:
+            # Reported in the background, so the box is ready for the next tag
+            self._authencator.auth_cache.invalidate(compartment.id, token)
+            self._outbox.put(compartment.id, token)
+            grants = self._grants.get(compartment.id)
+            if grants is not None:
+                grants.consume(token)
+
+    @staticmethod
+    def _on_session_done(future):
+        if future.exception() is not None:
+            logger.error(
+                "Compartment session failed: {}".format(  # pylint: disable=logging-format-interpolation
+                    future.exception()
+                )
+            )
 
-    def _warn_timeout(self):
-        """Light the red led and set state machine to timeout statue."""
-        with self._lock:
-            self._machine.open_timeout()
-        self._led.turn_on_red()
+    @_OPEN_BOX_SECONDS.time()
+    def open_box(self, uid, token) -> bool:
+        """Opens every idle compartment `token` is authorized for. Returns once
+            the compartments are unlocked, the customer sessions run in the
+            background.
 
-    def _block_until_closed(self, timeout: float = 10.0):
-        """Blocked checking if the box is closed within time. Makes red light flash
-            if not. Unblocks until the box is properly closed. Should be called with
-            green LED on.
+        Returns:
+            bool: whether any compartment was opened
+        """
+        idle = [c for c in self.compartments if c.is_idle()]
+        if self._machine.state is not self.States.STANDBY or not idle:
+            logger.warning(
+                "Tag {} ignored in state {}.".format(  # pylint: disable=logging-format-interpolation
+                    uid, self._machine.state
+                )
+            )
+            self._record(EventKind.TAG_IGNORED, uid=uid, token=token)
+            # Nothing idle, the tag is still answered
+            self._auth_error(idle or self.compartments)
+            return False
+        if not token or not token.strip():
+            # Never ask the backend about a tag whose text could not be read
+            logger.warning("Tag %s ignored, it has no token.", uid)
+            self._record(EventKind.TAG_IGNORED, uid=uid, detail="no token")
+            self._auth_error(idle)
+            return False
+        # TODO Auth should return tuple(flag: bool, role: Union[Enum[Customer|Deliever]])
+        # (flag, role) = flag and auth.authentication()
+        if len(idle) == 1:
+            flags = [self._authorize(idle[0], token)]
+        else:
+            flags = list(self._auth_pool.map(lambda c: self._authorize(c, token), idle))
+        granted = [c for c, flag in zip(idle, flags) if flag]
+        for compartment, flag in zip(idle, flags):
+            kind = EventKind.AUTH_GRANTED if flag else EventKind.AUTH_DENIED
+            self._record(kind, compartment.id, uid, token)
+
+        if not granted:
+            logger.error("Authentication failed.")
+            self._auth_error(idle)
+            return False
+        opened = False
+        for compartment in granted:
+            if not compartment.is_closed():
+                logger.error(
+                    "Compartment {} was opened unexpectedly.".format(  # pylint: disable=logging-format-interpolation
+                        compartment.id
+                    )
+                )
+            if not compartment.try_open():
+                continue
+            logger.info(
+                "User {}, uid={} is authorized to open {}".format(  # pylint: disable=logging-format-interpolation
+                    uid, token, compartment.id
+                )
+            )
+            self._sessions.submit(
+                self._run_session, compartment, uid, token
+            ).add_done_callback(self._on_session_done)
+            opened = True
+        return opened
+
+    def _compartment(self, compartment_id: Optional[str]) -> Optional[Compartment]:
+        if compartment_id is None:
+            return self.compartments[0]
+        for compartment in self.compartments:
+            if compartment.id == compartment_id:
+                return compartment
+        return None
+
+    def handle_command(self, command: Dict[str, Any]) -> bool:
+        """Executes a command pushed by the backend.
+
+        Supported commands:
+            {"type": "open", "compartment": <id>}: opens a compartment, the first
+                one if no id is given
+            {"type": "reset", "compartment": <id>}: leaves the ERROR state, of the
+                box if no id is given
+            {"type": "reload_config"}: reads config.yaml again
 
         Args:
-            timeout (float, optional): _description_. Defaults to 10.0.
+            command (Dict[str, Any]): the command
 
         Returns:
-            bool: if box is opened before it closes
+            bool: whether the command was executed
         """
-        if not self._led.get_status_green():
-            self._box_error()
-
-        start_time: float = time.time()
-        opened_before: bool = False
-        # If the box is never opened
-        logger.info("Waiting for box open.")
-        while self._sensor.is_closed():
-            time.sleep(BOX_STATUS_REFRESH_INTERVAL)
-            if self._check_closed_timeout(start_time, timeout):
-                with self._lock:
-                    self._machine.closed()
-                self._led.turn_off_green()
-                logger.info("Box did not open within timeout. Auth cancelled.")
+        kind = command.get("type")
+        if kind == "open":
+            compartment = self._compartment(command.get("compartment"))
+            if (
+                compartment is None
+                or self._machine.state is not self.States.STANDBY
+                or not compartment.try_open()
+            ):
                 return False
-            logger.debug("box opened: {}".format(self._sensor.is_opened()))
-            if self._sensor.is_opened():
-                opened_before = True
-                logger.info("Box opened.")
-                break
-        self._led.turn_off_green()
-        # Resets the start time once box opened
-        start_time = time.time()
-        # The open permission is expired, i.e.
-        # the box is either opened or the timeout is reached.
-        while not self._sensor.is_closed():
-            if self._check_closed_timeout(start_time, timeout):
-                logger.error("Box not close within timeout!!")
-                if not self._led.get_status_red():
-                    self._led.turn_on_red()
-            time.sleep(BOX_STATUS_REFRESH_INTERVAL)
-        # Finally closes
-        with self._lock:
-            self._machine.closed()
-        if self._led.get_status_red():
-            self._led.turn_off_red()
-        if opened_before:
-            logger.info("Box closed.")
+            logger.info(
+                "Compartment {} opened remotely.".format(  # pylint: disable=logging-format-interpolation
+                    compartment.id
+                )
+            )
+            self._record(EventKind.REMOTE_OPEN, compartment.id)
+            self._sessions.submit(
+                self._run_session, compartment, None, None
+            ).add_done_callback(self._on_session_done)
             return True
+        if kind == "reset":
+            if command.get("compartment") is not None:
+                compartment = self._compartment(command["compartment"])
+                return compartment is not None and compartment.reset()
+            if self._machine.state is not self.States.ERROR:
+                return False
+            self.reset()
+            return self.start()
+        if kind == "reload_config":
+            return self._config.reload()
+        logger.warning(
+            "Unknown command type {}.".format(  # pylint: disable=logging-format-interpolation
+                kind
+            )
+        )
         return False
 
-    def _box_error(self):
-        # with self._lock:
-        # self._machine.error()
-        self._led.turn_on_red()
-        time.sleep(1.0)
-        self._led.turn_off_red()
-
-    def _auth_error(self):
-        self._led.turn_on_red()
-        time.sleep(1.0)
-        self._led.turn_off_red()
+    def check_lid(self) -> bool:
+        """Checks the lids while nobody is authorized to open them. Open lids
+        and customer sessions keep the polling rate up.
 
-    def open_box(self, uid, token) -> bool:
-        """Transit status to CUSTOMER_OPEN."""
-        # TODO authentication, and sets the flag
-        if not self._sensor.is_closed():
-            with self._lock:
-                self._box_error()
-            logger.error("Box was opened unexpectedly.")
-        # TODO Auth should return tuple(flag: bool, role: Union[Enum[Customer|Deliever]])
-        # (flag, role) = flag and auth.authentication()
-        # DELETE ME when auth is implemented
-        # (flag, role) = True, Roles.CUSTOMER
-        flag = self._authencator.auth(self._config.get("id"), token)
+        Returns:
+            bool: whether the lids of all idle compartments are closed
+        """
+        closed = True
+        active = False
+        for compartment in self.compartments:
+            if not compartment.is_idle():
+                active = True
+            elif not compartment.is_closed():
+                # Logged on every tick while the lid is open, rate limited by
+                # the log pipeline, so it is formatted lazily
+                logger.error("Compartment %s was opened without token!", compartment.id)
+                closed = False
+                if compartment.id not in self._unexpected_open:
+                    self._unexpected_open.add(compartment.id)
+                    self._record(EventKind.UNEXPECTED_OPEN, compartment.id)
+                continue
+            self._unexpected_open.discard(compartment.id)
+        if active or not closed:
+            self.poll_scheduler.activity()
+        return closed
+
+    def read_tag(self) -> Tuple[Optional[int], Optional[str]]:
+        """Polls the reader once. A tag staying on the reader is returned only on
+            its arrival.
 
-        if not flag:
-            logger.error("Authentication failed.")
-            self._box_error()
-            return False
-        logger.info("User {}, uid={} is authorized to open".format(uid, token))
-        with self._lock:
-            self._machine.opened()
-        self._led.turn_on_green()
-        if self._block_until_closed():
-            self._authencator.update_box(self._config.get("id"), token)
-        return True
+        Returns:
+            Tuple[Optional[int], Optional[str]]: the uid and the stripped token of
+            a newly arrived tag, None if no tag arrived.
+        """
+        events = self._presence.poll()
+        if events:
+            self.poll_scheduler.activity()
+        for event in events:
+            if event.kind == TagEventKind.ARRIVED:
+                return event.uid, event.token
+        return None, None
 
     def routine_loop(self):
-        """Main loop of box manager."""
-        if self._sensor.is_opened():
-            logger.error("Box was oopened without token!")
-        # TODO put requests here to read from backend for commands
-        uid, token = self._reader.read()
+        """Main loop of box manager. Backend commands arrive through the command
+        channel, not by polling here.
+        """
+        self.check_lid()
+        uid, token = self.read_tag()
         if uid is not None:
-            self.open_box(uid, token.strip())
+            self.open_box(uid, token)
 
     # exc_type: type, exc_value: Exception, tb: traceback.TracebackException
     def __exit__(self, *args):
         self._reader.__exit__(*args)
-        self._led.__exit__(*args)
-        # TODO also sensor manager
+        self._config.stop_watching()
+        self._sessions.shutdown(wait=False)
+        self._auth_pool.shutdown(wait=False)
+        for compartment in self.compartments:
+            compartment.__exit__(*args)
+        self._session.stop()
+        if self._commands is not None:
+            self._commands.stop()
+        for grant_sync in self._grant_syncs:
+            grant_sync.stop()
+        self._outbox.stop()
+        self._authencator.close()
+        if self._journal is not None:
+            self._journal.close()
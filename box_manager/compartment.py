@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+
+import enum
+import logging
+import time
+from typing import Any, Callable, Dict, Optional, cast
+from box_manager.led_manager import (
+    LedManager,
+    PIN_LED_GREEN,
+    PIN_LED_RED,
+    PRIORITY_ERROR,
+)
+from box_manager.photo_resistor import (
+    PhotoResistor,
+    PIN_PHOTO_RESISTOR,
+    DEFAULT_DEBOUNCE,
+    DEFAULT_POLL_INTERVAL,
+)
+from utils.metrics import REGISTRY
+from utils.state_machine import StateMachine, Transition, TransitionTable
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LID_TIMEOUT = 10.0
+# Pins of a compartment entry of config.yaml that does not set them
+DEFAULT_PINS = {
+    "pin_green": PIN_LED_GREEN,
+    "pin_red": PIN_LED_RED,
+    "pin_lid": PIN_PHOTO_RESISTOR,
+}
+
+_LID_SESSION_SECONDS = REGISTRY.histogram(
+    "box_lid_session_seconds", "Duration of _block_until_closed."
+)
+_TRANSITIONS = REGISTRY.counter(
+    "compartment_state_transitions_total",
+    "Compartment state machine transitions.",
+    ["compartment", "trigger", "source", "dest"],
+)
+_STATE_SECONDS = REGISTRY.histogram(
+    "compartment_state_duration_seconds",
+    "Time a compartment spent in a state before leaving it.",
+    ["compartment", "state"],
+)
+
+
+class Compartment:
+    """One door of the box with its own lid sensor, LED pair and state machine.
+
+    A compartment is registered at the backend as a box of its own, i.e. orders
+    are placed into and authorized against `compartment_id`.
+
+    Args:
+        compartment_id (str): backend box id of the compartment
+        pin_green (int, optional): green LED pin. Defaults to PIN_LED_GREEN.
+        pin_red (int, optional): red LED pin. Defaults to PIN_LED_RED.
+        pin_lid (int, optional): lid sensor pin. Defaults to PIN_PHOTO_RESISTOR.
+        edge_triggered (bool, optional): see `PhotoResistor`. Defaults to False.
+        debounce (float, optional): see `PhotoResistor`. Defaults to
+            DEFAULT_DEBOUNCE.
+        poll_interval (float, optional): see `PhotoResistor`. Defaults to
+            DEFAULT_POLL_INTERVAL.
+        lid_timeout (float, optional): seconds the customer has to open and to
+            close the lid. Defaults to DEFAULT_LID_TIMEOUT.
+    """
+
+    class States(enum.Enum):
+        """State of SFM"""
+
+        ERROR = -1
+        STANDBY = 1
+        OPEN = 3
+        TIMEOUT = 4
+
+    transitions = TransitionTable(
+        States,
+        [
+            ["error", "*", States.ERROR],
+            ["reset", States.ERROR, States.STANDBY],
+            ["opened", States.STANDBY, States.OPEN],
+            ["open_timeout", States.OPEN, States.TIMEOUT],
+            ["closed", [States.OPEN, States.TIMEOUT], States.STANDBY],
+        ],
+    )
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self,
+        compartment_id: str,
+        pin_green: int = PIN_LED_GREEN,
+        pin_red: int = PIN_LED_RED,
+        pin_lid: int = PIN_PHOTO_RESISTOR,
+        edge_triggered: bool = False,
+        debounce: float = DEFAULT_DEBOUNCE,
+        poll_interval: float = DEFAULT_POLL_INTERVAL,
+        lid_timeout: float = DEFAULT_LID_TIMEOUT,
+    ):
+        self.id = compartment_id  # pylint: disable=invalid-name
+        self.lid_timeout = lid_timeout
+        self._machine = StateMachine(
+            self.transitions, self.States.STANDBY, self._on_transition
+        )
+        self._state_entered = time.perf_counter()
+        self._led = LedManager(pin_green, pin_red)
+        self._sensor = PhotoResistor(
+            pin_lid,
+            edge_triggered=edge_triggered,
+            debounce=debounce,
+            poll_interval=poll_interval,
+        )
+
+    @classmethod
+    def from_config(
+        cls, entry: Dict[str, Any], default_id: str, **kwargs
+    ) -> "Compartment":
+        """Creates a compartment from one `compartments` entry of config.yaml.
+
+        Args:
+            entry (Dict[str, Any]): with optional keys id, pin_green, pin_red and
+                pin_lid
+            default_id (str): backend box id if the entry has none
+            **kwargs: passed to the constructor
+
+        Returns:
+            Compartment: the compartment
+        """
+        pins = {key: entry.get(key, default) for key, default in DEFAULT_PINS.items()}
+        return cls(entry.get("id", default_id), **pins, **kwargs)
+
+    @property
+    def state(self) -> "Compartment.States":
+        """Returns the current state of the state machine."""
+        return cast(Compartment.States, self._machine.state)
+
+    @property
+    def state_seconds(self) -> float:
+        """Returns the seconds since the last state change."""
+        return time.perf_counter() - self._state_entered
+
+    def _on_transition(self, transition: Transition):
+        now = time.perf_counter()
+        source = transition.source.name
+        _TRANSITIONS.labels(
+            self.id, transition.trigger, source, transition.dest.name
+        ).inc()
+        _STATE_SECONDS.labels(self.id, source).observe(now - self._state_entered)
+        self._state_entered = now
+
+    def is_idle(self) -> bool:
+        """Returns whether the compartment waits for a customer."""
+        return self._machine.state is self.States.STANDBY
+
+    def is_closed(self) -> bool:  # pylint: disable=missing-function-docstring
+        return self._sensor.is_closed()
+
+    def try_open(self) -> bool:
+        """Unlocks the compartment for a customer and lights the green LED.
+
+        Returns:
+            bool: False if the compartment is not idle
+        """
+        if self._machine.try_trigger("opened") is None:
+            return False
+        self._led.turn_on_green()
+        return True
+
+    def reset(self) -> bool:
+        """Leaves the ERROR state.
+
+        Returns:
+            bool: False if the compartment is not in ERROR
+        """
+        return self._machine.try_trigger("reset") is not None
+
+    def flash_red(self, duration: float = 1.0):
+        """Flashes the red LED for `duration` seconds, without blocking."""
+        self._led.play_red("flash", PRIORITY_ERROR, duration=duration)
+
+    def _warn_timeout(self):
+        """Light the red led and set state machine to timeout statue."""
+        self._machine.trigger("open_timeout")
+        self._led.turn_on_red()
+
+    @_LID_SESSION_SECONDS.time()
+    def block_until_closed(
+        self, on_event: Optional[Callable[[str], None]] = None
+    ) -> bool:
+        """Blocked checking if the box is closed within time. Makes red light flash
+            if not. Unblocks until the box is properly closed. Should be called
+            after `try_open`.
+
+        Args:
+            on_event (Optional[Callable[[str], None]], optional): called with
+                "opened", "expired" (not opened within timeout), "lid_timeout"
+                (not closed within timeout) and "closed" as the session
+                progresses. Defaults to None.
+
+        Returns:
+            bool: if box is opened before it closes
+        """
+        timeout = self.lid_timeout
+        notify = on_event or (lambda event: None)
+        if not self._led.get_status_green():
+            self.flash_red()
+
+        opened_before: bool = False
+        # If the box is never opened
+        logger.info(
+            "Waiting for compartment {} to open.".format(  # pylint: disable=logging-format-interpolation
+                self.id
+            )
+        )
+        if self._sensor.is_closed():
+            if not self._sensor.wait_for_state(closed=False, timeout=timeout):
+                self._machine.trigger("closed")
+                self._led.turn_off_green()
+                logger.info(
+                    "Compartment {} did not open within timeout. Auth cancelled.".format(  # pylint: disable=logging-format-interpolation
+                        self.id
+                    )
+                )
+                notify("expired")
+                return False
+            opened_before = True
+            notify("opened")
+            logger.info(
+                "Compartment {} opened.".format(  # pylint: disable=logging-format-interpolation
+                    self.id
+                )
+            )
+        self._led.turn_off_green()
+        # The open permission is expired, i.e.
+        # the box is either opened or the timeout is reached.
+        if not self._sensor.wait_for_state(closed=True, timeout=timeout):
+            logger.error(
+                "Compartment {} not closed within timeout!!".format(  # pylint: disable=logging-format-interpolation
+                    self.id
+                )
+            )
+            notify("lid_timeout")
+            self._warn_timeout()
+            self._sensor.wait_for_state(closed=True)
+        # Finally closes
+        self._machine.trigger("closed")
+        if self._led.get_status_red():
+            self._led.turn_off_red()
+        notify("closed")
+        if opened_before:
+            logger.info(
+                "Compartment {} closed.".format(  # pylint: disable=logging-format-interpolation
+                    self.id
+                )
+            )
+            return True
+        return False
+
+    def __exit__(self, *args):
+        self._led.__exit__(*args)
+        self._sensor.__exit__(*args)
@@ -1,57 +1,268 @@
-import time
-from typing import Dict
+from threading import Condition, Event, Thread
+from typing import Callable, Dict, NamedTuple, Optional, Tuple, Union
 import logging
-import RPi.GPIO as GPIO
-from utils.manager_base import ManagerBase
+from hardware.backend import get_backend
+from utils.manager_base import DeviceBase
+from utils import clock
+from utils.metrics import REGISTRY
 
 logger = logging.getLogger(__name__)
 
 PIN_LED_GREEN = 11
 PIN_LED_RED = 12
 
+PRIORITY_INFO = 0
+PRIORITY_WARNING = 1
+PRIORITY_ERROR = 2
 
-class LedManager(ManagerBase):
-    """LED Manager. A singleton class managing LED status."""
+_PATTERNS_PLAYED = REGISTRY.counter(
+    "led_patterns_total", "LED patterns by name and outcome.", ["pattern", "outcome"]
+)
+
+
+class Pattern(NamedTuple):
+    """LED pattern: (on, seconds) steps, played `repeat` times, None repeats
+    until cancelled"""
+
+    name: str
+    steps: Tuple[Tuple[bool, float], ...]
+    repeat: Optional[int] = 1
+
+
+def flash(duration: float = 1.0) -> Pattern:
+    """On once for `duration` seconds."""
+    return Pattern("flash", ((True, duration),))
+
+
+def blink(count: int = 3, on: float = 0.2, off: float = 0.2) -> Pattern:
+    """On and off `count` times."""
+    return Pattern("blink", ((True, on), (False, off)), count)
+
+
+def pulse(on: float = 0.1, off: float = 0.9) -> Pattern:
+    """Short flashes until cancelled."""
+    return Pattern("pulse", ((True, on), (False, off)), None)
+
+
+PATTERNS: Dict[str, Callable[..., Pattern]] = {
+    "flash": flash,
+    "blink": blink,
+    "pulse": pulse,
+}
+
+
+class Playback:
+    """A pattern being played on one LED, returned by `LedManager.play`."""
+
+    def __init__(
+        self, manager: "LedManager", pin: int, pattern: Pattern, priority: int
+    ):
+        self.pin = pin
+        self.pattern = pattern
+        self.priority = priority
+        self._manager = manager
+        self._step = 0
+        self._played = 0
+        self.deadline = clock.monotonic() + pattern.steps[0][1]
+        self._done = Event()
+
+    @property
+    def level(self) -> bool:  # pylint: disable=missing-function-docstring
+        return self.pattern.steps[self._step][0]
+
+    def advance(self) -> bool:
+        """Moves to the next step.
+
+        Returns:
+            bool: False if the pattern is over
+        """
+        self._step += 1
+        if self._step == len(self.pattern.steps):
+            self._played += 1
+            if self.pattern.repeat is not None and self._played >= self.pattern.repeat:
+                return False
+            self._step = 0
+        # Relative to the previous deadline, so that the pattern does not drift
+        self.deadline += self.pattern.steps[self._step][1]
+        return True
+
+    def finish(self):  # pylint: disable=missing-function-docstring
+        self._done.set()
+
+    def done(self) -> bool:  # pylint: disable=missing-function-docstring
+        return self._done.is_set()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Waits for the pattern to end or to be cancelled.
+
+        Args:
+            timeout (Optional[float], optional): simulated seconds. Defaults to
+                None, no timeout.
+
+        Returns:
+            bool: whether the pattern ended
+        """
+        return self._done.wait(clock.to_real(timeout))
+
+    def cancel(self):
+        """Stops the pattern, the LED returns to its steady state."""
+        self._manager.cancel(self)
+
+
+class LedManager(DeviceBase):
+    """LED Manager. Manages the green/red LED pair of one compartment.
+
+    `turn_on_*` and `turn_off_*` set the steady state of an LED. Patterns
+    (`play`) are played on top of it by a background thread, without blocking
+    the caller; when a pattern ends or is cancelled, the LED returns to its
+    steady state. Each LED plays one pattern at a time: a new pattern replaces
+    the current one unless the current one has a higher priority.
+    """
 
     def __init__(self, pin_green: int = PIN_LED_GREEN, pin_red: int = PIN_LED_RED):
         self._pin_green = pin_green
         self._pin_red = pin_red
         self._leds_on: Dict[int, bool] = {self._pin_green: False, self._pin_red: False}
+        self._gpio = get_backend().gpio()
+
+        self._gpio.setmode(self._gpio.BOARD)
+        self._gpio.setwarnings(False)
+        self._gpio.setup(self._pin_green, self._gpio.OUT, initial=self._gpio.LOW)
+        self._gpio.setup(self._pin_red, self._gpio.OUT, initial=self._gpio.LOW)
+
+        self._cond = Condition()
+        self._levels: Dict[int, bool] = dict(self._leds_on)
+        self._playbacks: Dict[int, Playback] = {}
+        self._engine: Optional[Thread] = None
+        self._stopped = False
 
-        GPIO.setmode(GPIO.BOARD)
-        GPIO.setwarnings(False)
-        GPIO.setup(PIN_LED_GREEN, GPIO.OUT, initial=GPIO.LOW)
-        GPIO.setup(PIN_LED_RED, GPIO.OUT, initial=GPIO.LOW)
+    def _output(self, pin: int, level: bool):
+        # Called with self._cond held
+        if self._levels[pin] != level:
+            self._gpio.output(pin, self._gpio.HIGH if level else self._gpio.LOW)
+            self._levels[pin] = level
 
     def _turn_on(self, pin: int):
-        if self._get_led_status(pin):
-            logger.error(
-                "Turning LED {} ON while it is already ON.".format(  # pylint: disable=logging-format-interpolation
-                    pin
+        with self._cond:
+            if self._get_led_status(pin):
+                logger.error(
+                    "Turning LED {} ON while it is already ON.".format(  # pylint: disable=logging-format-interpolation
+                        pin
+                    )
                 )
-            )
-        GPIO.output(pin, GPIO.HIGH)
-        self._leds_on[pin] = True
+            self._leds_on[pin] = True
+            if pin not in self._playbacks:
+                self._output(pin, True)
 
     def _turn_off(self, pin: int):
-        if not self._get_led_status(pin):
-            logger.error(
-                "Turning LED {} OFF while it is already OFF.".format(  # pylint: disable=logging-format-interpolation
-                    pin
+        with self._cond:
+            if not self._get_led_status(pin):
+                logger.error(
+                    "Turning LED {} OFF while it is already OFF.".format(  # pylint: disable=logging-format-interpolation
+                        pin
+                    )
                 )
-            )
-        GPIO.output(pin, GPIO.LOW)
-        self._leds_on[pin] = False
+            self._leds_on[pin] = False
+            if pin not in self._playbacks:
+                self._output(pin, False)
 
     def _get_led_status(self, pin: int):
         return self._leds_on[pin]
 
-    def light_led_with_seconds(
-        self, pin: int, sec: float
-    ):  # pylint: disable=missing-function-docstring
-        self._turn_on(pin)
-        time.sleep(sec)
-        self._turn_off(pin)
+    def _end(self, playback: Playback, outcome: str):
+        # Called with self._cond held
+        del self._playbacks[playback.pin]
+        self._output(playback.pin, self._leds_on[playback.pin])
+        playback.finish()
+        _PATTERNS_PLAYED.labels(playback.pattern.name, outcome).inc()
+
+    def _run(self):
+        with self._cond:
+            while not self._stopped:
+                now = clock.monotonic()
+                for playback in list(self._playbacks.values()):
+                    while playback.deadline <= now:
+                        if not playback.advance():
+                            self._end(playback, "completed")
+                            break
+                    else:
+                        self._output(playback.pin, playback.level)
+                deadline = min(
+                    (p.deadline for p in self._playbacks.values()), default=None
+                )
+                timeout = None if deadline is None else max(0.0, deadline - now)
+                self._cond.wait(clock.to_real(timeout))
+
+    def play(
+        self,
+        pin: int,
+        pattern: Union[str, Pattern],
+        priority: int = PRIORITY_INFO,
+        **params,
+    ) -> Optional[Playback]:
+        """Plays a pattern on an LED in the background.
+
+        Args:
+            pin (int): LED pin
+            pattern (Union[str, Pattern]): pattern, or the name of one in
+                `PATTERNS` created with `params`
+            priority (int, optional): a pattern is only replaced by one of the
+                same or a higher priority. Defaults to PRIORITY_INFO.
+
+        Returns:
+            Optional[Playback]: the playing pattern, None if a pattern of higher
+            priority is playing
+        """
+        if isinstance(pattern, str):
+            pattern = PATTERNS[pattern](**params)
+        with self._cond:
+            current = self._playbacks.get(pin)
+            if current is not None:
+                if current.priority > priority:
+                    _PATTERNS_PLAYED.labels(pattern.name, "rejected").inc()
+                    return None
+                self._end(current, "replaced")
+            playback = Playback(self, pin, pattern, priority)
+            self._playbacks[pin] = playback
+            self._output(pin, playback.level)
+            if self._engine is None:
+                self._engine = Thread(target=self._run, name="led", daemon=True)
+                self._engine.start()
+            self._cond.notify()
+        return playback
+
+    def play_red(
+        self, pattern: Union[str, Pattern], priority: int = PRIORITY_INFO, **params
+    ) -> Optional[Playback]:
+        """Plays a pattern on the red LED, see `play`."""
+        return self.play(self._pin_red, pattern, priority, **params)
+
+    def play_green(
+        self, pattern: Union[str, Pattern], priority: int = PRIORITY_INFO, **params
+    ) -> Optional[Playback]:
+        """Plays a pattern on the green LED, see `play`."""
+        return self.play(self._pin_green, pattern, priority, **params)
+
+    def cancel(self, playback: Union[Playback, int]):
+        """Stops a pattern, or the pattern playing on a pin.
+
+        Args:
+            playback (Union[Playback, int]): pattern returned by `play`, or a pin
+        """
+        with self._cond:
+            if isinstance(playback, Playback):
+                current = self._playbacks.get(playback.pin)
+                if current is not playback:
+                    return
+            else:
+                current = self._playbacks.get(playback)
+            if current is not None:
+                self._end(current, "cancelled")
+                self._cond.notify()
+
+    def light_led_with_seconds(self, pin: int, sec: float) -> Optional[Playback]:
+        """Lights an LED for `sec` seconds without blocking, see `play`."""
+        return self.play(pin, flash(sec))
 
     def turn_on_red(self):  # pylint: disable=missing-function-docstring
         self._turn_on(self._pin_red)
@@ -71,16 +282,28 @@ class LedManager(ManagerBase):
     def get_status_green(self) -> bool:  # pylint: disable=missing-function-docstring
         return self._get_led_status(self._pin_green)
 
+    def __exit__(self, *args):
+        with self._cond:
+            self._stopped = True
+            for playback in list(self._playbacks.values()):
+                self._end(playback, "cancelled")
+            self._cond.notify()
+        if self._engine is not None:
+            self._engine.join(timeout=1.0)
+        # Other compartments share the GPIO, only release our pins
+        self._gpio.cleanup(self._pin_green)
+        self._gpio.cleanup(self._pin_red)
+
 
 def main():  # pylint: disable=missing-function-docstring
     with LedManager() as led:
         while True:
             print("start")
             led.turn_on_green()
-            time.sleep(0.5)
+            clock.sleep(0.5)
             led.turn_off_green()
             led.turn_on_red()
-            time.sleep(0.5)
+            clock.sleep(0.5)
             led.turn_off_red()
 
 
@@ -1,22 +1,96 @@
-import time
-import RPi.GPIO as GPIO
-from utils.manager_base import ManagerBase
+from threading import Condition, Thread
+from typing import Optional
+import logging
+from hardware.backend import get_backend
+from utils.manager_base import DeviceBase
+from utils import clock
+
+logger = logging.getLogger(__name__)
 
 PIN_PHOTO_RESISTOR = 13
+DEFAULT_DEBOUNCE = 0.05
+DEFAULT_POLL_INTERVAL = 0.05
+
+
+class PhotoResistor(DeviceBase):
+    """Photo resistor manager class, one per compartment lid
 
+    In edge triggered mode the sensor is not polled: GPIO edge detection updates
+    a debounced, cached lid state, and waiters are woken up on every transition.
 
-class PhotoResistor(ManagerBase):
-    """Photo resistor manager class, running as a singleton"""
+    Args:
+        pin_photo_resistor (int, optional): sensor pin. Defaults to PIN_PHOTO_RESISTOR.
+        edge_triggered (bool, optional): use GPIO edge detection instead of polling.
+            Defaults to False.
+        debounce (float, optional): seconds the level has to be stable before a
+            transition is accepted in edge triggered mode. Defaults to DEFAULT_DEBOUNCE.
+        poll_interval (float, optional): seconds between sensor reads while waiting
+            for a state without edge detection. Defaults to DEFAULT_POLL_INTERVAL.
+        gpio (optional): GPIO module, e.g. a `hardware.sim_gpio.SimGPIO`. Defaults to
+            the one of the selected hardware backend.
+    """
 
-    def __init__(self, pin_photo_resistor: int = PIN_PHOTO_RESISTOR):
+    def __init__(
+        self,
+        pin_photo_resistor: int = PIN_PHOTO_RESISTOR,
+        edge_triggered: bool = False,
+        debounce: float = DEFAULT_DEBOUNCE,
+        poll_interval: float = DEFAULT_POLL_INTERVAL,
+        gpio=None,
+    ):
         self._pin_photo_resistor = pin_photo_resistor
+        self._gpio = gpio if gpio is not None else get_backend().gpio()
+        self._edge_triggered = edge_triggered
+        self._debounce = debounce
+        self._poll_interval = poll_interval
+        self._cond = Condition()
+        # Time of the last unsettled edge, None once the level was sampled
+        self._edge_at: Optional[float] = None
+        self._transitions = 0
+        self._stopped = False
 
-        GPIO.setmode(GPIO.BOARD)
-        GPIO.setwarnings(False)
-        GPIO.setup(PIN_PHOTO_RESISTOR, GPIO.IN, pull_up_down=GPIO.PUD_UP)
+        self._gpio.setmode(self._gpio.BOARD)
+        self._gpio.setwarnings(False)
+        self._gpio.setup(
+            self._pin_photo_resistor, self._gpio.IN, pull_up_down=self._gpio.PUD_UP
+        )
+
+        self._closed = self._read_sensor() == 1
+        if self._edge_triggered:
+            Thread(
+                target=self._debounce_edges, name="lid-debounce", daemon=True
+            ).start()
+            self._gpio.add_event_detect(
+                self._pin_photo_resistor, self._gpio.BOTH, callback=self._on_edge
+            )
 
     def _read_sensor(self):
-        return GPIO.input(self._pin_photo_resistor)
+        return self._gpio.input(self._pin_photo_resistor)
+
+    def _on_edge(self, _channel: int):
+        # Restarts the debounce window, the level is sampled once it has been
+        # quiet for `self._debounce` seconds.
+        with self._cond:
+            self._edge_at = clock.monotonic()
+            self._cond.notify_all()
+
+    def _debounce_edges(self):
+        with self._cond:
+            while not self._stopped:
+                if self._edge_at is None:
+                    self._cond.wait()
+                    continue
+                remaining = self._edge_at + self._debounce - clock.monotonic()
+                if remaining > 0:
+                    self._cond.wait(clock.to_real(remaining))
+                    continue
+                self._edge_at = None
+                closed = self._read_sensor() == 1
+                if closed != self._closed:
+                    self._closed = closed
+                    self._transitions += 1
+                    self._cond.notify_all()
+                    logger.debug("Lid %s.", "closed" if closed else "opened")
 
     def is_closed(self) -> bool:
         """Returns whether the box lid is closed
@@ -24,6 +98,8 @@ class PhotoResistor(ManagerBase):
         Returns:
             bool: result
         """
+        if self._edge_triggered:
+            return self._closed
         return self._read_sensor() == 1
 
     def is_opened(self) -> bool:
@@ -34,13 +110,69 @@ class PhotoResistor(ManagerBase):
         """
         return not self.is_closed()
 
+    def wait_for_state(self, closed: bool, timeout: Optional[float] = None) -> bool:
+        """Blocks until the lid is in the given state. Returns immediately if it
+            already is. Falls back to polling if not edge triggered.
+
+        Args:
+            closed (bool): True to wait for closed, False to wait for opened
+            timeout (Optional[float], optional): seconds to wait, None waits forever.
+                Defaults to None.
+
+        Returns:
+            bool: whether the lid reached the state within timeout
+        """
+        if self._edge_triggered:
+            with self._cond:
+                return self._cond.wait_for(
+                    lambda: self._closed == closed, clock.to_real(timeout)
+                )
+
+        deadline = None if timeout is None else clock.monotonic() + timeout
+        while self.is_closed() != closed:
+            if deadline is not None and clock.monotonic() >= deadline:
+                return False
+            clock.sleep(self._poll_interval)
+        return True
+
+    def wait_for_transition(self, timeout: Optional[float] = None) -> Optional[bool]:
+        """Blocks until the lid changes its state.
+
+        Args:
+            timeout (Optional[float], optional): seconds to wait, None waits forever.
+                Defaults to None.
+
+        Returns:
+            Optional[bool]: the new state (True for closed), None on timeout
+        """
+        if self._edge_triggered:
+            # Counted under the lock, so no transition after the call is missed
+            with self._cond:
+                transitions = self._transitions
+                if not self._cond.wait_for(
+                    lambda: self._transitions != transitions, clock.to_real(timeout)
+                ):
+                    return None
+                return self._closed
+
+        closed = self.is_closed()
+        if self.wait_for_state(not closed, timeout):
+            return not closed
+        return None
+
+    def __exit__(self, *args):
+        if self._edge_triggered:
+            self._gpio.remove_event_detect(self._pin_photo_resistor)
+            with self._cond:
+                self._stopped = True
+                self._cond.notify_all()
+        self._gpio.cleanup(self._pin_photo_resistor)
+
 
 def main():  # pylint: disable=missing-function-docstring
-    with PhotoResistor() as pr:  # pylint: disable=invalid-name
+    with PhotoResistor(edge_triggered=True) as pr:  # pylint: disable=invalid-name
         while True:
-            val = pr.is_closed
-            print(val)
-            time.sleep(1)
+            print(pr.wait_for_transition())
 
 
 if __name__ == "__main__":
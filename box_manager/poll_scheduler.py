@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+
+from threading import Lock
+from typing import Optional
+import logging
+import time
+from utils import clock
+from utils.metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ACTIVE_RATE = 20.0
+DEFAULT_IDLE_RATE = 2.0
+DEFAULT_ACTIVE_HOLD = 5.0
+DEFAULT_BACKOFF_TIME = 10.0
+DEFAULT_CPU_BUDGET = 0.05
+DEFAULT_BUDGET_WINDOW = 5.0
+
+_WAKEUPS = REGISTRY.counter("poll_wakeups_total", "Polling loop wake-ups.")
+_INTERVAL = REGISTRY.gauge("poll_interval_seconds", "Current polling interval.")
+_DUTY_CYCLE = REGISTRY.gauge(
+    "poll_duty_cycle", "Fraction of time spent polling in the last budget window."
+)
+_THROTTLE = REGISTRY.gauge(
+    "poll_throttle", "Factor the polling interval is stretched by to meet the budget."
+)
+
+
+class PollScheduler:
+    """Adapts the polling interval of the RFID reader and the lid sensors to
+    recent activity.
+
+    After any activity (a tag or lid event, a customer session) the box polls at
+    `active_rate` for `active_hold` seconds, then the interval grows
+    geometrically to the `idle_rate` interval within `backoff_time` seconds.
+    The interval is a function of the time since the last activity only, so
+    several loops can share one scheduler.
+
+    The loops report the duration of their work with `record`. If the fraction
+    of time spent polling exceeds `cpu_budget`, the interval is stretched until
+    it is met again, but never beyond the idle interval.
+
+    Args:
+        active_rate (float, optional): polls per second after activity. Defaults
+            to DEFAULT_ACTIVE_RATE.
+        idle_rate (float, optional): polls per second when idle. Defaults to
+            DEFAULT_IDLE_RATE.
+        active_hold (float, optional): seconds the active rate is kept after
+            activity. Defaults to DEFAULT_ACTIVE_HOLD.
+        backoff_time (float, optional): seconds from the end of `active_hold`
+            until the idle rate is reached. Defaults to DEFAULT_BACKOFF_TIME.
+        cpu_budget (float, optional): max. fraction of time spent polling, 0
+            disables the budget. Defaults to DEFAULT_CPU_BUDGET.
+        budget_window (float, optional): seconds over which the budget is
+            checked. Defaults to DEFAULT_BUDGET_WINDOW.
+    """
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self,
+        active_rate: float = DEFAULT_ACTIVE_RATE,
+        idle_rate: float = DEFAULT_IDLE_RATE,
+        active_hold: float = DEFAULT_ACTIVE_HOLD,
+        backoff_time: float = DEFAULT_BACKOFF_TIME,
+        cpu_budget: float = DEFAULT_CPU_BUDGET,
+        budget_window: float = DEFAULT_BUDGET_WINDOW,
+    ):
+        self._lock = Lock()
+        self.configure(active_rate, idle_rate, active_hold, backoff_time, cpu_budget)
+        self.budget_window = budget_window
+        # Boot counts as activity, the box is probably being looked at
+        self._last_activity = clock.monotonic()
+        self._throttle = 1.0
+        self._window_start = time.perf_counter()
+        self._window_work = 0.0
+        self.duty_cycle = 0.0
+        self.wakeups = 0
+
+    @classmethod
+    def fixed(cls, rate: float) -> "PollScheduler":
+        """Returns a scheduler polling at a constant `rate`, without budget."""
+        return cls(rate, rate, cpu_budget=0)
+
+    def configure(  # pylint: disable=too-many-arguments
+        self,
+        active_rate: float = DEFAULT_ACTIVE_RATE,
+        idle_rate: float = DEFAULT_IDLE_RATE,
+        active_hold: float = DEFAULT_ACTIVE_HOLD,
+        backoff_time: float = DEFAULT_BACKOFF_TIME,
+        cpu_budget: float = DEFAULT_CPU_BUDGET,
+    ):
+        """Changes the parameters, see the constructor."""
+        if not 0 < idle_rate <= active_rate:
+            raise ValueError(
+                "expected 0 < idle_rate <= active_rate, got {} and {}".format(
+                    idle_rate, active_rate
+                )
+            )
+        with self._lock:
+            self.active_interval = 1.0 / active_rate
+            self.idle_interval = 1.0 / idle_rate
+            self.active_hold = active_hold
+            self.backoff_time = backoff_time
+            self.cpu_budget = cpu_budget
+            self._throttle = 1.0
+
+    def activity(self):
+        """Switches to the active rate, e.g. on a tag or lid event."""
+        self._last_activity = clock.monotonic()
+
+    def interval(self, now: Optional[float] = None) -> float:
+        """Returns the time to sleep until the next poll.
+
+        Args:
+            now (Optional[float], optional): current `clock.monotonic()`.
+                Defaults to None, the current time.
+
+        Returns:
+            float: interval in (simulated) seconds
+        """
+        if now is None:
+            now = clock.monotonic()
+        backoff = now - self._last_activity - self.active_hold
+        if backoff <= 0:
+            interval = self.active_interval
+        elif backoff >= self.backoff_time:
+            interval = self.idle_interval
+        else:
+            ratio = self.idle_interval / self.active_interval
+            interval = self.active_interval * ratio ** (backoff / self.backoff_time)
+        interval = min(max(interval, self.idle_interval), interval * self._throttle)
+        _INTERVAL.set(interval)
+        return interval
+
+    def record(self, work: float):
+        """Accounts one wake-up of a polling loop.
+
+        Args:
+            work (float): real seconds the wake-up spent working
+        """
+        now = time.perf_counter()
+        _WAKEUPS.inc()
+        with self._lock:
+            self.wakeups += 1
+            self._window_work += work
+            elapsed = now - self._window_start
+            if elapsed < self.budget_window:
+                return
+            self.duty_cycle = self._window_work / elapsed
+            self._window_start, self._window_work = now, 0.0
+            if 0 < self.cpu_budget < self.duty_cycle:
+                # Stretching beyond the idle interval gains nothing, see `interval`
+                self._throttle = min(
+                    self._throttle * self.duty_cycle / self.cpu_budget,
+                    self.idle_interval / self.active_interval,
+                )
+                logger.debug(
+                    "Polling over budget (%.1f%%), throttled by %.2f.",
+                    self.duty_cycle * 100,
+                    self._throttle,
+                )
+            elif self.duty_cycle < self.cpu_budget / 2:
+                self._throttle = max(1.0, self._throttle / 2)
+            throttle = self._throttle
+        _DUTY_CYCLE.set(self.duty_cycle)
+        _THROTTLE.set(throttle)
@@ -1,12 +1,309 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+"""Writes customer tokens to RFID tags.
+
+One token:
+
+    python change_token.py TOKEN
+
+A batch, one token per line or in the first column of a CSV file, "-" for
+stdin:
+
+    python change_token.py --tokens tokens.csv --results results.csv
+
+Keeps one reader open and writes each token to the next card placed on the
+reader, then reads it back to verify it. Cards already provisioned in this
+batch are ignored until they are taken away, so a stack of cards can be fed
+one after the other. Repeated tokens are skipped.
+
+Every outcome is appended to the results file as a CSV row token, uid,
+status, time. A batch restarted with the same results file skips the tokens
+and cards recorded as "ok" there. Throughput is reported in cards per minute.
+"""
+
+from typing import Dict, Iterable, Iterator, NamedTuple, Optional, Set, TextIO
+import argparse
+import csv
+import os
 import sys
-from mfrc522 import SimpleMFRC522
+import time
+from hardware.backend import select_backend, DEFAULT_BACKEND
+from rfid_manager.reader import (
+    RfidReader,
+    READ_MODES,
+    DEFAULT_READ_MODE,
+    TEXT_LENGTH,
+)
+from utils import clock
+
+DEFAULT_POLL_INTERVAL = 0.05
+DEFAULT_VERIFY_POLLS = 10
+DEFAULT_RETRIES = 2
+DEFAULT_REPORT_EVERY = 10
+
+STATUS_OK = "ok"
+STATUS_DUPLICATE = "duplicate"
+STATUS_INVALID = "invalid"
+STATUS_VERIFY_FAILED = "verify_failed"
+RESULT_FIELDS = ["token", "uid", "status", "time"]
+
+
+class Result(NamedTuple):
+    """Outcome of provisioning one token"""
+
+    token: str
+    uid: Optional[int]
+    status: str
+
+
+def read_tokens(lines: Iterable[str]) -> Iterator[str]:
+    """Yields the tokens of CSV `lines`: the first column of every row, except
+    for empty rows, comments and a "token" header.
+    """
+    for row in csv.reader(lines):
+        if not row or not row[0].strip() or row[0].startswith("#"):
+            continue
+        token = row[0].strip()
+        if token != "token":
+            yield token
+
+
+def validate(token: str) -> bool:
+    """Returns whether `token` fits the text blocks of a tag."""
+    return len(token) <= TEXT_LENGTH and token.isascii() and token.isprintable()
+
+
+class ResultLog:
+    """Appends results to a CSV file, and loads what an earlier run provisioned.
+
+    Args:
+        path (Optional[str]): results file, results are not stored if None
+    """
+
+    def __init__(self, path: Optional[str]):
+        self.tokens: Set[str] = set()
+        self.uids: Set[int] = set()
+        self._file: Optional[TextIO] = None
+        if path is None:
+            return
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8", newline="") as results:
+                for row in csv.DictReader(results):
+                    if row.get("status") == STATUS_OK:
+                        self.tokens.add(row["token"])
+                        self.uids.add(int(row["uid"]))
+        new = not os.path.exists(path) or os.path.getsize(path) == 0
+        # pylint: disable-next=consider-using-with
+        self._file = open(path, "a", encoding="utf-8", newline="")
+        self._writer = csv.writer(self._file)
+        if new:
+            self._writer.writerow(RESULT_FIELDS)
+
+    def add(self, result: Result):
+        """Records `result`, durably before returning."""
+        if result.status == STATUS_OK:
+            self.tokens.add(result.token)
+            self.uids.add(result.uid)
+        if self._file is None:
+            return
+        self._writer.writerow(
+            [
+                result.token,
+                "" if result.uid is None else result.uid,
+                result.status,
+                time.strftime("%Y-%m-%dT%H:%M:%S"),
+            ]
+        )
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):  # pylint: disable=missing-function-docstring
+        if self._file is not None:
+            self._file.close()
+
+
+class Provisioner:
+    """Writes tokens to the cards placed on one reader.
+
+    Args:
+        reader (RfidReader): reader kept open for the whole batch
+        log (ResultLog): results of this and earlier runs
+        poll_interval (float, optional): seconds between reader polls while
+            waiting for a card. Defaults to DEFAULT_POLL_INTERVAL.
+        verify_polls (int, optional): polls to read a written card back.
+            Defaults to DEFAULT_VERIFY_POLLS.
+        retries (int, optional): writes repeated when the verification fails.
+            Defaults to DEFAULT_RETRIES.
+    """
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self,
+        reader: RfidReader,
+        log: ResultLog,
+        poll_interval: float = DEFAULT_POLL_INTERVAL,
+        verify_polls: int = DEFAULT_VERIFY_POLLS,
+        retries: int = DEFAULT_RETRIES,
+    ):
+        self._reader = reader
+        self._log = log
+        self._poll_interval = poll_interval
+        self._verify_polls = verify_polls
+        self._retries = retries
+        self._seen: Set[str] = set()
+        self.counts: Dict[str, int] = {}
+        self.resumed = 0
+
+    def wait_for_card(self) -> int:
+        """Blocks until a card not provisioned yet is on the reader.
+
+        Returns:
+            int: uid of the card
+        """
+        waiting_on: Optional[int] = None
+        while True:
+            uid, _ = self._reader.read()
+            if uid is not None and uid not in self._log.uids:
+                return uid
+            if uid is not None and uid != waiting_on:
+                print("Card {} is provisioned already, take it away.".format(uid))
+            waiting_on = uid
+            clock.sleep(self._poll_interval)
+
+    def verify(self, uid: int, token: str) -> bool:
+        """Returns whether card `uid` reads back as `token`."""
+        for _ in range(self._verify_polls):
+            read_uid, text = self._reader.read()
+            if read_uid == uid and text is not None:
+                return text.rstrip() == token
+            clock.sleep(self._poll_interval)
+        return False
+
+    def provision(self, token: str) -> Optional[Result]:
+        """Writes `token` to the next card.
+
+        Returns:
+            Optional[Result]: the outcome, None if an earlier run provisioned
+            the token
+        """
+        if token in self._log.tokens:
+            self.resumed += 1
+            return None
+        if token in self._seen:
+            result = Result(token, None, STATUS_DUPLICATE)
+        elif not validate(token):
+            result = Result(token, None, STATUS_INVALID)
+        else:
+            result = self._write(token)
+        self._seen.add(token)
+        self._log.add(result)
+        self.counts[result.status] = self.counts.get(result.status, 0) + 1
+        return result
+
+    def _write(self, token: str) -> Result:
+        attempts = 0
+        while True:
+            self.wait_for_card()
+            # Not the blocking write, it would take any card, e.g. a provisioned
+            # one replacing this card. A tag left selected by a classic read only
+            # answers the second request.
+            uid, _ = self._reader.write_no_block(token)
+            if uid is None:
+                uid, _ = self._reader.write_no_block(token)
+            if uid is None:
+                clock.sleep(self._poll_interval)
+                continue
+            if self.verify(uid, token):
+                return Result(token, uid, STATUS_OK)
+            attempts += 1
+            if attempts > self._retries:
+                return Result(token, uid, STATUS_VERIFY_FAILED)
+
+
+def _lines(path: str) -> Iterator[str]:
+    if path == "-":
+        yield from sys.stdin
+        return
+    with open(path, "r", encoding="utf-8", newline="") as tokens:
+        yield from tokens
+
+
+def _rate(count: int, seconds: float) -> float:
+    return count / seconds * 60 if seconds > 0 else 0.0
+
+
+def run(tokens: Iterable[str], provisioner: Provisioner, report_every: int) -> int:
+    """Provisions `tokens` and prints progress and throughput.
+
+    Returns:
+        int: number of tokens not provisioned
+    """
+    started = time.monotonic()
+    failed = done = 0
+    try:
+        for token in tokens:
+            result = provisioner.provision(token)
+            if result is None:
+                continue
+            print("{}: {} {}".format(result.status, result.token, result.uid))
+            if result.status == STATUS_OK:
+                done += 1
+                if report_every and done % report_every == 0:
+                    elapsed = time.monotonic() - started
+                    print(
+                        "{} cards, {:.1f} cards/min".format(done, _rate(done, elapsed))
+                    )
+            elif result.status != STATUS_DUPLICATE:
+                failed += 1
+    except KeyboardInterrupt:
+        print("Interrupted, rerun with the same results file to resume.")
+        failed += 1
+    elapsed = time.monotonic() - started
+    print(
+        "{} cards in {:.1f} s, {:.1f} cards/min. {} skipped as provisioned "
+        "earlier, {}".format(
+            done,
+            elapsed,
+            _rate(done, elapsed),
+            provisioner.resumed,
+            ", ".join(
+                "{} {}".format(count, status)
+                for status, count in sorted(provisioner.counts.items())
+            )
+            or "nothing else",
+        )
+    )
+    return failed
+
 
+def main():  # pylint: disable=missing-function-docstring
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("token", nargs="?", help="single token to write")
+    parser.add_argument("--tokens", help='CSV file of tokens, "-" for stdin')
+    parser.add_argument("--results", help="CSV file of results, for resuming")
+    parser.add_argument("--hardware", default=DEFAULT_BACKEND)
+    parser.add_argument("--read-mode", choices=READ_MODES, default=DEFAULT_READ_MODE)
+    parser.add_argument("--retries", type=int, default=DEFAULT_RETRIES)
+    parser.add_argument("--report-every", type=int, default=DEFAULT_REPORT_EVERY)
+    args = parser.parse_args()
+    if (args.token is None) == (args.tokens is None):
+        parser.error("expected either a token or --tokens")
 
-print(sys.argv)
+    select_backend(args.hardware)
+    log = ResultLog(args.results)
+    try:
+        with RfidReader(mode=args.read_mode) as reader:
+            provisioner = Provisioner(reader, log, retries=args.retries)
+            if args.token is not None:
+                tokens: Iterable[str] = [args.token]
+            else:
+                tokens = read_tokens(_lines(args.tokens))
+            failed = run(tokens, provisioner, args.report_every)
+    finally:
+        log.close()
+    sys.exit(1 if failed else 0)
 
-text = sys.argv[1]
 
-reader = SimpleMFRC522()
-print(reader.read())
-reader.write(text)
-print("token changed to {}".format(text))
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+
+from abc import ABC, abstractmethod
+from typing import Optional
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+HARDWARE_ENV = "BOARD_HARDWARE"
+DEFAULT_BACKEND = "rpi"
+
+
+class HardwareBackendError(Exception):  # pylint: disable=missing-class-docstring
+    pass
+
+
+class HardwareBackend(ABC):
+    """Provides the GPIO module and MFRC522 reader used by the box managers."""
+
+    name = ""
+
+    @abstractmethod
+    def gpio(self):
+        """Returns an object implementing the `RPi.GPIO` module API."""
+
+    @abstractmethod
+    def create_reader(self):
+        """Returns a new object implementing the `mfrc522.SimpleMFRC522` API."""
+
+    @abstractmethod
+    def reader_spi(self, reader):
+        """Returns the SPI device of `reader`, from `create_reader`, wrapped to
+        count its transactions.
+
+        Returns:
+            CountingSpi: spidev-like device of the reader's MFRC522
+        """
+
+
+class RpiBackend(HardwareBackend):
+    """Real hardware: `RPi.GPIO` and `mfrc522`."""
+
+    name = "rpi"
+
+    def __init__(self):
+        # Imported here, so that other backends work where these are missing
+        from RPi import GPIO  # pylint: disable=import-outside-toplevel
+
+        self._gpio = GPIO
+
+    def gpio(self):
+        return self._gpio
+
+    def create_reader(self):
+        # Deferred to the reader setup, it pulls in spidev
+        from mfrc522 import SimpleMFRC522  # pylint: disable=import-outside-toplevel
+
+        return SimpleMFRC522()
+
+    def reader_spi(self, reader):
+        # pylint: disable=import-outside-toplevel
+        from hardware.mfrc522_driver import CountingSpi
+
+        # Also counts the traffic of the mfrc522 package itself
+        chip = reader.READER
+        if not isinstance(chip.spi, CountingSpi):
+            chip.spi = CountingSpi(chip.spi)
+        return chip.spi
+
+
+# Set by `select_backend`
+_backend: Optional[HardwareBackend] = None  # pylint: disable=invalid-name
+
+
+def select_backend(name: Optional[str] = None, **kwargs) -> HardwareBackend:
+    """Selects the process wide hardware backend. Must be called before any
+        manager touches the hardware.
+
+    Args:
+        name (Optional[str], optional): "rpi" or "sim". The `BOARD_HARDWARE`
+            environment variable takes precedence. Defaults to DEFAULT_BACKEND.
+        **kwargs: passed to the backend constructor
+
+    Returns:
+        HardwareBackend: the selected backend
+    """
+    global _backend  # pylint: disable=global-statement
+    name = os.environ.get(HARDWARE_ENV) or name or DEFAULT_BACKEND
+    if name == RpiBackend.name:
+        _backend = RpiBackend(**kwargs)
+    elif name == "sim":
+        from hardware.simulator import (  # pylint: disable=import-outside-toplevel
+            Simulator,
+        )
+
+        _backend = Simulator(**kwargs)
+    else:
+        raise HardwareBackendError("Unknown hardware backend {}".format(name))
+    logger.info(
+        "Using hardware backend {}.".format(  # pylint: disable=logging-format-interpolation
+            name
+        )
+    )
+    return _backend
+
+
+def get_backend(default: Optional[str] = None) -> HardwareBackend:
+    """Returns the selected backend, selecting `default` if there is none yet.
+
+    Args:
+        default (Optional[str], optional): backend to select if none is selected.
+            Defaults to None.
+
+    Returns:
+        HardwareBackend: the selected backend
+    """
+    if _backend is None:
+        return select_backend(default)
+    return _backend
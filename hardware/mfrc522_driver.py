@@ -0,0 +1,417 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+"""Register level driver of the MFRC522 for ISO 14443-A / MIFARE Classic tags.
+
+Talks to the chip through a spidev-like object with an `xfer2` method, e.g. the
+one the `mfrc522` package opened, after it initialized the chip. Compared with
+that package, the driver
+
+- bursts FIFO reads and writes into single SPI transactions,
+- computes CRC_A on the host instead of with the CalcCRC command,
+- writes interrupt, FIFO and crypto flags directly instead of read-modify-write,
+- uses a short timeout for the frames that only probe for a tag.
+
+With `legacy=True` it drives the chip exactly like the `mfrc522` package does,
+so the simulator can reproduce that package's bus traffic.
+"""
+
+from typing import List, NamedTuple, Optional, Sequence
+from utils.metrics import REGISTRY
+
+# Registers
+COMMAND = 0x01
+COM_IEN = 0x02
+COM_IRQ = 0x04
+DIV_IRQ = 0x05
+ERROR = 0x06
+STATUS2 = 0x08
+FIFO_DATA = 0x09
+FIFO_LEVEL = 0x0A
+CONTROL = 0x0C
+BIT_FRAMING = 0x0D
+MODE = 0x11
+TX_CONTROL = 0x14
+TX_ASK = 0x15
+CRC_RESULT_M = 0x21
+CRC_RESULT_L = 0x22
+T_MODE = 0x2A
+T_PRESCALER = 0x2B
+T_RELOAD_H = 0x2C
+T_RELOAD_L = 0x2D
+
+# Chip commands
+CMD_IDLE = 0x00
+CMD_CALC_CRC = 0x03
+CMD_TRANSCEIVE = 0x0C
+CMD_AUTHENT = 0x0E
+CMD_SOFT_RESET = 0x0F
+
+# Tag commands
+PICC_REQA = 0x26
+PICC_WUPA = 0x52
+PICC_SELECT_CL1 = 0x93
+PICC_AUTH_KEY_A = 0x60
+PICC_READ = 0x30
+PICC_WRITE = 0xA0
+PICC_HALT = 0x50
+PICC_ACK = 0x0A
+
+# Interrupt bits of COM_IRQ and DIV_IRQ, crypto flag of STATUS2
+IRQ_TIMER = 0x01
+IRQ_IDLE = 0x10
+IRQ_RX = 0x20
+IRQ_TX = 0x40
+IRQ_CRC = 0x04
+MF_CRYPTO1_ON = 0x08
+ERROR_MASK = 0x1B
+
+# Timer reload values, in ticks of 0.5 ms as set up by `init`. A tag answers a
+# wake-up within 0.1 ms, the long timeout covers authentication and reads.
+SHORT_TIMEOUT_TICKS = 1
+LONG_TIMEOUT_TICKS = 30
+# Upper bound of interrupt register polls per frame
+MAX_IRQ_POLLS = 2000
+
+# Where `mfrc522.SimpleMFRC522` stores its text
+TEXT_BLOCKS = (8, 9, 10)
+TEXT_TRAILER = 11
+DEFAULT_KEY = (0xFF,) * 6
+
+_SPI_TRANSACTIONS = REGISTRY.counter(
+    "rfid_spi_transactions_total", "SPI transactions with the RFID reader."
+)
+_SPI_BYTES = REGISTRY.counter("rfid_spi_bytes_total", "SPI bytes to the RFID reader.")
+
+
+def crc_a(data: Sequence[int]) -> List[int]:
+    """Returns the ISO 14443-A CRC of `data`, low byte first."""
+    crc = 0x6363
+    for byte in data:
+        byte ^= crc & 0xFF
+        byte ^= (byte << 4) & 0xFF
+        crc = (crc >> 8) ^ (byte << 8) ^ (byte << 3) ^ (byte >> 4)
+    return [crc & 0xFF, crc >> 8]
+
+
+def uid_to_num(uid: Sequence[int]) -> int:
+    """Returns the tag id `mfrc522.SimpleMFRC522` reports for an anticollision
+    answer, i.e. the 4 uid bytes and the check byte as one number."""
+    number = 0
+    for byte in uid[:5]:
+        number = number * 256 + byte
+    return number
+
+
+class CountingSpi:
+    """Wraps a spidev-like device and counts its transactions and bytes.
+
+    Args:
+        spi: device with `xfer2`
+    """
+
+    def __init__(self, spi):
+        self._spi = spi
+        self.transactions = 0
+        self.bytes = 0
+
+    def xfer2(self, data: List[int]) -> List[int]:
+        """Counts and forwards one SPI transaction."""
+        self.transactions += 1
+        self.bytes += len(data)
+        _SPI_TRANSACTIONS.inc()
+        _SPI_BYTES.inc(len(data))
+        return self._spi.xfer2(data)
+
+    def __getattr__(self, name: str):
+        return getattr(self._spi, name)
+
+
+class Frame(NamedTuple):
+    """Result of one frame exchanged with a tag"""
+
+    ok: bool
+    data: List[int]
+    bits: int
+
+
+class Mfrc522Driver:
+    """ISO 14443-A tag operations on an MFRC522.
+
+    Not thread safe, the caller serializes access to the chip.
+
+    Args:
+        spi: spidev-like device with `xfer2`
+        legacy (bool, optional): drive the chip like the `mfrc522` package.
+            Defaults to False.
+    """
+
+    def __init__(self, spi, legacy: bool = False):
+        self._spi = spi
+        self.legacy = legacy
+        self._reload: Optional[int] = None
+
+    def _write(self, register: int, *values: int):
+        self._spi.xfer2([(register << 1) & 0x7E, *values])
+
+    def _read(self, *registers: int) -> List[int]:
+        # One transaction, each address byte clocks out the previous register
+        addresses = [((register << 1) & 0x7E) | 0x80 for register in registers]
+        return self._spi.xfer2(addresses + [0])[1:]
+
+    def _set_bits(self, register: int, mask: int):
+        self._write(register, self._read(register)[0] | mask)
+
+    def _clear_bits(self, register: int, mask: int):
+        self._write(register, self._read(register)[0] & ~mask & 0xFF)
+
+    def _write_fifo(self, data: Sequence[int]):
+        if self.legacy:
+            for byte in data:
+                self._write(FIFO_DATA, byte)
+        else:
+            self._write(FIFO_DATA, *data)
+
+    def _read_fifo(self, count: int) -> List[int]:
+        if self.legacy:
+            return [self._read(FIFO_DATA)[0] for _ in range(count)]
+        return self._read(*([FIFO_DATA] * count)) if count else []
+
+    def init(self):
+        """Resets and sets up the chip, like `mfrc522.MFRC522` does on creation."""
+        self._write(COMMAND, CMD_SOFT_RESET)
+        self._write(T_MODE, 0x8D)
+        self._write(T_PRESCALER, 0x3E)
+        self._write(T_RELOAD_L, LONG_TIMEOUT_TICKS)
+        self._write(T_RELOAD_H, 0)
+        self._write(TX_ASK, 0x40)
+        self._write(MODE, 0x3D)
+        self._reload = LONG_TIMEOUT_TICKS
+        if self._read(TX_CONTROL)[0] & 0x03 != 0x03:
+            self._set_bits(TX_CONTROL, 0x03)
+
+    def _set_timeout(self, ticks: int):
+        # The legacy driver never changes the timeout set by `init`
+        if not self.legacy and ticks != self._reload:
+            self._write(T_RELOAD_L, ticks)
+            self._reload = ticks
+
+    def _crc(self, data: Sequence[int]) -> List[int]:
+        if not self.legacy:
+            return crc_a(data)
+        self._clear_bits(DIV_IRQ, IRQ_CRC)
+        self._set_bits(FIFO_LEVEL, 0x80)
+        self._write_fifo(data)
+        self._write(COMMAND, CMD_CALC_CRC)
+        for _ in range(0xFF):
+            if self._read(DIV_IRQ)[0] & IRQ_CRC:
+                break
+        return [self._read(CRC_RESULT_L)[0], self._read(CRC_RESULT_M)[0]]
+
+    def _to_card(  # pylint: disable=too-many-branches
+        self, command: int, data: Sequence[int], last_bits: int = 0, answer=True
+    ) -> Frame:
+        if command == CMD_AUTHENT:
+            irq_enable, wait_irq = 0x12, IRQ_IDLE
+        elif not answer:
+            # Only waits for the end of the transmission
+            irq_enable, wait_irq = 0x77, IRQ_TX
+        else:
+            irq_enable, wait_irq = 0x77, IRQ_IDLE | IRQ_RX
+        # FIFO level and control are only read for answered transceives
+        level = control = 0
+        if self.legacy:
+            self._write(COM_IEN, irq_enable | 0x80)
+            self._clear_bits(COM_IRQ, 0x80)
+            self._set_bits(FIFO_LEVEL, 0x80)
+        else:
+            # Clears all interrupt bits and flushes the FIFO
+            self._write(COM_IRQ, 0x7F)
+            self._write(FIFO_LEVEL, 0x80)
+        self._write(COMMAND, CMD_IDLE)
+        self._write_fifo(data)
+        self._write(COMMAND, command)
+        if command == CMD_TRANSCEIVE:
+            if self.legacy:
+                self._set_bits(BIT_FRAMING, 0x80)
+            else:
+                self._write(BIT_FRAMING, 0x80 | last_bits)
+
+        irq = 0
+        for _ in range(MAX_IRQ_POLLS):
+            irq = self._read(COM_IRQ)[0]
+            if irq & (IRQ_TIMER | wait_irq):
+                break
+        else:
+            return Frame(False, [], 0)
+        if self.legacy:
+            self._clear_bits(BIT_FRAMING, 0x80)
+            error = self._read(ERROR)[0]
+        else:
+            self._write(BIT_FRAMING, 0)
+            if command == CMD_TRANSCEIVE:
+                error, level, control = self._read(ERROR, FIFO_LEVEL, CONTROL)
+            else:
+                error = self._read(ERROR)[0]
+        if error & ERROR_MASK or irq & irq_enable & IRQ_TIMER:
+            return Frame(False, [], 0)
+        if command != CMD_TRANSCEIVE or not answer:
+            return Frame(True, [], 0)
+
+        if self.legacy:
+            level = self._read(FIFO_LEVEL)[0]
+            control = self._read(CONTROL)[0]
+        rx_last_bits = control & 0x07
+        bits = (level - 1) * 8 + rx_last_bits if rx_last_bits else level * 8
+        # The mfrc522 package reads at most 16 bytes, e.g. not a block's CRC
+        count = max(1, min(level, 16)) if self.legacy else level
+        return Frame(True, self._read_fifo(count), bits)
+
+    def request(self, wake_up: bool = False) -> bool:
+        """Sends REQA, which idle tags answer, or WUPA, which halted tags answer
+        as well.
+
+        Returns:
+            bool: whether a tag answered
+        """
+        self._set_timeout(SHORT_TIMEOUT_TICKS)
+        if self.legacy:
+            self._write(BIT_FRAMING, 7)
+        frame = self._to_card(
+            CMD_TRANSCEIVE, [PICC_WUPA if wake_up else PICC_REQA], last_bits=7
+        )
+        return frame.ok and frame.bits == 16
+
+    def anticollision(self) -> Optional[List[int]]:
+        """Returns the 4 uid bytes and the check byte of the answering tag."""
+        self._set_timeout(SHORT_TIMEOUT_TICKS)
+        if self.legacy:
+            self._write(BIT_FRAMING, 0)
+        frame = self._to_card(CMD_TRANSCEIVE, [PICC_SELECT_CL1, 0x20])
+        if not frame.ok or len(frame.data) != 5:
+            return None
+        uid = frame.data
+        if uid[0] ^ uid[1] ^ uid[2] ^ uid[3] != uid[4]:
+            return None
+        return uid
+
+    def select(self, uid: Sequence[int]) -> bool:
+        """Selects the tag `uid` from `anticollision`."""
+        self._set_timeout(LONG_TIMEOUT_TICKS)
+        data = [PICC_SELECT_CL1, 0x70, *uid[:5]]
+        frame = self._to_card(CMD_TRANSCEIVE, data + self._crc(data))
+        return frame.ok and frame.bits == 24
+
+    def authenticate(self, block: int, key: Sequence[int], uid: Sequence[int]) -> bool:
+        """Authenticates with key A for the sector of `block`."""
+        self._set_timeout(LONG_TIMEOUT_TICKS)
+        frame = self._to_card(CMD_AUTHENT, [PICC_AUTH_KEY_A, block, *key, *uid[:4]])
+        return frame.ok and bool(self._read(STATUS2)[0] & MF_CRYPTO1_ON)
+
+    def stop_crypto(self):  # pylint: disable=missing-function-docstring
+        if self.legacy:
+            self._clear_bits(STATUS2, MF_CRYPTO1_ON)
+        else:
+            self._write(STATUS2, 0)
+
+    def read_block(self, block: int) -> Optional[List[int]]:
+        """Returns the 16 bytes of `block`, None on failure."""
+        self._set_timeout(LONG_TIMEOUT_TICKS)
+        data = [PICC_READ, block]
+        frame = self._to_card(CMD_TRANSCEIVE, data + self._crc(data))
+        if not frame.ok:
+            return None
+        if self.legacy:
+            return frame.data if len(frame.data) == 16 else None
+        if len(frame.data) != 18 or crc_a(frame.data[:16]) != frame.data[16:]:
+            return None
+        return frame.data[:16]
+
+    def _acked(self, data: List[int]) -> bool:
+        frame = self._to_card(CMD_TRANSCEIVE, data + self._crc(data))
+        return frame.ok and frame.bits == 4 and frame.data[0] & 0x0F == PICC_ACK
+
+    def write_block(self, block: int, data: Sequence[int]) -> bool:
+        """Writes 16 bytes to `block`."""
+        self._set_timeout(LONG_TIMEOUT_TICKS)
+        return self._acked([PICC_WRITE, block]) and self._acked(list(data[:16]))
+
+    def halt(self):
+        """Halts the selected tag, it then only answers WUPA."""
+        self._set_timeout(SHORT_TIMEOUT_TICKS)
+        data = [PICC_HALT, 0]
+        self._to_card(CMD_TRANSCEIVE, data + self._crc(data), answer=False)
+
+    def probe(self, retry: bool = False) -> Optional[List[int]]:
+        """Returns the uid of the tag in the field, without selecting it. The tag
+        is left ready, for `read_blocks` or `park`.
+
+        A tag left ready rather than halted drops back to idle on the next
+        wake-up instead of answering it. With `retry`, e.g. while a tag is known
+        to be present, a missing answer is retried once.
+
+        Returns:
+            Optional[List[int]]: uid and check byte, None if there is no tag
+        """
+        if not self.request(wake_up=True):
+            if not retry or not self.request(wake_up=True):
+                return None
+        return self.anticollision()
+
+    def park(self, uid: Sequence[int]) -> bool:
+        """Selects and halts tag `uid` after a `probe`, so that it answers the
+        next probe right away."""
+        if not self.select(uid):
+            return False
+        self.halt()
+        return True
+
+    def read_blocks(
+        self,
+        uid: Sequence[int],
+        blocks: Sequence[int] = TEXT_BLOCKS,
+        trailer: int = TEXT_TRAILER,
+        key: Sequence[int] = DEFAULT_KEY,
+    ) -> Optional[List[int]]:
+        """Selects tag `uid` after a `probe`, reads `blocks` of the sector of
+        `trailer` and halts the tag.
+
+        Returns:
+            Optional[List[int]]: the block contents, None on failure
+        """
+        data: Optional[List[int]] = None
+        if self.select(uid) and self.authenticate(trailer, key, uid):
+            data = []
+            for block in blocks:
+                content = self.read_block(block)
+                if content is None:
+                    data = None
+                    break
+                data += content
+            # Encrypted, while crypto is still on
+            self.halt()
+        self.stop_crypto()
+        return data
+
+    def write_blocks(
+        self,
+        uid: Sequence[int],
+        data: Sequence[int],
+        blocks: Sequence[int] = TEXT_BLOCKS,
+        trailer: int = TEXT_TRAILER,
+        key: Sequence[int] = DEFAULT_KEY,
+    ) -> bool:
+        """Selects tag `uid` after a `probe`, writes `data`, 16 bytes per block,
+        to `blocks` of the sector of `trailer` and halts the tag.
+
+        Returns:
+            bool: whether all blocks were written
+        """
+        written = False
+        if self.select(uid) and self.authenticate(trailer, key, uid):
+            written = all(
+                self.write_block(block, data[index * 16 : (index + 1) * 16])
+                for index, block in enumerate(blocks)
+            )
+            self.halt()
+        self.stop_crypto()
+        return written
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+# pylint: disable=missing-function-docstring
+
+from threading import RLock
+from typing import Callable, Dict, List, Optional, Tuple
+import time
+
+
+class SimGPIOError(Exception):  # pylint: disable=missing-class-docstring
+    pass
+
+
+class SimGPIO:  # pylint: disable=invalid-name
+    """Simulated drop-in for the `RPi.GPIO` module.
+
+    Implements the subset of the `RPi.GPIO` API used by the box, plus helpers to
+    drive input pins (`set_input`) and inspect outputs (`output_history`).
+    Edge callbacks registered with `add_event_detect` run synchronously in the
+    thread calling `set_input`.
+
+    Args:
+        clock (Callable[[], float], optional): time source for recorded
+            events. Defaults to time.monotonic.
+    """
+
+    BOARD = 10
+    BCM = 11
+    OUT = 0
+    IN = 1
+    LOW = 0
+    HIGH = 1
+    PUD_OFF = 20
+    PUD_DOWN = 21
+    PUD_UP = 22
+    RISING = 31
+    FALLING = 32
+    BOTH = 33
+
+    def __init__(self, clock: Callable[[], float] = time.monotonic):
+        self._clock = clock
+        self._lock = RLock()
+        self._mode: Optional[int] = None
+        self._directions: Dict[int, int] = {}
+        self._levels: Dict[int, int] = {}
+        self._detectors: Dict[int, Tuple[int, List[Callable[[int], None]]]] = {}
+        self.output_history: List[Tuple[float, int, int]] = []
+
+    def setmode(self, mode: int):
+        self._mode = mode
+
+    def getmode(self) -> Optional[int]:
+        return self._mode
+
+    def setwarnings(self, flag: bool):
+        pass
+
+    def setup(
+        self, channel: int, direction: int, pull_up_down: int = PUD_OFF, initial=-1
+    ):
+        if self._mode is None:
+            raise SimGPIOError("Please set pin numbering mode using setmode()")
+        with self._lock:
+            self._directions[channel] = direction
+            if direction == self.OUT:
+                self._set_output(channel, self.LOW if initial == -1 else initial)
+            elif channel not in self._levels:
+                self._levels[channel] = (
+                    self.HIGH if pull_up_down == self.PUD_UP else self.LOW
+                )
+
+    def _check_setup(self, channel: int):
+        if channel not in self._directions:
+            raise SimGPIOError(
+                "The GPIO channel {} has not been set up".format(channel)
+            )
+
+    def _set_output(self, channel: int, value: int):
+        value = self.HIGH if value else self.LOW
+        self._levels[channel] = value
+        self.output_history.append((self._clock(), channel, value))
+
+    def input(self, channel: int) -> int:
+        self._check_setup(channel)
+        return self._levels[channel]
+
+    def output(self, channel: int, value: int):
+        self._check_setup(channel)
+        with self._lock:
+            self._set_output(channel, value)
+
+    def add_event_detect(
+        self,
+        channel: int,
+        edge: int,
+        callback: Callable[[int], None] = None,
+        bouncetime: int = None,
+    ):  # pylint: disable=unused-argument
+        self._check_setup(channel)
+        with self._lock:
+            if channel in self._detectors:
+                raise SimGPIOError(
+                    "Conflicting edge detection already enabled for this GPIO channel"
+                )
+            self._detectors[channel] = (edge, [callback] if callback else [])
+
+    def add_event_callback(self, channel: int, callback: Callable[[int], None]):
+        with self._lock:
+            if channel not in self._detectors:
+                raise SimGPIOError(
+                    "Add event detection using add_event_detect first before "
+                    "adding a callback"
+                )
+            self._detectors[channel][1].append(callback)
+
+    def remove_event_detect(self, channel: int):
+        with self._lock:
+            self._detectors.pop(channel, None)
+
+    def cleanup(self, channel: int = None):
+        with self._lock:
+            channels = list(self._directions) if channel is None else [channel]
+            for pin in channels:
+                self._directions.pop(pin, None)
+                self._detectors.pop(pin, None)
+                self._levels.pop(pin, None)
+
+    def set_input(self, channel: int, value: int):
+        """Drives an input pin, e.g. simulates the light sensor changing.
+
+        Args:
+            channel (int): pin number
+            value (int): new level, HIGH or LOW
+        """
+        value = self.HIGH if value else self.LOW
+        with self._lock:
+            previous = self._levels.get(channel)
+            self._levels[channel] = value
+            edge, callbacks = self._detectors.get(channel, (None, []))
+            callbacks = list(callbacks)
+        if previous == value or edge is None:
+            return
+        rising = value == self.HIGH
+        if edge == self.BOTH or (edge == self.RISING) == rising:
+            for callback in callbacks:
+                callback(channel)
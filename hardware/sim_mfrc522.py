@@ -0,0 +1,423 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+# pylint: disable=missing-function-docstring
+"""Simulated MFRC522 at register level, with MIFARE Classic 1K tags.
+
+`SimMFRC522Chip` models the chip registers behind its SPI interface, its
+transceive, authenticate and CRC commands and its timer, and `SimTag` the ISO
+14443-A state machine and memory of a tag. Time on the chip is virtual and
+advances with every SPI transaction, so timeouts cost a deterministic number of
+interrupt register polls.
+
+`SimMFRC522` is the drop-in for `mfrc522.SimpleMFRC522`, driving the chip the
+way that package does.
+"""
+
+from threading import Lock
+from typing import Dict, List, Optional, Sequence, Tuple
+import enum
+from hardware import mfrc522_driver as pcd
+from hardware.mfrc522_driver import CountingSpi, Mfrc522Driver, crc_a, uid_to_num
+from utils import clock
+
+# SimpleMFRC522 stores text in three 16 byte blocks and returns it space padded
+TEXT_LENGTH = 48
+POLL_INTERVAL = 0.05
+
+# Cost of one SPI transaction from Python on a Raspberry Pi, and of each byte
+TRANSACTION_SECONDS = 50e-6
+BYTE_SECONDS = 8e-6
+# Air interface at 106 kbit/s, 9 bits per byte with parity
+BIT_SECONDS = 1 / 106e3
+FRAME_DELAY_SECONDS = 90e-6
+AUTHENTICATION_SECONDS = 1e-3
+CLOCK_HZ = 13.56e6
+FIFO_SIZE = 64
+
+TRAILER_DEFAULT = [0xFF] * 6 + [0xFF, 0x07, 0x80, 0x69] + [0xFF] * 6
+
+
+def tag_uid(serial: int) -> int:
+    """Returns the `SimpleMFRC522` id of the tag with 4 byte serial number
+    `serial`, i.e. the serial with its check byte appended."""
+    serial_bytes = list((serial & 0xFFFFFFFF).to_bytes(4, "big"))
+    return uid_to_num(serial_bytes + [_check_byte(serial_bytes)])
+
+
+def _check_byte(serial: Sequence[int]) -> int:
+    return serial[0] ^ serial[1] ^ serial[2] ^ serial[3]
+
+
+class SimTag:
+    """A MIFARE Classic 1K tag, 64 blocks of 16 bytes with key A of each sector
+    in its trailer block.
+
+    Args:
+        serial (List[int]): 4 byte serial number
+    """
+
+    class States(enum.Enum):
+        """ISO 14443-3 tag states."""
+
+        IDLE = 0
+        READY = 1
+        ACTIVE = 2
+        HALT = 3
+
+    def __init__(self, serial: List[int]):
+        self.serial = serial
+        self.uid = serial + [_check_byte(serial)]
+        self.memory = [[0] * 16 for _ in range(64)]
+        self.memory[0] = self.uid + [0x08, 0x04, 0x00] + [0] * 8
+        for trailer in range(3, 64, 4):
+            self.memory[trailer] = list(TRAILER_DEFAULT)
+        self.state = self.States.IDLE
+        self._sector: Optional[int] = None
+        self._write_block: Optional[int] = None
+
+    def power_up(self):
+        """Resets the tag as it enters the field."""
+        self.state = self.States.IDLE
+        self._sector = None
+        self._write_block = None
+
+    def _drop(self):
+        # Unexpected frames put the tag back to idle
+        self.power_up()
+
+    def authenticate(self, block: int, key: List[int], serial: List[int]) -> bool:
+        if self.state is not self.States.ACTIVE or serial != self.serial:
+            self._drop()
+            return False
+        if key != self.memory[block // 4 * 4 + 3][:6]:
+            self._drop()
+            return False
+        self._sector = block // 4
+        return True
+
+    def receive(self, frame: List[int], bits: int) -> Optional[Tuple[List[int], int]]:
+        """Returns the answer to `frame` and its number of bits, or None if the
+        tag stays silent."""
+        # pylint: disable=too-many-return-statements
+        if bits == 7 and frame[0] in (pcd.PICC_REQA, pcd.PICC_WUPA):
+            if self.state is self.States.IDLE or (
+                self.state is self.States.HALT and frame[0] == pcd.PICC_WUPA
+            ):
+                self.state = self.States.READY
+                return [0x04, 0x00], 16
+            if self.state is not self.States.HALT:
+                self._drop()
+            return None
+        if self.state is self.States.READY:
+            if frame == [pcd.PICC_SELECT_CL1, 0x20]:
+                return list(self.uid), 40
+            if (
+                len(frame) == 9
+                and frame[:7] == [pcd.PICC_SELECT_CL1, 0x70] + self.uid
+                and crc_a(frame[:7]) == frame[7:]
+            ):
+                self.state = self.States.ACTIVE
+                return [0x08] + crc_a([0x08]), 24
+        elif self.state is self.States.ACTIVE and crc_a(frame[:-2]) == frame[-2:]:
+            return self._command(frame[:-2])
+        self._drop()
+        return None
+
+    def _command(self, data: List[int]) -> Optional[Tuple[List[int], int]]:
+        if self._write_block is not None and len(data) == 16:
+            self.memory[self._write_block] = list(data)
+            self._write_block = None
+            return [pcd.PICC_ACK], 4
+        if data == [pcd.PICC_HALT, 0]:
+            self.power_up()
+            self.state = self.States.HALT
+            return None
+        if len(data) == 2 and data[1] // 4 == self._sector:
+            if data[0] == pcd.PICC_READ:
+                content = self.memory[data[1]]
+                return content + crc_a(content), 144
+            if data[0] == pcd.PICC_WRITE:
+                self._write_block = data[1]
+                return [pcd.PICC_ACK], 4
+        self._drop()
+        return None
+
+
+class SimMFRC522Chip:
+    """Register model of an MFRC522 with an spidev-like `xfer2`.
+
+    The tag in the field is set with `tag`. Only the registers and commands
+    used by `Mfrc522Driver` are modelled.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self.registers = [0] * 64
+        self.fifo: List[int] = []
+        self.tag: Optional[SimTag] = None
+        # Virtual chip time in seconds
+        self.now = 0.0
+        self._response: Optional[Tuple[List[int], int]] = None
+        self._response_at: Optional[float] = None
+        self._timeout_at: Optional[float] = None
+        self._reset()
+
+    def _reset(self):
+        self.registers = [0] * 64
+        self.registers[pcd.COMMAND] = 0x20
+        self.registers[pcd.COM_IEN] = 0x80
+        self.registers[pcd.COM_IRQ] = 0x14
+        self.registers[pcd.MODE] = 0x3F
+        self.registers[pcd.TX_CONTROL] = 0x80
+        self.fifo = []
+        self._cancel()
+
+    def _cancel(self):
+        self._response = None
+        self._response_at = None
+        self._timeout_at = None
+
+    def insert(self, tag: Optional[SimTag]):
+        """Moves `tag` into the field, or removes the current tag if None."""
+        with self._lock:
+            if tag is not None:
+                tag.power_up()
+            self.tag = tag
+
+    def xfer2(self, data: List[int]) -> List[int]:
+        with self._lock:
+            self.now += TRANSACTION_SECONDS + BYTE_SECONDS * len(data)
+            address = (data[0] >> 1) & 0x3F
+            if not data[0] & 0x80:
+                for value in data[1:]:
+                    self._write(address, value)
+                return [0] * len(data)
+            result = [0]
+            for byte in data[1:]:
+                result.append(self._read(address))
+                address = (byte >> 1) & 0x3F
+            return result
+
+    def _timeout(self) -> float:
+        registers = self.registers
+        prescaler = (registers[pcd.T_MODE] & 0x0F) << 8 | registers[pcd.T_PRESCALER]
+        reload = registers[pcd.T_RELOAD_H] << 8 | registers[pcd.T_RELOAD_L]
+        return (reload + 1) * (2 * prescaler + 1) / CLOCK_HZ
+
+    def _update(self):
+        if self._response_at is not None and self.now >= self._response_at:
+            data, bits = self._response or ([], 0)
+            self.fifo = list(data)
+            self.registers[pcd.CONTROL] = bits % 8
+            self.registers[pcd.COM_IRQ] |= pcd.IRQ_IDLE | (pcd.IRQ_RX if data else 0)
+            self.registers[pcd.COMMAND] = pcd.CMD_IDLE
+            self._cancel()
+        elif self._timeout_at is not None and self.now >= self._timeout_at:
+            self.registers[pcd.COM_IRQ] |= pcd.IRQ_TIMER
+            self._cancel()
+
+    def _read(self, address: int) -> int:
+        self._update()
+        if address == pcd.FIFO_DATA:
+            return self.fifo.pop(0) if self.fifo else 0
+        if address == pcd.FIFO_LEVEL:
+            return len(self.fifo)
+        return self.registers[address]
+
+    def _write(self, address: int, value: int):
+        # pylint: disable=too-many-branches
+        if address == pcd.FIFO_DATA:
+            if len(self.fifo) < FIFO_SIZE:
+                self.fifo.append(value)
+        elif address == pcd.FIFO_LEVEL:
+            if value & 0x80:
+                self.fifo = []
+        elif address in (pcd.COM_IRQ, pcd.DIV_IRQ):
+            # Bit 7 tells whether the marked bits are set or cleared
+            if value & 0x80:
+                self.registers[address] |= value & 0x7F
+            else:
+                self.registers[address] &= ~value & 0xFF
+        elif address == pcd.COMMAND:
+            self.registers[address] = value
+            self._command(value & 0x0F)
+        elif address == pcd.BIT_FRAMING:
+            self.registers[address] = value & 0x7F
+            if value & 0x80 and self.registers[pcd.COMMAND] == pcd.CMD_TRANSCEIVE:
+                self._transmit(value & 0x07)
+        else:
+            self.registers[address] = value
+
+    def _command(self, command: int):
+        if command == pcd.CMD_SOFT_RESET:
+            self._reset()
+        elif command == pcd.CMD_IDLE:
+            self._cancel()
+        elif command == pcd.CMD_CALC_CRC:
+            low, high = crc_a(self.fifo)
+            self.fifo = []
+            self.registers[pcd.CRC_RESULT_L] = low
+            self.registers[pcd.CRC_RESULT_M] = high
+            self.registers[pcd.DIV_IRQ] |= pcd.IRQ_CRC
+            self.registers[pcd.COMMAND] = pcd.CMD_IDLE
+        elif command == pcd.CMD_AUTHENT:
+            fifo, self.fifo = self.fifo, []
+            if (
+                len(fifo) == 12
+                and self.tag is not None
+                and self.tag.authenticate(fifo[1], fifo[2:8], fifo[8:12])
+            ):
+                self.registers[pcd.STATUS2] |= pcd.MF_CRYPTO1_ON
+                self._answer(([], 0), AUTHENTICATION_SECONDS)
+            else:
+                self._answer(None, 0)
+
+    def _transmit(self, last_bits: int):
+        frame, self.fifo = self.fifo, []
+        if not frame:
+            return
+        self.registers[pcd.COM_IRQ] |= pcd.IRQ_TX
+        bits = (len(frame) - 1) * 8 + last_bits if last_bits else len(frame) * 8
+        self.now += bits * 9 / 8 * BIT_SECONDS
+        response = self.tag.receive(frame, bits) if self.tag is not None else None
+        delay = FRAME_DELAY_SECONDS
+        if response is not None:
+            delay += response[1] * 9 / 8 * BIT_SECONDS
+        self._answer(response, delay)
+
+    def _answer(self, response: Optional[Tuple[List[int], int]], delay: float):
+        # TAuto starts the timer at the end of the transmission
+        self._timeout_at = (
+            self.now + self._timeout() if self.registers[pcd.T_MODE] & 0x80 else None
+        )
+        self._response = response
+        self._response_at = self.now + delay if response is not None else None
+        if (
+            self._response_at is not None
+            and self._timeout_at is not None
+            and self._timeout_at < self._response_at
+        ):
+            self._response_at = None
+
+
+class SimMFRC522:
+    """Simulated drop-in for `mfrc522.SimpleMFRC522` with virtual tags.
+
+    Tags are presented to and removed from the antenna with `present` and
+    `remove`; texts written to a tag are kept per uid. All tag access goes
+    through the register model in `chip`, with the SPI traffic of the `mfrc522`
+    package, counted by `spi`.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._tags: Dict[int, SimTag] = {}
+        self.chip = SimMFRC522Chip()
+        self.spi = CountingSpi(self.chip)
+        self._driver = Mfrc522Driver(self.spi, legacy=True)
+        self._driver.init()
+        self.reads = 0
+        self.writes = 0
+
+    def present(self, uid: int, text: Optional[str] = None):
+        """Places tag `uid` on the reader.
+
+        Args:
+            uid (int): tag id as reported by `read`, see `tag_uid`
+            text (Optional[str], optional): new tag text, keeps the stored text if
+                None. Defaults to None.
+
+        Raises:
+            ValueError: if `uid` has no valid check byte
+        """
+        uid_bytes = list((uid & 0xFFFFFFFFFF).to_bytes(5, "big"))
+        if uid > 0xFFFFFFFFFF or _check_byte(uid_bytes) != uid_bytes[4]:
+            raise ValueError("invalid tag id {}, see tag_uid".format(uid))
+        with self._lock:
+            tag = self._tags.get(uid)
+            if tag is None or text is not None:
+                if tag is None:
+                    tag = self._tags[uid] = SimTag(uid_bytes[:4])
+                data = list(
+                    (text or "").ljust(TEXT_LENGTH)[:TEXT_LENGTH].encode("ascii")
+                )
+                for index, block in enumerate(pcd.TEXT_BLOCKS):
+                    tag.memory[block] = data[index * 16 : (index + 1) * 16]
+            self.chip.insert(tag)
+
+    def remove(self):
+        """Takes the current tag away from the reader."""
+        self.chip.insert(None)
+
+    def tag_text(self, uid: int) -> Optional[str]:
+        with self._lock:
+            tag = self._tags.get(uid)
+            if tag is None:
+                return None
+            return "".join(
+                chr(byte) for block in pcd.TEXT_BLOCKS for byte in tag.memory[block]
+            )
+
+    def _select(self) -> Optional[List[int]]:
+        if not self._driver.request():
+            return None
+        return self._driver.anticollision()
+
+    def read_id_no_block(self) -> Optional[int]:
+        with self._lock:
+            uid = self._select()
+            return None if uid is None else uid_to_num(uid)
+
+    def read_no_block(self) -> Tuple[Optional[int], Optional[str]]:
+        with self._lock:
+            self.reads += 1
+            uid = self._select()
+            if uid is None:
+                return None, None
+            driver = self._driver
+            driver.select(uid)
+            text = ""
+            if driver.authenticate(pcd.TEXT_TRAILER, pcd.DEFAULT_KEY, uid):
+                for block in pcd.TEXT_BLOCKS:
+                    text += "".join(
+                        chr(byte) for byte in driver.read_block(block) or []
+                    )
+            driver.stop_crypto()
+            return uid_to_num(uid), text
+
+    def read_id(self) -> int:
+        while True:
+            uid = self.read_id_no_block()
+            if uid is not None:
+                return uid
+            clock.sleep(POLL_INTERVAL)
+
+    def read(self) -> Tuple[int, str]:
+        while True:
+            uid, text = self.read_no_block()
+            if uid is not None:
+                return uid, text
+            clock.sleep(POLL_INTERVAL)
+
+    def write_no_block(self, text: str) -> Tuple[Optional[int], Optional[str]]:
+        with self._lock:
+            uid = self._select()
+            if uid is None:
+                return None, None
+            self.writes += 1
+            driver = self._driver
+            driver.select(uid)
+            if driver.authenticate(pcd.TEXT_TRAILER, pcd.DEFAULT_KEY, uid):
+                driver.read_block(pcd.TEXT_TRAILER)
+                data = list(text.ljust(TEXT_LENGTH).encode("ascii"))
+                for index, block in enumerate(pcd.TEXT_BLOCKS):
+                    driver.write_block(block, data[index * 16 : (index + 1) * 16])
+            driver.stop_crypto()
+            return uid_to_num(uid), text[:TEXT_LENGTH]
+
+    def write(self, text: str) -> Tuple[int, str]:
+        while True:
+            uid, written = self.write_no_block(text)
+            if uid is not None:
+                return uid, written
+            clock.sleep(POLL_INTERVAL)
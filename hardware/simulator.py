@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+
+from typing import Callable, List, Optional, Tuple
+from box_manager.led_manager import PIN_LED_GREEN, PIN_LED_RED
+from box_manager.photo_resistor import PIN_PHOTO_RESISTOR
+from hardware.backend import HardwareBackend
+from hardware.mfrc522_driver import CountingSpi
+from hardware.sim_gpio import SimGPIO
+from hardware.sim_mfrc522 import SimMFRC522
+from utils import clock
+
+
+class Simulator(HardwareBackend):
+    """Scriptable simulated box hardware.
+
+    Provides virtual tags, a virtual lid and a recorded LED timeline. All
+    timestamps are taken from `utils.clock`, so with `time_scale` > 1 the full
+    `BoxManager` flow runs accelerated while timings stay in simulated seconds.
+
+    Args:
+        time_scale (float, optional): speed-up of simulated time. Defaults to 1.0.
+    """
+
+    name = "sim"
+
+    def __init__(self, time_scale: float = 1.0):
+        clock.set_time_scale(time_scale)
+        self._gpio = SimGPIO(clock=clock.monotonic)
+        # One antenna shared by all readers created from this backend
+        self.reader = SimMFRC522()
+
+    def gpio(self) -> SimGPIO:
+        return self._gpio
+
+    def create_reader(self) -> SimMFRC522:
+        return self.reader
+
+    def reader_spi(self, reader: SimMFRC522) -> CountingSpi:
+        return reader.spi
+
+    def present_tag(self, uid: int, text: Optional[str] = None):
+        """Places tag `uid` on the reader, see `SimMFRC522.present`."""
+        self.reader.present(uid, text)
+
+    def remove_tag(self):  # pylint: disable=missing-function-docstring
+        self.reader.remove()
+
+    def open_lid(self, pin: int = PIN_PHOTO_RESISTOR):
+        """Opens the lid whose sensor is connected to `pin`."""
+        self._gpio.set_input(pin, SimGPIO.LOW)
+
+    def close_lid(self, pin: int = PIN_PHOTO_RESISTOR):
+        """Closes the lid whose sensor is connected to `pin`."""
+        self._gpio.set_input(pin, SimGPIO.HIGH)
+
+    def led_timeline(
+        self, pins: Tuple[int, ...] = (PIN_LED_GREEN, PIN_LED_RED)
+    ) -> List[Tuple[float, int, int]]:
+        """Returns the recorded LED changes.
+
+        Args:
+            pins (Tuple[int, ...], optional): LED pins of interest. Defaults to
+                the green and red LED.
+
+        Returns:
+            List[Tuple[float, int, int]]: (simulated time, pin, level) entries
+        """
+        return [event for event in self._gpio.output_history if event[1] in pins]
+
+    def first_led_change(self, pin: int, level: int, since: float) -> Optional[float]:
+        """Returns the simulated time `pin` was first set to `level` after `since`."""
+        for timestamp, _, event_level in self.led_timeline((pin,)):
+            if timestamp >= since and event_level == level:
+                return timestamp
+        return None
+
+    @staticmethod
+    def wait_until(
+        predicate: Callable[[], bool], timeout: float, interval: float = 0.01
+    ) -> bool:
+        """Waits for `predicate` to hold, in simulated time.
+
+        Args:
+            predicate (Callable[[], bool]): condition to wait for
+            timeout (float): simulated seconds to wait
+            interval (float, optional): simulated polling interval. Defaults to 0.01.
+
+        Returns:
+            bool: whether the predicate held within timeout
+        """
+        deadline = clock.monotonic() + timeout
+        while not predicate():
+            if clock.monotonic() >= deadline:
+                return False
+            clock.sleep(interval)
+        return True
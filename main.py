@@ -1,22 +1,92 @@
 #!/usr/bin/env python3
 # -*- coding: UTF-8 -*-
-import time
 import os
 import logging
 import argparse
 import ast
+import atexit
 import sys
+from typing import Any, Dict
 
-from box_manager.box_manager import BoxManager
-from utils.configure_reader import BOX_STATUS_REFRESH_INTERVAL
+from utils.startup import STARTUP
 
+# pylint: disable=wrong-import-position
+with STARTUP.phase("imports"):
+    from box_manager.box_manager import BoxManager
+    from utils import clock
+    from utils.diagnostics import Diagnostics, DEFAULT_DIRECTORY
+    from utils.metrics import LoopMonitor, MetricsServer, MetricsFileWriter
+    from utils.log_pipeline import (
+        configure_logging,
+        DEFAULT_BACKUP_COUNT,
+        DEFAULT_MAX_BYTES,
+        DEFAULT_RATE_INTERVAL,
+        LOG_DATE_FORMAT,
+        LOG_FORMAT,
+    )
+# pylint: enable=wrong-import-position
+
+logger = logging.getLogger(__name__)
+
+
+def _status(manager: BoxManager, monitor: LoopMonitor) -> Dict[str, Any]:
+    status = manager.status()
+    status["loop_interval"] = monitor.interval
+    status["last_loop_duration"] = monitor.last_duration
+    return status
 
-def main():  # pylint: disable=missing-function-docstring
+
+def main(  # pylint: disable=missing-function-docstring
+    runtime: str = "asyncio",
+    metrics_port: int = 0,
+    metrics_file: str = None,
+    diagnostics_socket: str = None,
+    diagnostics_dir: str = DEFAULT_DIRECTORY,
+    profile_startup: bool = False,
+):
+    if metrics_port:
+        MetricsServer(metrics_port).start()
+    if metrics_file:
+        MetricsFileWriter(metrics_file).start()
     with BoxManager() as manager:
-        manager.start()
-        while True:
-            manager.routine_loop()
-            time.sleep(BOX_STATUS_REFRESH_INTERVAL)
+        if profile_startup:
+            manager.start(background=False)
+            print(STARTUP.report())
+            return
+        scheduler = manager.poll_scheduler
+        if runtime == "asyncio":
+            # Imported here, the sync runtime does without asyncio
+            import asyncio  # pylint: disable=import-outside-toplevel
+            from box_manager.async_runtime import (  # pylint: disable=import-outside-toplevel
+                AsyncRuntime,
+            )
+
+            async_runtime = AsyncRuntime(manager)
+            monitor = async_runtime.loop_monitor
+        else:
+            monitor = LoopMonitor(scheduler.interval())
+        # Idle until a signal or a socket command arrives
+        diagnostics = Diagnostics(lambda: _status(manager, monitor), diagnostics_dir)
+        diagnostics.install_signals()
+        if diagnostics_socket:
+            diagnostics.serve(diagnostics_socket)
+        try:
+            if runtime == "asyncio":
+                asyncio.run(async_runtime.run())
+                return
+            manager.start()
+            while True:
+                with monitor.iteration():
+                    try:
+                        manager.routine_loop()
+                    except Exception:  # pylint: disable=broad-except
+                        # One failed tick must not stop the box
+                        logger.exception("Routine loop failed.")
+                scheduler.record(monitor.last_duration)
+                monitor.interval = scheduler.interval()
+                clock.sleep(monitor.interval)
+        finally:
+            diagnostics.close()
 
 
 if __name__ == "__main__":
@@ -43,23 +113,128 @@ if __name__ == "__main__":
         help="log path",
     )
 
+    parser.add_argument(
+        "--runtime",
+        type=str,
+        dest="runtime",
+        required=False,
+        default="asyncio",
+        choices=["asyncio", "sync"],
+        help="asyncio runs polling, lid monitoring and sessions concurrently; "
+        "sync runs the blocking poll loop.",
+    )
+
+    parser.add_argument(
+        "--metrics-port",
+        type=int,
+        dest="metrics_port",
+        required=False,
+        default=0,
+        help="Serve Prometheus metrics on this local port, 0 to disable.",
+    )
+
+    parser.add_argument(
+        "--metrics-file",
+        type=str,
+        dest="metrics_file",
+        required=False,
+        default=None,
+        help="Periodically write Prometheus metrics to this file.",
+    )
+
+    parser.add_argument(
+        "--sync-log",
+        action="store_true",
+        dest="sync_log",
+        help="Write log records synchronously from the calling thread.",
+    )
+
+    parser.add_argument(
+        "--log-max-bytes",
+        type=int,
+        dest="log_max_bytes",
+        required=False,
+        default=DEFAULT_MAX_BYTES,
+        help="Rotate the log file at this size.",
+    )
+
+    parser.add_argument(
+        "--log-backups",
+        type=int,
+        dest="log_backups",
+        required=False,
+        default=DEFAULT_BACKUP_COUNT,
+        help="Number of rotated log files kept.",
+    )
+
+    parser.add_argument(
+        "--log-rate-interval",
+        type=float,
+        dest="log_rate_interval",
+        required=False,
+        default=DEFAULT_RATE_INTERVAL,
+        help="Emit identical log messages at most once per this many seconds, "
+        "summarizing repeats. 0 disables rate limiting.",
+    )
+
+    parser.add_argument(
+        "--diagnostics-socket",
+        type=str,
+        dest="diagnostics_socket",
+        required=False,
+        default=None,
+        help="Accept diagnostics commands on this Unix socket, see "
+        "utils/diagnostics.py. SIGUSR1 and SIGUSR2 work without it.",
+    )
+
+    parser.add_argument(
+        "--diagnostics-dir",
+        type=str,
+        dest="diagnostics_dir",
+        required=False,
+        default=DEFAULT_DIRECTORY,
+        help="Directory for stack dumps and profiles.",
+    )
+
+    parser.add_argument(
+        "--profile-startup",
+        action="store_true",
+        dest="profile_startup",
+        help="Start the box, log in to the backend, print the time spent in each "
+        "startup phase and exit.",
+    )
+
     args = vars(parser.parse_args(sys.argv[1:]))
 
-    LOGLEVEL = os.environ.get("LOGLEVEL", "INFO").upper()
-    if args["background"]:
+    LOGLEVEL = os.environ.get(
+        "LOGLEVEL", "INFO" if args["background"] else "DEBUG"
+    ).upper()
+    log_path = args["log_path"] if args["background"] else None
+    if args["sync_log"]:
         logging.basicConfig(
             level=LOGLEVEL,
-            format="[%(asctime)s] [%(levelname)s] %(filename)s: %(message)s",
-            datefmt="%Y-%m-%d %H:%M:%S",
-            filename=args["log_path"],
+            format=LOG_FORMAT,
+            datefmt=LOG_DATE_FORMAT,
+            filename=log_path,
             filemode="a",
         )
-
     else:
-        logging.basicConfig(
-            level=os.environ.get("LOGLEVEL", "DEBUG").upper(),
-            format="[%(asctime)s] [%(levelname)s] %(filename)s: %(message)s",
-            datefmt="%Y-%m-%d %H:%M:%S",
+        # The box loops only enqueue records, disk I/O happens on the listener
+        atexit.register(
+            configure_logging(
+                LOGLEVEL,
+                log_path,
+                max_bytes=args["log_max_bytes"],
+                backup_count=args["log_backups"],
+                rate_interval=args["log_rate_interval"],
+            ).stop
         )
 
-    main()
+    main(
+        args["runtime"],
+        args["metrics_port"],
+        args["metrics_file"],
+        args["diagnostics_socket"],
+        args["diagnostics_dir"],
+        args["profile_startup"],
+    )
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+
+from collections import OrderedDict
+from typing import Dict, List, NamedTuple, Optional
+import enum
+import logging
+from rfid_manager.reader import RfidReader
+from utils import clock
+from utils.metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_COOLDOWN = 3.0
+DEFAULT_ABSENCE_GRACE = 0.6
+DEFAULT_TOKEN_CACHE_SIZE = 64
+
+_EVENTS = REGISTRY.counter(
+    "rfid_presence_events_total", "Tag presence events by kind.", ["kind"]
+)
+
+
+class TagEventKind(enum.Enum):
+    """Kind of tag presence event"""
+
+    ARRIVED = 0
+    LEFT = 1
+
+
+class TagEvent(NamedTuple):
+    """Tag presence change reported by `TagPresenceTracker.poll`"""
+
+    kind: TagEventKind
+    uid: int
+    token: Optional[str]
+    timestamp: float
+
+
+class TagPresenceTracker:
+    """Turns raw reader polls into "tag arrived" / "tag left" events.
+
+    A tag staying on the reader is reported once. It is considered gone only
+    after it has not been seen for `absence_grace` seconds, since the MFRC522
+    does not answer every poll. A tag coming back within `cooldown` seconds of
+    its last arrival is suppressed. A tag only arrives once its text was read,
+    reads without text do not count. Tag texts are cached per uid.
+
+    Args:
+        reader (RfidReader): reader to poll
+        cooldown (float, optional): seconds before the same uid may arrive again.
+            Defaults to DEFAULT_COOLDOWN.
+        absence_grace (float, optional): seconds without a read before a tag is
+            considered gone. Defaults to DEFAULT_ABSENCE_GRACE.
+        token_cache_size (int, optional): max. number of cached uid texts.
+            Defaults to DEFAULT_TOKEN_CACHE_SIZE.
+    """
+
+    def __init__(
+        self,
+        reader: RfidReader,
+        cooldown: float = DEFAULT_COOLDOWN,
+        absence_grace: float = DEFAULT_ABSENCE_GRACE,
+        token_cache_size: int = DEFAULT_TOKEN_CACHE_SIZE,
+    ):
+        self._reader = reader
+        self._cooldown = cooldown
+        self._absence_grace = absence_grace
+        self._token_cache_size = token_cache_size
+
+        self._present: Optional[int] = None
+        self._last_seen = 0.0
+        self._last_arrival: Dict[int, float] = {}
+        self._tokens: "OrderedDict[int, str]" = OrderedDict()
+
+    @property
+    def present(self) -> Optional[int]:
+        """Returns the uid of the tag currently on the reader, if any."""
+        return self._present
+
+    def cached_token(self, uid: int) -> Optional[str]:
+        """Returns the last text read from tag `uid`, if cached."""
+        return self._tokens.get(uid)
+
+    def _cache_token(self, uid: int, token: str):
+        self._tokens[uid] = token
+        self._tokens.move_to_end(uid)
+        while len(self._tokens) > self._token_cache_size:
+            self._tokens.popitem(last=False)
+
+    def _emit(self, kind: TagEventKind, uid: int, now: float) -> TagEvent:
+        _EVENTS.labels(kind.name).inc()
+        logger.debug("Tag %s %s.", uid, kind.name.lower())
+        return TagEvent(kind, uid, self._tokens.get(uid), now)
+
+    def poll(self) -> List[TagEvent]:
+        """Polls the reader once.
+
+        Returns:
+            List[TagEvent]: presence changes since the last poll, oldest first
+        """
+        uid, token = self._reader.read()
+        now = clock.monotonic()
+        events: List[TagEvent] = []
+        text = token.strip() if token is not None else ""
+        if uid is not None and uid != self._present and not text:
+            # E.g. a failed authentication. The tag arrives with its first
+            # complete read, so that it is never authorized without its token.
+            logger.debug("Tag %s read without text.", uid)
+            uid = None
+
+        if uid is None:
+            if (
+                self._present is not None
+                and now - self._last_seen >= self._absence_grace
+            ):
+                events.append(self._emit(TagEventKind.LEFT, self._present, now))
+                self._present = None
+            return events
+
+        if text:
+            self._cache_token(uid, text)
+        self._last_seen = now
+        if uid == self._present:
+            return events
+        if self._present is not None:
+            events.append(self._emit(TagEventKind.LEFT, self._present, now))
+        self._present = uid
+
+        last_arrival = self._last_arrival.get(uid)
+        if last_arrival is not None and now - last_arrival < self._cooldown:
+            logger.debug("Tag %s suppressed, within cooldown.", uid)
+            return events
+        self._last_arrival[uid] = now
+        # Expired entries are only kept to suppress bounces, drop them
+        for stale in [
+            u for u, t in self._last_arrival.items() if now - t >= self._cooldown
+        ]:
+            if stale != uid:
+                del self._last_arrival[stale]
+        events.append(self._emit(TagEventKind.ARRIVED, uid, now))
+        return events
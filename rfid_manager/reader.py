@@ -1,9 +1,29 @@
 #!/usr/bin/env python3
 # -*- coding: UTF-8 -*-
 
-from typing import Tuple, Optional
-from mfrc522 import SimpleMFRC522
+from threading import Lock
+from typing import OrderedDict, Tuple, Optional
+from hardware.backend import get_backend
+from hardware.mfrc522_driver import Mfrc522Driver, TEXT_BLOCKS, uid_to_num
+from utils import clock
 from utils.manager_base import ManagerBase
+from utils.metrics import REGISTRY
+
+READ_MODE_CLASSIC = "classic"
+READ_MODE_UID_FIRST = "uid_first"
+READ_MODES = (READ_MODE_CLASSIC, READ_MODE_UID_FIRST)
+DEFAULT_READ_MODE = READ_MODE_CLASSIC
+DEFAULT_TEXT_CACHE_SIZE = 64
+# Length of the text stored on a tag, space padded
+TEXT_LENGTH = len(TEXT_BLOCKS) * 16
+POLL_INTERVAL = 0.05
+
+_READ_SECONDS = REGISTRY.histogram(
+    "rfid_read_seconds", "Duration of non-blocking RFID reads."
+)
+_BLOCK_READS = REGISTRY.counter(
+    "rfid_block_reads_total", "Tag data reads, i.e. authenticated block reads."
+)
 
 
 class RfidReader(ManagerBase):
@@ -11,12 +31,45 @@ class RfidReader(ManagerBase):
 
     Should always be used as `with RfidReader() as reader` to ensure clean exit
 
+    In the "classic" mode every `read` selects the tag, authenticates and reads
+    its text, like `mfrc522.SimpleMFRC522.read_no_block`. In the "uid_first"
+    mode `read` only probes for the uid of the tag in the field, and reads the
+    text when a tag arrives. Texts are cached per uid, and the resting tag is
+    kept halted so that it answers the next probe right away.
+
+    The SPI traffic to the reader is counted by `spi`.
+
     Args:
-        metaclass (_type_, optional): _description_. Defaults to Singleton.
+        mode (str, optional): "classic" or "uid_first". Defaults to
+            DEFAULT_READ_MODE.
+        text_cache_size (int, optional): max. number of cached uid texts.
+            Defaults to DEFAULT_TEXT_CACHE_SIZE.
+
+    Raises:
+        ValueError: if the mode is unknown
     """
 
-    def __init__(self):
-        self.reader = SimpleMFRC522()
+    def __init__(
+        self,
+        mode: str = DEFAULT_READ_MODE,
+        text_cache_size: int = DEFAULT_TEXT_CACHE_SIZE,
+    ):
+        if mode not in READ_MODES:
+            raise ValueError("Unknown RFID read mode {}".format(mode))
+        backend = get_backend()
+        self.reader = backend.create_reader()
+        self.spi = backend.reader_spi(self.reader)
+        self.mode = mode
+        self._driver: Optional[Mfrc522Driver] = None
+        if mode == READ_MODE_UID_FIRST:
+            self._driver = Mfrc522Driver(self.spi)
+        # Serializes the driver calls
+        self._lock = Lock()
+        self._texts: OrderedDict[int, str] = OrderedDict()
+        self._text_cache_size = text_cache_size
+        # Uid answering the last probe
+        self._present: Optional[int] = None
+        self._parked = False
 
     def blocked_read(self) -> Tuple[int, str]:
         """Reads any tag once. Blocks when no card is read.
@@ -24,8 +77,15 @@ class RfidReader(ManagerBase):
         Returns:
             Tuple[int, str]: the uid and the text in the tag
         """
-        return self.reader.read()
+        if self._driver is None:
+            return self.reader.read()
+        while True:
+            uid, text = self.read()
+            if uid is not None and text is not None:
+                return uid, text
+            clock.sleep(POLL_INTERVAL)
 
+    @_READ_SECONDS.time()
     def read(self) -> Tuple[Optional[int], Optional[str]]:
         """Reads any tag. Returns id == None if no card presents.
 
@@ -33,15 +93,88 @@ class RfidReader(ManagerBase):
             Tuple[Opeional[int], Optional[str]]: the uid and the text in
             the tag. None for no card presents.
         """
-        return self.reader.read_no_block()
-
-    def write(self, text: str) -> None:
-        """Writes any tag once
+        if self._driver is None:
+            _BLOCK_READS.inc()
+            return self.reader.read_no_block()
+        with self._lock:
+            return self._read_uid_first(self._driver)
+
+    def _read_uid_first(
+        self, driver: Mfrc522Driver
+    ) -> Tuple[Optional[int], Optional[str]]:
+        # A tag parked on the last poll answers the first wake-up
+        uid_bytes = driver.probe(retry=not self._parked and self._present is not None)
+        if uid_bytes is None:
+            self._present = None
+            self._parked = False
+            return None, None
+        uid = uid_to_num(uid_bytes)
+        if uid == self._present:
+            self._parked = driver.park(uid_bytes)
+            return uid, self._texts.get(uid)
+
+        _BLOCK_READS.inc()
+        data = driver.read_blocks(uid_bytes)
+        if data is None:
+            # Read again on the next poll, the tag may have moved off the antenna
+            self._present = None
+            self._parked = False
+            return uid, self._texts.get(uid)
+        self._present = uid
+        self._parked = True
+        text = "".join(chr(byte) for byte in data)
+        self._texts[uid] = text
+        self._texts.move_to_end(uid)
+        while len(self._texts) > self._text_cache_size:
+            self._texts.popitem(last=False)
+        return uid, text
+
+    def write(self, text: str) -> Tuple[int, str]:
+        """Writes any tag once. Blocks when no card is read.
 
         Args:
             text (str): text to be writen
+
+        Returns:
+            Tuple[int, str]: the uid of the written tag and the text written
+        """
+        if self._driver is None:
+            return self.reader.write(text)
+        while True:
+            uid, written = self.write_no_block(text)
+            if uid is not None:
+                return uid, written
+            clock.sleep(POLL_INTERVAL)
+
+    def write_no_block(self, text: str) -> Tuple[Optional[int], Optional[str]]:
+        """Writes the tag on the reader once. Returns id == None if no card
+        presents or the write failed.
+
+        Args:
+            text (str): text to be writen, at most TEXT_LENGTH characters are
+                stored
+
+        Returns:
+            Tuple[Optional[int], Optional[str]]: the uid of the written tag and
+            the text written
         """
-        self.reader.write(text)
+        if self._driver is None:
+            return self.reader.write_no_block(text)
+        data = list(text.ljust(TEXT_LENGTH)[:TEXT_LENGTH].encode("ascii"))
+        with self._lock:
+            # The tag may be halted, e.g. by the last `read`
+            uid_bytes = self._driver.probe(retry=True)
+            written = uid_bytes is not None and self._driver.write_blocks(
+                uid_bytes, data
+            )
+            # Read back in full on the next poll
+            self._present = None
+            self._parked = False
+            if not written:
+                return None, None
+            uid = uid_to_num(uid_bytes)
+            self._texts.pop(uid, None)
+            return uid, text[:TEXT_LENGTH]
 
 
 def main():
@@ -0,0 +1,21 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+"""Shared fixtures. Tests run on the simulated hardware backend."""
+
+import os
+import sys
+
+import pytest
+
+# The modules are imported from the repository root, like main.py does
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# pylint: disable=wrong-import-position
+from hardware.backend import select_backend
+from hardware.simulator import Simulator
+
+
+@pytest.fixture
+def sim() -> Simulator:
+    """Selects a fresh simulated backend."""
+    return select_backend("sim")
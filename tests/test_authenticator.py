@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+# pylint: disable=missing-function-docstring
+
+import pytest
+
+from benchmarks.stub_backend import StubBackend
+from utils.authenticator import Authenticator
+
+
+@pytest.fixture
+def backend():
+    with StubBackend() as stub:
+        stub.add_box("box", "secret")
+        yield stub
+
+
+def _authenticator(backend: StubBackend) -> Authenticator:
+    return Authenticator.create(backend.url, timeout=(0.5, 0.5))
+
+
+def test_failed_relogin_keeps_jwt(backend):
+    authenticator = _authenticator(backend)
+    assert authenticator.login("box", "secret")
+    jwt = authenticator.jwt_cookie
+    backend.add_box("box", "changed")
+
+    assert not authenticator.refresh_session()
+    assert authenticator.jwt_cookie is jwt
+    authenticator.close()
+
+
+def test_refresh_without_backend_fails(backend):
+    authenticator = _authenticator(backend)
+    assert authenticator.login("box", "secret")
+    # Nothing listens there, the stub would keep serving pooled connections
+    authenticator.url = "http://127.0.0.1:1"
+
+    assert not authenticator.refresh_session()
+    authenticator.close()
+
+
+def test_auth_without_backend_denies(backend):
+    authenticator = _authenticator(backend)
+    assert authenticator.login("box", "secret")
+    authenticator.url = "http://127.0.0.1:1"
+
+    assert not authenticator.auth("box", "token")
+    assert authenticator.auth_cache.get("box", "token") is None
+    assert not authenticator.update_box("box", "token")
+    assert authenticator.fetch_grants("box") is None
+    authenticator.close()
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+# pylint: disable=missing-function-docstring,redefined-outer-name
+
+import time
+from unittest import mock
+
+import pytest
+
+from benchmarks.stub_backend import StubBackend
+from box_manager.box_manager import BoxManager
+from utils.authenticator import Authenticator
+from utils.command_channel import CommandChannel, parse_events
+from utils.state_machine import StateMachine
+
+BOX = "box"
+
+
+def _until(predicate, timeout: float = 5.0) -> bool:
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+@pytest.fixture
+def manager():
+    compartment = mock.Mock()
+    compartment.id = "c1"
+    compartment.try_open.return_value = True
+    compartment.reset.return_value = True
+    manager = BoxManager.__new__(BoxManager)
+    manager.compartments = [compartment]
+    # pylint: disable=protected-access
+    manager._machine = StateMachine(BoxManager.transitions, BoxManager.States.STANDBY)
+    manager._journal = None
+    manager._sessions = mock.Mock()
+    manager._config = mock.Mock()
+    manager._config.reload.return_value = True
+    return manager
+
+
+@pytest.fixture
+def channel(manager):
+    with StubBackend(heartbeat=0.1) as backend:
+        backend.add_box(BOX, "secret")
+        authenticator = Authenticator.create(backend.url, timeout=(0.5, 0.5))
+        assert authenticator.login(BOX, "secret")
+        channel = CommandChannel(
+            lambda cursor: authenticator.open_command_stream(BOX, cursor, 1.0),
+            manager.handle_command,
+            backoff_base=0.05,
+        )
+        channel.start()
+        yield backend, channel
+        channel.stop()
+        authenticator.close()
+
+
+def test_parse_events_skips_heartbeats():
+    lines = [": heartbeat", "", "id: 1", "event: command", 'data: {"a":', "data: 1}", ""]
+    assert list(parse_events(lines)) == [("1", "command", '{"a":\n1}')]
+
+
+def test_commands_are_dispatched(manager, channel):
+    backend, _ = channel
+    compartment = manager.compartments[0]
+    backend.push_command(BOX, {"type": "open", "compartment": "c1"})
+    backend.push_command(BOX, {"type": "reset", "compartment": "c1"})
+    backend.push_command(BOX, {"type": "reload_config"})
+
+    # pylint: disable-next=protected-access
+    assert _until(lambda: manager._config.reload.called)
+    compartment.try_open.assert_called_once()
+    compartment.reset.assert_called_once()
+
+
+def test_channel_resumes_after_dropped_stream(manager, channel):
+    backend, commands = channel
+    compartment = manager.compartments[0]
+    backend.push_command(BOX, {"type": "open"})
+    assert _until(lambda: commands.cursor == "1")
+
+    backend.drop_streams()
+    backend.push_command(BOX, {"type": "reset", "compartment": "c1"})
+    assert _until(lambda: commands.cursor == "2")
+    compartment.reset.assert_called_once()
+    # Resumed after the last command, nothing is replayed
+    compartment.try_open.assert_called_once()
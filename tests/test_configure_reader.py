@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+# pylint: disable=missing-function-docstring
+
+import pytest
+import yaml
+
+from utils.configure_reader import ConfigError, ConfigSnapshot, ConfigureReader
+
+ENTRIES = {
+    "name": "box",
+    "id": "box",
+    "password": "secret",
+    "address": "here",
+    "backend_url": "http://localhost",
+}
+
+
+def test_idle_rate_above_active_rate_is_rejected():
+    with pytest.raises(ConfigError):
+        ConfigSnapshot(dict(ENTRIES, poll_active_rate=5.0, poll_idle_rate=10.0))
+    # The other rate keeps its default, 20 active and 2 idle
+    with pytest.raises(ConfigError):
+        ConfigSnapshot(dict(ENTRIES, poll_idle_rate=30.0))
+    ConfigSnapshot(dict(ENTRIES, poll_active_rate=5.0, poll_idle_rate=5.0))
+
+
+def test_default_pins_collide():
+    with pytest.raises(ConfigError):
+        ConfigSnapshot(dict(ENTRIES, compartments=[{"id": "a"}, {"id": "b"}]))
+    with pytest.raises(ConfigError):
+        ConfigSnapshot(dict(ENTRIES, compartments=[{"id": "a", "pin_lid": 11}]))
+    ConfigSnapshot(
+        dict(
+            ENTRIES,
+            compartments=[
+                {"id": "a"},
+                {"id": "b", "pin_green": 15, "pin_red": 16, "pin_lid": 18},
+            ],
+        )
+    )
+
+
+def test_reload_keeps_config_with_bad_rates(tmp_path):
+    path = tmp_path / "config.yaml"
+    path.write_text(yaml.safe_dump(dict(ENTRIES, poll_active_rate=20.0)))
+    reader = ConfigureReader(str(path), cache=False)
+
+    path.write_text(yaml.safe_dump(dict(ENTRIES, poll_active_rate=1.0)))
+    assert not reader.reload()
+    assert reader.get("poll_active_rate") == 20.0
@@ -0,0 +1,21 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+# pylint: disable=missing-function-docstring
+
+import os
+import stat
+
+from utils.diagnostics import Diagnostics
+
+
+def test_socket_is_owner_only(tmp_path):
+    path = str(tmp_path / "box.sock")
+    umask = os.umask(0o022)
+    diagnostics = Diagnostics(lambda: {}, str(tmp_path))
+    try:
+        diagnostics.serve(path)
+        assert stat.S_IMODE(os.stat(path).st_mode) & 0o077 == 0
+        assert os.umask(0o022) == 0o022
+    finally:
+        diagnostics.close()
+        os.umask(umask)
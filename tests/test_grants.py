@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+# pylint: disable=missing-function-docstring
+
+import base64
+import time
+
+import pytest
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ed25519
+
+from utils.grants import GrantIndex, GrantSync, GrantVerifier, grant_payload
+
+BOX = "box"
+
+
+@pytest.fixture
+def key():
+    return ed25519.Ed25519PrivateKey.generate()
+
+
+@pytest.fixture
+def index(key, tmp_path):
+    pem = (
+        key.public_key()
+        .public_bytes(
+            serialization.Encoding.PEM, serialization.PublicFormat.SubjectPublicKeyInfo
+        )
+        .decode("utf-8")
+    )
+    verifier = GrantVerifier(pem)
+    return GrantIndex(BOX, lambda: verifier, str(tmp_path / "grants.json"))
+
+
+def _grant(key, token: str):
+    expires = int(time.time()) + 3600
+    signature = key.sign(grant_payload(BOX, token, expires))
+    return {
+        "token": token,
+        "expires": expires,
+        "signature": base64.b64encode(signature).decode("ascii"),
+    }
+
+
+def test_malformed_grants_are_dropped(key, index):
+    good = _grant(key, "good")
+    bad = [
+        {"token": "no-expiry", "signature": good["signature"]},
+        dict(_grant(key, "bad-signature"), signature="not base64!"),
+        dict(_grant(key, "text-expiry"), expires="soon"),
+        "not a grant",
+    ]
+    assert GrantSync(index, lambda: bad + [good]).sync()
+
+    assert index.lookup("good")
+    for token in ["no-expiry", "bad-signature", "text-expiry"]:
+        assert index.lookup(token) is None
+
+
+def test_malformed_response_keeps_sync_alive(index):
+    assert not GrantSync(index, lambda: {"grants": []}).sync()
+
+
+def test_undecodable_signature_is_no_grant(key, index):
+    index.update([_grant(key, "token")])
+    # pylint: disable-next=protected-access
+    index._grants["token"][1] = "abc"
+
+    assert index.lookup("token") is None
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+# pylint: disable=missing-function-docstring
+
+import os
+from threading import Thread
+
+import pytest
+
+from utils.journal import EventJournal, EventKind
+
+
+def _fill(directory: str, count: int, segment_size: int = 200):
+    journal = EventJournal(directory, segment_size, retention_days=0)
+    for i in range(count):
+        journal.append(EventKind.OPENED, "c1", i, "token-{}".format(i), "", 1000.0 + i)
+    journal.close()
+
+
+def _uids(journal: EventJournal):
+    return sorted(event.uid for event in journal.query())
+
+
+def test_rolled_segments_compact_in_background(tmp_path):
+    _fill(str(tmp_path), 50)
+    journal = EventJournal(str(tmp_path), 200, retention_days=0)
+    assert _uids(journal) == list(range(50))
+    journal.close()
+
+
+def test_compact_merges_small_segments(tmp_path):
+    _fill(str(tmp_path), 30)
+    journal = EventJournal(str(tmp_path), 100000, retention_days=0)
+    segments = journal.stats()["segments"]
+    assert journal.compact() == segments - 2
+    assert journal.stats()["segments"] == 2
+    assert _uids(journal) == list(range(30))
+    journal.close()
+
+
+def test_failed_merge_keeps_events(tmp_path, monkeypatch):
+    _fill(str(tmp_path), 30)
+    journal = EventJournal(str(tmp_path), 100000, retention_days=0)
+    replace = os.replace
+
+    def power_loss(src, dst):
+        if src.endswith(".seg.tmp"):
+            raise OSError("power loss")
+        replace(src, dst)
+
+    monkeypatch.setattr(os, "replace", power_loss)
+    with pytest.raises(OSError):
+        journal.compact()
+    monkeypatch.setattr(os, "replace", replace)
+    journal.close()
+
+    assert _uids(EventJournal(str(tmp_path), read_only=True)) == list(range(30))
+
+
+def test_compaction_waits_for_open_queries(tmp_path):
+    _fill(str(tmp_path), 30)
+    journal = EventJournal(str(tmp_path), 100000, retention_days=0)
+    events = journal.query()
+    first = next(events)
+    compactor = Thread(target=journal.compact)
+    compactor.start()
+    compactor.join(0.2)
+    assert compactor.is_alive()
+    assert [first.uid] + [event.uid for event in events] == list(range(30))
+    compactor.join(5)
+    assert journal.stats()["segments"] == 2
+    journal.close()
+
+
+def test_read_only_query_resumes_after_compaction(tmp_path):
+    _fill(str(tmp_path), 30)
+    reader = EventJournal(str(tmp_path), read_only=True)
+    events = reader.query()
+    first = next(events)
+    # The box compacting meanwhile, from another process
+    writer = EventJournal(str(tmp_path), 100000, retention_days=0)
+    writer.compact()
+    writer.close()
+    assert [first.uid] + [event.uid for event in events] == list(range(30))
+
+
+def test_read_only_journal_writes_no_index(tmp_path):
+    _fill(str(tmp_path), 30)
+    index_path = os.path.join(str(tmp_path), "00000000.idx")
+    os.remove(index_path)
+    assert _uids(EventJournal(str(tmp_path), read_only=True)) == list(range(30))
+    assert not os.path.exists(index_path)
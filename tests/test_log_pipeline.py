@@ -0,0 +1,30 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+# pylint: disable=missing-function-docstring
+
+import logging
+import queue
+
+from utils.log_pipeline import RateLimitingQueueHandler
+
+
+def _record(name: str, level: int, lineno: int, msg: str = "Read failed: %s"):
+    return logging.LogRecord(name, level, "box.py", lineno, msg, ("timeout",), None)
+
+
+def test_repeats_of_one_call_site_are_limited():
+    log_queue = queue.Queue()
+    handler = RateLimitingQueueHandler(log_queue, rate_interval=60.0)
+    for _ in range(3):
+        handler.emit(_record("box", logging.WARNING, 10))
+    assert log_queue.qsize() == 1
+
+
+def test_call_sites_are_limited_separately():
+    log_queue = queue.Queue()
+    handler = RateLimitingQueueHandler(log_queue, rate_interval=60.0)
+    handler.emit(_record("box", logging.WARNING, 10))
+    handler.emit(_record("box", logging.WARNING, 20))
+    handler.emit(_record("box", logging.ERROR, 10))
+    handler.emit(_record("reader", logging.WARNING, 10))
+    assert log_queue.qsize() == 4
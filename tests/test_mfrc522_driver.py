@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+# pylint: disable=missing-function-docstring
+
+import pytest
+
+from hardware.mfrc522_driver import (
+    DEFAULT_KEY,
+    TEXT_BLOCKS,
+    TEXT_TRAILER,
+    CountingSpi,
+    Mfrc522Driver,
+    crc_a,
+    uid_to_num,
+)
+from hardware.sim_mfrc522 import SimMFRC522Chip, SimTag, tag_uid
+
+SERIAL = [0x12, 0x34, 0x56, 0x78]
+
+
+@pytest.fixture
+def chip():
+    return SimMFRC522Chip()
+
+
+@pytest.fixture
+def driver(chip):
+    driver = Mfrc522Driver(CountingSpi(chip))
+    driver.init()
+    return driver
+
+
+def test_crc_a():
+    # HLTA as sent on the air
+    assert crc_a([0x50, 0x00]) == [0x57, 0xCD]
+
+
+def test_probe_without_tag(driver):
+    assert driver.probe(retry=True) is None
+
+
+def test_probe_returns_uid(chip, driver):
+    chip.insert(SimTag(SERIAL))
+    uid = driver.probe()
+    assert uid_to_num(uid) == tag_uid(0x12345678)
+    assert chip.tag.state is SimTag.States.READY
+
+
+def test_parked_tag_answers_next_probe(chip, driver):
+    chip.insert(SimTag(SERIAL))
+    uid = driver.probe()
+    assert driver.park(uid)
+    assert chip.tag.state is SimTag.States.HALT
+    assert driver.probe() == uid
+
+
+def test_read_blocks(chip, driver):
+    tag = SimTag(SERIAL)
+    for block in TEXT_BLOCKS:
+        tag.memory[block] = [block] * 16
+    chip.insert(tag)
+
+    data = driver.read_blocks(driver.probe())
+    assert data == [block for block in TEXT_BLOCKS for _ in range(16)]
+    assert tag.state is SimTag.States.HALT
+
+
+def test_write_blocks_reads_back(chip, driver):
+    chip.insert(SimTag(SERIAL))
+    data = list(range(16 * len(TEXT_BLOCKS)))
+
+    assert driver.write_blocks(driver.probe(), data)
+    assert driver.read_blocks(driver.probe()) == data
+
+
+def test_wrong_key_fails_read(chip, driver):
+    tag = SimTag(SERIAL)
+    tag.memory[TEXT_TRAILER][:6] = [0] * 6
+    chip.insert(tag)
+
+    assert driver.read_blocks(driver.probe(), key=DEFAULT_KEY) is None
+    assert driver.probe() is not None
+
+
+def test_removed_tag_fails_read(chip, driver):
+    chip.insert(SimTag(SERIAL))
+    uid = driver.probe()
+    chip.insert(None)
+    assert driver.read_blocks(uid) is None
@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+# pylint: disable=missing-function-docstring
+
+import threading
+
+import pytest
+
+from box_manager.photo_resistor import PhotoResistor
+from hardware.sim_gpio import SimGPIO
+
+PIN = 13
+
+
+@pytest.fixture
+def gpio():
+    return SimGPIO()
+
+
+@pytest.fixture
+def sensor(gpio):
+    with PhotoResistor(PIN, edge_triggered=True, debounce=0.02, gpio=gpio) as sensor:
+        yield sensor
+
+
+def _bounce(gpio: SimGPIO, level: int, edges: int = 20):
+    for i in range(edges):
+        gpio.set_input(PIN, i % 2)
+    gpio.set_input(PIN, level)
+
+
+def test_bouncing_edges_settle_once(gpio, sensor):
+    threads = threading.active_count()
+    _bounce(gpio, gpio.LOW)
+    assert threading.active_count() == threads
+    assert sensor.is_closed()
+
+    assert sensor.wait_for_state(False, timeout=1.0)
+    assert sensor.wait_for_transition(timeout=0.1) is None
+
+
+def test_transition_during_wait_is_seen(gpio, sensor):
+    waiting = threading.Event()
+    result = []
+
+    def wait():
+        waiting.set()
+        result.append(sensor.wait_for_transition(timeout=1.0))
+
+    waiter = threading.Thread(target=wait)
+    waiter.start()
+    waiting.wait()
+    gpio.set_input(PIN, gpio.LOW)
+    waiter.join()
+    assert result == [False]
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+# pylint: disable=missing-function-docstring
+
+from unittest import mock
+
+from box_manager.box_manager import BoxManager
+from hardware.mfrc522_driver import DEFAULT_KEY, TEXT_TRAILER
+from hardware.sim_mfrc522 import tag_uid
+from rfid_manager.presence import TagEventKind, TagPresenceTracker
+from rfid_manager.reader import READ_MODE_UID_FIRST, RfidReader
+from utils import clock
+from utils.state_machine import StateMachine
+
+
+class _Reader:
+    def __init__(self, reads):
+        self._reads = list(reads)
+
+    def read(self):
+        return self._reads.pop(0) if self._reads else (None, None)
+
+
+def _poll(tracker: TagPresenceTracker, monkeypatch, polls: int):
+    now = [0.0]
+    monkeypatch.setattr(clock, "monotonic", lambda: now[0])
+    events = []
+    for _ in range(polls):
+        now[0] += 0.05
+        events += tracker.poll()
+    return [(event.kind, event.uid, event.token) for event in events]
+
+
+def test_tag_arrives_with_its_first_text(monkeypatch):
+    tracker = TagPresenceTracker(_Reader([(7, None), (7, ""), (7, "token-7   ")]))
+    events = _poll(tracker, monkeypatch, 4)
+    assert events == [(TagEventKind.ARRIVED, 7, "token-7")]
+    assert tracker.present == 7
+
+
+def test_read_without_text_keeps_cached_token(monkeypatch):
+    tracker = TagPresenceTracker(_Reader([(7, "token-7"), (7, ""), (7, None)]))
+    _poll(tracker, monkeypatch, 3)
+    assert tracker.cached_token(7) == "token-7"
+
+
+def test_failed_block_read_delays_arrival(sim, monkeypatch):
+    uid = tag_uid(42)
+    sim.present_tag(uid, "token-42")
+    trailer = sim.reader.chip.tag.memory[TEXT_TRAILER]
+    trailer[:6] = [0] * 6
+    tracker = TagPresenceTracker(RfidReader.create(mode=READ_MODE_UID_FIRST))
+    assert _poll(tracker, monkeypatch, 3) == []
+
+    trailer[:6] = list(DEFAULT_KEY)
+    events = _poll(tracker, monkeypatch, 1)
+    assert events == [(TagEventKind.ARRIVED, uid, "token-42")]
+
+
+def _manager(compartments) -> BoxManager:
+    manager = BoxManager.__new__(BoxManager)
+    manager.compartments = compartments
+    # pylint: disable=protected-access
+    manager._machine = StateMachine(BoxManager.transitions, BoxManager.States.STANDBY)
+    manager._journal = None
+    manager._authencator = mock.Mock()
+    manager._grants = {}
+    return manager
+
+
+def test_open_box_rejects_missing_token():
+    compartment = mock.Mock()
+    compartment.is_idle.return_value = True
+    manager = _manager([compartment])
+
+    for token in [None, "", "   "]:
+        assert not manager.open_box(1, token)
+    # pylint: disable-next=protected-access
+    manager._authencator.auth.assert_not_called()
+    assert compartment.flash_red.call_count == 3
+
+
+def test_open_box_without_idle_compartment_signals_all():
+    compartments = [mock.Mock(), mock.Mock()]
+    for compartment in compartments:
+        compartment.is_idle.return_value = False
+    manager = _manager(compartments)
+
+    assert not manager.open_box(1, "token")
+    for compartment in compartments:
+        compartment.flash_red.assert_called_once()
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+# pylint: disable=missing-function-docstring
+
+import pytest
+
+from hardware.sim_gpio import SimGPIO, SimGPIOError
+
+
+@pytest.fixture
+def gpio():
+    gpio = SimGPIO(clock=lambda: 1.0)
+    gpio.setmode(gpio.BOARD)
+    return gpio
+
+
+def test_setup_requires_mode():
+    with pytest.raises(SimGPIOError):
+        SimGPIO().setup(11, SimGPIO.OUT)
+
+
+def test_unset_channel_raises(gpio):
+    with pytest.raises(SimGPIOError):
+        gpio.input(11)
+    with pytest.raises(SimGPIOError):
+        gpio.output(11, gpio.HIGH)
+
+
+def test_input_follows_pull(gpio):
+    gpio.setup(13, gpio.IN, pull_up_down=gpio.PUD_UP)
+    gpio.setup(15, gpio.IN, pull_up_down=gpio.PUD_DOWN)
+    assert gpio.input(13) == gpio.HIGH
+    assert gpio.input(15) == gpio.LOW
+
+
+def test_output_history(gpio):
+    gpio.setup(11, gpio.OUT)
+    gpio.output(11, True)
+    gpio.output(11, gpio.LOW)
+    assert gpio.input(11) == gpio.LOW
+    assert gpio.output_history == [(1.0, 11, 0), (1.0, 11, 1), (1.0, 11, 0)]
+
+
+def test_edge_callbacks(gpio):
+    gpio.setup(13, gpio.IN, pull_up_down=gpio.PUD_UP)
+    rising, both = [], []
+    gpio.add_event_detect(13, gpio.RISING, callback=rising.append)
+    with pytest.raises(SimGPIOError):
+        gpio.add_event_detect(13, gpio.BOTH)
+    gpio.add_event_callback(13, lambda channel: both.append(gpio.input(channel)))
+
+    gpio.set_input(13, gpio.HIGH)
+    gpio.set_input(13, gpio.LOW)
+    gpio.set_input(13, gpio.HIGH)
+    assert rising == [13]
+    assert both == [gpio.HIGH]
+
+    gpio.remove_event_detect(13)
+    gpio.set_input(13, gpio.LOW)
+    gpio.set_input(13, gpio.HIGH)
+    assert rising == [13]
+
+
+def test_event_callback_requires_detection(gpio):
+    gpio.setup(13, gpio.IN)
+    with pytest.raises(SimGPIOError):
+        gpio.add_event_callback(13, print)
+
+
+def test_cleanup(gpio):
+    gpio.setup(11, gpio.OUT)
+    gpio.setup(12, gpio.OUT)
+    gpio.cleanup(11)
+    with pytest.raises(SimGPIOError):
+        gpio.input(11)
+    assert gpio.input(12) == gpio.LOW
+    gpio.cleanup()
+    with pytest.raises(SimGPIOError):
+        gpio.input(12)
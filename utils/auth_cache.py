@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+
+from collections import OrderedDict
+from threading import Lock
+from typing import Dict, Optional, Tuple
+from utils import clock
+from utils.metrics import REGISTRY
+
+DEFAULT_CACHE_SIZE = 256
+DEFAULT_POSITIVE_TTL = 30.0
+DEFAULT_NEGATIVE_TTL = 10.0
+
+_LOOKUPS = REGISTRY.counter(
+    "auth_cache_lookups_total", "Auth cache lookups by result.", ["result"]
+)
+
+
+class AuthCache:
+    """Bounded LRU cache of authorization results keyed by (box id, token).
+
+    Granted and denied results expire after separate TTLs, so a customer tapping
+    twice does not cause two backend round trips, and unknown tags do not keep
+    hitting the backend either.
+
+    Args:
+        max_size (int, optional): max. number of cached entries. Defaults to
+            DEFAULT_CACHE_SIZE.
+        positive_ttl (float, optional): seconds a granted result stays valid.
+            Defaults to DEFAULT_POSITIVE_TTL.
+        negative_ttl (float, optional): seconds a denied result stays valid.
+            Defaults to DEFAULT_NEGATIVE_TTL.
+    """
+
+    def __init__(
+        self,
+        max_size: int = DEFAULT_CACHE_SIZE,
+        positive_ttl: float = DEFAULT_POSITIVE_TTL,
+        negative_ttl: float = DEFAULT_NEGATIVE_TTL,
+    ):
+        self._max_size = max_size
+        self._positive_ttl = positive_ttl
+        self._negative_ttl = negative_ttl
+        self._entries: "OrderedDict[Tuple[str, str], Tuple[bool, float]]" = (
+            OrderedDict()
+        )
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, box_id: str, token: str) -> Optional[bool]:
+        """Looks up a cached authorization result
+
+        Args:
+            box_id (str): box id
+            token (str): user token, read from RFID
+
+        Returns:
+            Optional[bool]: cached result, None if absent or expired
+        """
+        key = (box_id, token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] <= clock.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                _LOOKUPS.labels("miss").inc()
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            _LOOKUPS.labels("hit").inc()
+            return entry[0]
+
+    def put(self, box_id: str, token: str, granted: bool):
+        """Caches an authorization result
+
+        Args:
+            box_id (str): box id
+            token (str): user token, read from RFID
+            granted (bool): authorization result
+        """
+        if self._max_size <= 0:
+            return
+        ttl = self._positive_ttl if granted else self._negative_ttl
+        key = (box_id, token)
+        with self._lock:
+            self._entries[key] = (granted, clock.monotonic() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, box_id: str, token: str):
+        """Drops the cached result of (box_id, token), if any."""
+        with self._lock:
+            self._entries.pop((box_id, token), None)
+
+    def clear(self):  # pylint: disable=missing-function-docstring
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        """Returns cache counters, used for sizing the cache.
+
+        Returns:
+            Dict[str, int]: hits, misses, evictions and current size
+        """
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "size": len(self._entries),
+            }
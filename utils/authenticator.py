@@ -1,22 +1,279 @@
 #!/usr/bin/env python3
 # -*- coding: UTF-8 -*-
 
-from utils.manager_base import ManagerBase
-import requests as req
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from threading import Lock, RLock
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional, Tuple
+import json
 import logging
+import os
+import time
+from utils.manager_base import ManagerBase
+from utils.auth_cache import AuthCache
+from utils.grants import GrantVerifier
+from utils.metrics import REGISTRY
+from utils.startup import lazy_module
+
+if TYPE_CHECKING:
+    import requests
+
+req = lazy_module("requests")
 
 logger = logging.getLogger(__name__)
 
+DEFAULT_POOL_SIZE = 4
+DEFAULT_CONNECT_TIMEOUT = 3.05
+DEFAULT_READ_TIMEOUT = 10.0
+
+# Resources fetched once at startup, name -> path
+_BOOTSTRAP = {
+    "csrf": "/auth/csrf",
+    "pkey": "/auth/pkey",
+    "pem": "/auth/pem",
+    "csrf_delivery": "/delivery/csrf",
+}
+# Public keys do not change between restarts and can be cached on disk, the
+# CSRF responses carry per-session cookies and cannot
+_CACHEABLE = ("pkey", "pem")
+# Resources refetched together with a new login
+_SESSION_RESOURCES = ("csrf", "csrf_delivery")
+# Responses meaning the session (JWT or CSRF cookies) is no longer accepted
+_SESSION_REJECTED = (401, 403)
+
+_BACKEND_SECONDS = REGISTRY.histogram(
+    "backend_request_seconds", "Duration of backend calls.", ["call"]
+)
+_BACKEND_RESPONSES = REGISTRY.counter(
+    "backend_responses_total", "Backend responses by status code.", ["call", "code"]
+)
+
 
 class Authenticator(ManagerBase):
-    def __init__(self, backend_url: str):
+    """Backend client of the box.
+
+    All requests go through one persistent `requests.Session` so that the
+    TCP/TLS connection to the backend is kept alive and reused between taps.
+
+    The bootstrap resources (CSRF tokens and public keys) are fetched
+    concurrently in the background; accessing one waits for it and refetches
+    it if the background fetch failed, so construction never blocks or raises.
+
+    Args:
+        backend_url (str): base url of the backend
+        pool_size (int, optional): max. number of pooled keep-alive connections.
+            Defaults to DEFAULT_POOL_SIZE.
+        timeout (Tuple[float, float], optional): (connect, read) timeout in seconds
+            applied to every request. Defaults to
+            (DEFAULT_CONNECT_TIMEOUT, DEFAULT_READ_TIMEOUT).
+        auth_cache (AuthCache, optional): cache of `auth` results. Defaults to an
+            `AuthCache` with default size and TTLs.
+        bootstrap_cache_path (Optional[str], optional): file caching the public
+            keys between restarts, None disables caching. Defaults to None.
+        executor (Optional[ThreadPoolExecutor], optional): runs the bootstrap
+            fetches, shared by many authenticators in one process. Defaults to
+            None, which creates a private one.
+    """
+
+    def __init__(
+        self,
+        backend_url: str,
+        pool_size: int = DEFAULT_POOL_SIZE,
+        timeout: Tuple[float, float] = (DEFAULT_CONNECT_TIMEOUT, DEFAULT_READ_TIMEOUT),
+        auth_cache: AuthCache = None,
+        bootstrap_cache_path: Optional[str] = None,
+        executor: Optional[ThreadPoolExecutor] = None,
+    ):
         self.url = backend_url
-        self.csrf = req.get(self.url + "/auth/csrf", verify=False)
-        self.pkey = req.get(self.url + "/auth/pkey", verify=False)
-        self.pem = req.get(self.url + "/auth/pem", verify=False)
-        self.csrf_delivery = req.get(self.url + "/delivery/csrf", verify=False)
-        self.jwt_cookie = None
+        self.timeout = timeout
+        self.auth_cache = auth_cache if auth_cache is not None else AuthCache()
+        self._session = self._create_session(pool_size)
+        self.jwt_cookie: Optional["requests.cookies.RequestsCookieJar"] = None
+        self.logged_in_at: Optional[float] = None
+        self._credentials: Optional[Tuple[str, str]] = None
+        self._login_generation = 0
+        self._refresh_lock = RLock()
+        self._verifier: Optional[GrantVerifier] = None
+
+        self._bootstrap_cache_path = bootstrap_cache_path
+        self._bootstrap_lock = Lock()
+        self._bootstrap: Dict[str, Future] = {}
+        self._owns_executor = executor is None
+        self._executor = executor or ThreadPoolExecutor(
+            max_workers=len(_BOOTSTRAP), thread_name_prefix="bootstrap"
+        )
+        cached = self._load_bootstrap_cache()
+        for name in _BOOTSTRAP:
+            if name in cached:
+                self._bootstrap[name] = Future()
+                self._bootstrap[name].set_result(cached[name])
+            else:
+                self._bootstrap[name] = self._executor.submit(self._fetch, name)
+
+    def _load_bootstrap_cache(self) -> Dict[str, Any]:
+        if self._bootstrap_cache_path is None:
+            return {}
+        try:
+            with open(
+                self._bootstrap_cache_path, "r", encoding="utf-8"
+            ) as f:  # pylint: disable=invalid-name
+                cached = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if cached.get("url") != self.url:
+            return {}
+        return {name: cached[name] for name in _CACHEABLE if name in cached}
+
+    def _store_bootstrap_cache(self, name: str, value: str):
+        if self._bootstrap_cache_path is None:
+            return
+        with self._bootstrap_lock:
+            cached = self._load_bootstrap_cache()
+            cached.update({"url": self.url, name: value})
+            tmp_path = self._bootstrap_cache_path + ".tmp"
+            with open(
+                tmp_path, "w", encoding="utf-8"
+            ) as f:  # pylint: disable=invalid-name
+                json.dump(cached, f)
+            os.replace(tmp_path, self._bootstrap_cache_path)
+
+    def _fetch(self, name: str) -> Any:
+        r = self._get(_BOOTSTRAP[name])
+        if name not in _CACHEABLE:
+            return r
+        r.raise_for_status()
+        self._store_bootstrap_cache(name, r.text)
+        return r.text
+
+    def _resolve(self, name: str) -> Any:
+        try:
+            return self._bootstrap[name].result()
+        except req.RequestException as e:  # pylint: disable=invalid-name
+            logger.warning(
+                "Bootstrap of {} failed: {}, retrying.".format(  # pylint: disable=logging-format-interpolation
+                    name, e
+                )
+            )
+        value = self._fetch(name)
+        future: Future = Future()
+        future.set_result(value)
+        self._bootstrap[name] = future
+        return value
+
+    @property
+    def csrf(self) -> "requests.Response":  # pylint: disable=missing-function-docstring
+        return self._resolve("csrf")
 
+    @property
+    def csrf_delivery(self) -> "requests.Response":
+        """Returns the CSRF response of the delivery endpoints."""
+        return self._resolve("csrf_delivery")
+
+    @property
+    def pkey(self) -> str:  # pylint: disable=missing-function-docstring
+        return self._resolve("pkey")
+
+    @property
+    def pem(self) -> str:  # pylint: disable=missing-function-docstring
+        return self._resolve("pem")
+
+    def session_expiry(self) -> Optional[float]:
+        """Returns when the first of the JWT and CSRF cookies expires.
+
+        Returns:
+            Optional[float]: expiry as unix time, None if no cookie has an expiry
+        """
+        jars = [self.jwt_cookie] + [self.csrf.cookies, self.csrf_delivery.cookies]
+        expiries = [cookie.expires for jar in jars if jar is not None for cookie in jar]
+        expiries = [e for e in expiries if e]
+        return min(expiries) if expiries else None
+
+    def refresh_session(self) -> bool:
+        """Refetches the CSRF tokens and logs in again with the last credentials.
+
+        Returns:
+            bool: login success, False if never logged in or the backend is
+            unreachable
+        """
+        if self._credentials is None:
+            return False
+        with self._refresh_lock:
+            try:
+                for name in _SESSION_RESOURCES:
+                    future: Future = Future()
+                    future.set_result(self._fetch(name))
+                    self._bootstrap[name] = future
+                return self.login(*self._credentials)
+            except req.RequestException as e:  # pylint: disable=invalid-name
+                logger.warning(
+                    "Session refresh failed: {}".format(  # pylint: disable=logging-format-interpolation
+                        e
+                    )
+                )
+                return False
+
+    def _send_with_relogin(
+        self, send: Callable[[], "requests.Response"]
+    ) -> "requests.Response":
+        """Sends a request, logs in again and retries once if the session was
+        rejected.
+        """
+        generation = self._login_generation
+        r = send()
+        if r.status_code not in _SESSION_REJECTED or self._credentials is None:
+            return r
+        with self._refresh_lock:
+            # Someone else may have logged in again while the request was in flight
+            if generation == self._login_generation:
+                logger.warning(
+                    "Session rejected with {}, logging in again.".format(  # pylint: disable=logging-format-interpolation
+                        r.status_code
+                    )
+                )
+                if not self.refresh_session():
+                    return r
+        # Releases the connection of a streamed response
+        r.close()
+        return send()
+
+    def wait_bootstrap(self, timeout: Optional[float] = None) -> bool:
+        """Waits for the background bootstrap to finish.
+
+        Args:
+            timeout (Optional[float], optional): seconds to wait, None waits
+                forever. Defaults to None.
+
+        Returns:
+            bool: whether all resources were fetched successfully
+        """
+        done, not_done = wait(list(self._bootstrap.values()), timeout)
+        return not not_done and all(f.exception() is None for f in done)
+
+    @staticmethod
+    def _create_session(pool_size: int) -> "requests.Session":
+        session = req.Session()
+        session.verify = False
+        adapter = req.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+
+    def _get(self, path: str, **kwargs) -> "requests.Response":
+        return self._session.get(self.url + path, timeout=self.timeout, **kwargs)
+
+    def _warm_up(self):
+        """Makes sure a keep-alive connection to the backend is open, so that the
+        first tap after login does not pay for the TCP/TLS handshake.
+        """
+        try:
+            self._session.head(self.url, timeout=self.timeout)
+        except req.RequestException as e:  # pylint: disable=invalid-name
+            logger.warning(
+                "Connection warm-up failed: {}".format(  # pylint: disable=logging-format-interpolation
+                    e
+                )
+            )
+
+    @_BACKEND_SECONDS.labels("login").time()
     def login(self, username: str, password: str) -> bool:
         """Login current box to the backend
 
@@ -27,17 +284,25 @@ class Authenticator(ManagerBase):
         Returns:
             bool: login success
         """
-        r = req.post(
+        r = self._session.post(
             self.url + "/auth/jwe/box",
             json={"username": username, "password": password},
             cookies=self.csrf.cookies,
             headers=self.csrf.cookies.get_dict(),
-            verify=False
+            timeout=self.timeout,
         )
-        self.jwt_cookie = r.cookies
+        _BACKEND_RESPONSES.labels("login", r.status_code).inc()
         logger.info("Login status code: {}, text {}.".format(r.status_code, r.text))
+        if r.status_code == 200:
+            # A failed relogin keeps the last JWT, it may still be valid
+            self.jwt_cookie = r.cookies
+            self._credentials = (username, password)
+            self.logged_in_at = time.time()
+            self._login_generation += 1
+            self._warm_up()
         return r.status_code == 200
 
+    @_BACKEND_SECONDS.labels("auth").time()
     def auth(self, username: str, token: str) -> bool:
         """Authenticate, returns True if user has one or more packet to pick up
 
@@ -48,16 +313,37 @@ class Authenticator(ManagerBase):
         Returns:
             bool: result
         """
-        r = req.get(
-            self.url + "/order/list/{}?token={}".format(username, token),
-            cookies=self.jwt_cookie,
-            verify=False
-        )
+        cached = self.auth_cache.get(username, token)
+        if cached is not None:
+            logger.debug("Auth result for %s served from cache.", username)
+            return cached
+        try:
+            r = self._send_with_relogin(
+                lambda: self._get(
+                    "/order/list/{}?token={}".format(username, token),
+                    cookies=self.jwt_cookie,
+                )
+            )
+        except req.RequestException as e:  # pylint: disable=invalid-name
+            # No verdict, not cached: the next tap asks the backend again
+            logger.warning(
+                "Auth request failed: {}".format(  # pylint: disable=logging-format-interpolation
+                    e
+                )
+            )
+            return False
         logger.info("Auth status code: {}, text {}.".format(r.status_code, r.text))
+        _BACKEND_RESPONSES.labels("auth", r.status_code).inc()
+        if r.status_code == 404:
+            self.auth_cache.put(username, token, False)
         if r.status_code != 200:
+            # Other errors (expired session, server errors) are not the tag's fault
             return False
-        return len(eval(r.text)) > 0
+        granted = len(eval(r.text)) > 0
+        self.auth_cache.put(username, token, granted)
+        return granted
 
+    @_BACKEND_SECONDS.labels("update_box").time()
     def update_box(self, username: str, token: str) -> bool:
         """Updates the box status when the customer/deliver successfully opened and closed the box
 
@@ -71,15 +357,140 @@ class Authenticator(ManagerBase):
         if self.jwt_cookie is None:
             logger.error("No jwt cookie cached, unable to access backend!!")
             return False
-        fake_cookie = self.jwt_cookie.get_dict()
-        fake_cookie.update(self.csrf_delivery.cookies.get_dict())
-        r = req.put(
-            self.url + "/order/change-status/{}/{}".format(username, token),
-            cookies=fake_cookie,
-            headers=self.csrf_delivery.cookies.get_dict(),
-            verify=False
-        )
+
+        def send() -> "requests.Response":
+            fake_cookie = self.jwt_cookie.get_dict()
+            fake_cookie.update(self.csrf_delivery.cookies.get_dict())
+            return self._session.put(
+                self.url + "/order/change-status/{}/{}".format(username, token),
+                cookies=fake_cookie,
+                headers=self.csrf_delivery.cookies.get_dict(),
+                timeout=self.timeout,
+            )
+
+        try:
+            r = self._send_with_relogin(send)
+        except req.RequestException as e:  # pylint: disable=invalid-name
+            logger.warning(
+                "Box update request failed: {}".format(  # pylint: disable=logging-format-interpolation
+                    e
+                )
+            )
+            return False
         logger.info(
             "Box update status code: {}, text {}.".format(r.status_code, r.text)
         )
+        _BACKEND_RESPONSES.labels("update_box", r.status_code).inc()
+        if r.status_code == 200:
+            # The pickup consumed the order, the cached grant is stale now
+            self.auth_cache.invalidate(username, token)
         return r.status_code == 200
+
+    def grant_verifier(self) -> Optional[GrantVerifier]:
+        """Returns a verifier for grants signed with the backend key in `/auth/pem`.
+
+        Returns:
+            Optional[GrantVerifier]: verifier, None if the key is not available
+        """
+        if self._verifier is None:
+            try:
+                self._verifier = GrantVerifier(self.pem)
+            except (
+                req.RequestException,
+                ValueError,
+            ) as e:  # pylint: disable=invalid-name
+                logger.warning(
+                    "Backend public key unavailable: {}".format(  # pylint: disable=logging-format-interpolation
+                        e
+                    )
+                )
+        return self._verifier
+
+    @_BACKEND_SECONDS.labels("fetch_grants").time()
+    def fetch_grants(self, username: str) -> Optional[List[Dict[str, Any]]]:
+        """Fetches the signed pickup grants issued for this box
+
+        Args:
+            username (str): user name
+
+        Returns:
+            Optional[List[Dict[str, Any]]]: grants, None on failure
+        """
+        if self.jwt_cookie is None:
+            return None
+        try:
+            r = self._send_with_relogin(
+                lambda: self._get(
+                    "/order/grants/{}".format(username), cookies=self.jwt_cookie
+                )
+            )
+        except req.RequestException as e:  # pylint: disable=invalid-name
+            logger.warning(
+                "Grant sync request failed: {}".format(  # pylint: disable=logging-format-interpolation
+                    e
+                )
+            )
+            return None
+        _BACKEND_RESPONSES.labels("fetch_grants", r.status_code).inc()
+        if r.status_code != 200:
+            logger.warning(
+                "Grant sync status code: {}.".format(  # pylint: disable=logging-format-interpolation
+                    r.status_code
+                )
+            )
+            return None
+        return r.json()
+
+    def open_command_stream(
+        self, username: str, cursor: Optional[str], read_timeout: float
+    ) -> Optional["requests.Response"]:
+        """Opens the server-sent event stream of backend commands for this box
+
+        Args:
+            username (str): user name
+            cursor (Optional[str]): id of the last handled command, None for new
+                commands only
+            read_timeout (float): seconds without data, heartbeats included,
+                before the stream is considered dead
+
+        Returns:
+            Optional[req.Response]: the open stream, None on failure
+        """
+        if self.jwt_cookie is None:
+            return None
+        headers = {"Accept": "text/event-stream"}
+        if cursor is not None:
+            headers["Last-Event-ID"] = cursor
+        try:
+            r = self._send_with_relogin(
+                lambda: self._session.get(
+                    self.url + "/box/commands/{}".format(username),
+                    cookies=self.jwt_cookie,
+                    headers=headers,
+                    stream=True,
+                    timeout=(self.timeout[0], read_timeout),
+                )
+            )
+        except req.RequestException as e:  # pylint: disable=invalid-name
+            logger.warning(
+                "Command stream request failed: {}".format(  # pylint: disable=logging-format-interpolation
+                    e
+                )
+            )
+            return None
+        _BACKEND_RESPONSES.labels("commands", r.status_code).inc()
+        if r.status_code != 200:
+            logger.warning(
+                "Command stream status code: {}.".format(  # pylint: disable=logging-format-interpolation
+                    r.status_code
+                )
+            )
+            r.close()
+            return None
+        return r
+
+    def close(self):
+        """Closes all pooled backend connections."""
+        if self._owns_executor:
+            self._executor.shutdown(wait=False)
+        self._session.close()
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+"""Scalable process clock.
+
+Box logic sleeps and measures time through this module instead of `time`, so the
+hardware simulator can run the full box flow faster than real time. With the
+default scale of 1.0 all functions behave like their `time` counterparts.
+"""
+
+from typing import Optional
+import threading
+import time as _time
+
+_lock = threading.Lock()
+_scale = 1.0
+_real_origin = _time.monotonic()
+_origin = _real_origin
+_wall_offset = _time.time() - _real_origin
+
+
+def get_time_scale() -> float:  # pylint: disable=missing-function-docstring
+    return _scale
+
+
+def set_time_scale(scale: float):
+    """Makes simulated time pass `scale` times faster than real time.
+
+    Args:
+        scale (float): speed-up factor, 1.0 for real time
+    """
+    global _scale, _real_origin, _origin  # pylint: disable=global-statement
+    if scale <= 0:
+        raise ValueError("time scale must be positive, got {}".format(scale))
+    with _lock:
+        # Rebase, so that monotonic() stays continuous across scale changes
+        now = monotonic()
+        _real_origin = _time.monotonic()
+        _origin = now
+        _scale = scale
+
+
+def monotonic() -> float:
+    """Scaled counterpart of `time.monotonic`."""
+    return _origin + (_time.monotonic() - _real_origin) * _scale
+
+
+def time() -> float:
+    """Scaled counterpart of `time.time`."""
+    return monotonic() + _wall_offset
+
+
+def to_real(seconds: Optional[float]) -> Optional[float]:
+    """Converts a simulated duration to real seconds, e.g. for lock timeouts.
+
+    Args:
+        seconds (Optional[float]): simulated duration, None is passed through
+
+    Returns:
+        Optional[float]: real duration
+    """
+    if seconds is None:
+        return None
+    return seconds / _scale
+
+
+def sleep(seconds: float):
+    """Scaled counterpart of `time.sleep`."""
+    _time.sleep(seconds / _scale)
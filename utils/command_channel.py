@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+"""Push-style command channel from the backend, using server-sent events.
+
+The box keeps one streaming request open
+
+    GET /box/commands/{box id}
+    Accept: text/event-stream
+    Last-Event-ID: <id of the last handled command>
+
+and the backend pushes one event per command, e.g.
+
+    id: 42
+    event: command
+    data: {"type": "open", "compartment": "group13"}
+
+Comment lines (starting with ":") serve as heartbeats. After a disconnect the
+box reconnects with exponential backoff and resumes after the last handled
+command, which is persisted so that a restart does not replay commands.
+"""
+
+from threading import Event, Lock, Thread
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    cast,
+)
+import json
+import logging
+import os
+from utils.metrics import REGISTRY
+
+if TYPE_CHECKING:
+    import requests
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_COMMAND_CURSOR_PATH = "command_cursor"
+DEFAULT_STREAM_TIMEOUT = 90.0
+DEFAULT_BACKOFF_BASE = 1.0
+DEFAULT_BACKOFF_MAX = 60.0
+
+_COMMANDS = REGISTRY.counter(
+    "command_channel_commands_total", "Commands received by type.", ["type"]
+)
+_CONNECTS = REGISTRY.counter(
+    "command_channel_connects_total", "Command stream connection attempts."
+)
+_CONNECTED = REGISTRY.gauge(
+    "command_channel_connected", "Whether the command stream is connected."
+)
+
+
+def parse_events(lines: Iterable[str]) -> Iterator[Tuple[Optional[str], str, str]]:
+    """Parses a server-sent event stream.
+
+    Args:
+        lines (Iterable[str]): decoded lines of the stream, without line breaks
+
+    Yields:
+        Tuple[Optional[str], str, str]: (id, event type, data) of every event
+    """
+    event_id: Optional[str] = None
+    event_type = "message"
+    data: List[str] = []
+    for line in lines:
+        if not line:
+            if data:
+                yield event_id, event_type, "\n".join(data)
+            event_id, event_type, data = None, "message", []
+            continue
+        if line.startswith(":"):
+            continue
+        field, _, value = line.partition(":")
+        value = value[1:] if value.startswith(" ") else value
+        if field == "id":
+            event_id = value
+        elif field == "event":
+            event_type = value
+        elif field == "data":
+            data.append(value)
+
+
+class CommandChannel:
+    """Receives backend commands in a background thread and hands them to
+    `handler`.
+
+    Args:
+        open_stream (Callable[[Optional[str]], Optional[requests.Response]]): opens the
+            event stream resuming after the given event id, e.g.
+            `Authenticator.open_command_stream`. Returns None on failure.
+        handler (Callable[[Dict[str, Any]], bool]): executes one command, e.g.
+            `BoxManager.handle_command`
+        cursor_path (Optional[str], optional): file persisting the id of the last
+            handled command, None keeps it in memory only. Defaults to None.
+        backoff_base (float, optional): first reconnect delay in seconds, doubled
+            on every consecutive failure. Defaults to DEFAULT_BACKOFF_BASE.
+        backoff_max (float, optional): upper bound of the reconnect delay in
+            seconds. Defaults to DEFAULT_BACKOFF_MAX.
+    """
+
+    def __init__(
+        self,
+        open_stream: Callable[[Optional[str]], Optional["requests.Response"]],
+        handler: Callable[[Dict[str, Any]], bool],
+        cursor_path: Optional[str] = None,
+        backoff_base: float = DEFAULT_BACKOFF_BASE,
+        backoff_max: float = DEFAULT_BACKOFF_MAX,
+    ):
+        self._open_stream = open_stream
+        self._handler = handler
+        self._cursor_path = cursor_path
+        self._backoff_base = backoff_base
+        self._backoff_max = backoff_max
+        self._stopped = Event()
+        self._lock = Lock()
+        self._response: Optional["requests.Response"] = None
+        self._thread: Optional[Thread] = None
+        self.cursor = self._load_cursor()
+
+    def _load_cursor(self) -> Optional[str]:
+        if self._cursor_path is None:
+            return None
+        try:
+            with open(self._cursor_path, "r", encoding="utf-8") as cursor_file:
+                return cursor_file.read().strip() or None
+        except OSError:
+            return None
+
+    def _store_cursor(self, cursor: str):
+        self.cursor = cursor
+        if self._cursor_path is None:
+            return
+        tmp_path = self._cursor_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as cursor_file:
+            cursor_file.write(cursor)
+        os.replace(tmp_path, self._cursor_path)
+
+    def _dispatch(self, data: str):
+        try:
+            command = json.loads(data)
+            _COMMANDS.labels(command.get("type", "")).inc()
+            logger.info(
+                "Command received: {}".format(  # pylint: disable=logging-format-interpolation
+                    command
+                )
+            )
+            if not self._handler(command):
+                logger.warning(
+                    "Command not executed: {}".format(  # pylint: disable=logging-format-interpolation
+                        command
+                    )
+                )
+        except Exception as e:  # pylint: disable=invalid-name,broad-except
+            # A failing command is skipped, never retried forever
+            logger.error(
+                "Command {} failed: {}".format(  # pylint: disable=logging-format-interpolation
+                    data, e
+                )
+            )
+
+    def _consume(self, response: "requests.Response"):
+        # Events are tiny and must be handled as soon as they arrive, a larger
+        # chunk size would wait for more data first. Decoded, the lines are str.
+        lines = cast(
+            Iterable[str], response.iter_lines(chunk_size=1, decode_unicode=True)
+        )
+        for event_id, event_type, data in parse_events(lines):
+            if self._stopped.is_set():
+                return
+            if event_type == "command":
+                self._dispatch(data)
+            if event_id:
+                self._store_cursor(event_id)
+
+    def _run(self):
+        backoff = self._backoff_base
+        while not self._stopped.is_set():
+            _CONNECTS.inc()
+            try:
+                response = self._open_stream(self.cursor)
+                if response is not None:
+                    with self._lock:
+                        self._response = response
+                    _CONNECTED.set(1)
+                    backoff = self._backoff_base
+                    logger.info("Command stream connected.")
+                    self._consume(response)
+            except Exception as e:  # pylint: disable=invalid-name,broad-except
+                if not self._stopped.is_set():
+                    logger.warning(
+                        "Command stream failed: {}".format(  # pylint: disable=logging-format-interpolation
+                            e
+                        )
+                    )
+            finally:
+                _CONNECTED.set(0)
+                with self._lock:
+                    if self._response is not None:
+                        self._response.close()
+                        self._response = None
+            if self._stopped.wait(backoff):
+                return
+            backoff = min(self._backoff_max, backoff * 2)
+
+    def start(self):
+        """Starts receiving commands in the background."""
+        if self._thread is not None:
+            return
+        self._thread = Thread(target=self._run, name="commands", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stops receiving commands and closes the stream."""
+        self._stopped.set()
+        with self._lock:
+            if self._response is not None:
+                self._response.close()
@@ -1,42 +1,363 @@
 #!/usr/bin/env python3
 # -*- coding: UTF-8 -*-
-from typing import Any, Dict
+from threading import Event, Lock, Thread
+from types import MappingProxyType
+from typing import Any, Callable, Dict, List, Mapping, Optional, Tuple
+import hashlib
+import json
 import logging
-import yaml
+import os
+from utils.startup import lazy_module
+
+yaml = lazy_module("yaml")
 
 logger = logging.getLogger(__name__)
 
 BOX_STATUS_REFRESH_RATE = 5
 BOX_STATUS_REFRESH_INTERVAL = 1.0 / BOX_STATUS_REFRESH_RATE
+DEFAULT_WATCH_INTERVAL = 2.0
+CACHE_SUFFIX = ".cache.json"
+
+_MISSING = object()
+
+REQUIRED_ENTRIES = ("name", "id", "password", "address", "backend_url")
+
+
+class ConfigError(Exception):  # pylint: disable=missing-class-docstring
+    pass
+
+
+def _is_number(value: Any) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _positive(value: Any) -> bool:
+    return _is_number(value) and value > 0
+
+
+def _non_negative(value: Any) -> bool:
+    return _is_number(value) and value >= 0
+
+
+def _valid_pin(value: Any) -> bool:
+    # Physical (BOARD) numbering of the 40-pin header
+    return isinstance(value, int) and not isinstance(value, bool) and 1 <= value <= 40
+
+
+def _valid_compartments(value: Any) -> bool:
+    # Imported here, the box modules import this one
+    # pylint: disable-next=import-outside-toplevel
+    from box_manager.compartment import DEFAULT_PINS
+
+    if not isinstance(value, list) or not value:
+        return False
+    ids, pins = set(), []
+    for entry in value:
+        if not isinstance(entry, dict):
+            return False
+        ids.add(entry.get("id"))
+        for key, default in DEFAULT_PINS.items():
+            pin = entry.get(key, default)
+            if not _valid_pin(pin):
+                return False
+            pins.append(pin)
+    # Compartments need distinct backend ids and must not share pins
+    return len(ids) == len(value) and len(set(pins)) == len(pins)
+
+
+# Entry -> (check, expectation), checked if present
+_RULES: Dict[str, Tuple[Callable[[Any], bool], str]] = {
+    "name": (lambda v: isinstance(v, str), "a string"),
+    "id": (lambda v: isinstance(v, str) and v != "", "a non-empty string"),
+    "password": (lambda v: isinstance(v, str), "a string"),
+    "address": (lambda v: isinstance(v, str), "a string"),
+    "backend_url": (
+        lambda v: isinstance(v, str) and v.startswith(("http://", "https://")),
+        "an http(s) url",
+    ),
+    "box_status_refresh_rate": (_positive, "a positive number"),
+    "backend_pool_size": (
+        lambda v: isinstance(v, int) and not isinstance(v, bool) and v > 0,
+        "a positive integer",
+    ),
+    "backend_connect_timeout": (_positive, "a positive number"),
+    "backend_read_timeout": (_positive, "a positive number"),
+    "command_stream_timeout": (_positive, "a positive number"),
+    "lid_timeout": (_positive, "a positive number"),
+    "lid_debounce": (_non_negative, "a non-negative number"),
+    "auth_cache_ttl": (_non_negative, "a non-negative number"),
+    "auth_cache_negative_ttl": (_non_negative, "a non-negative number"),
+    "rfid_cooldown": (_non_negative, "a non-negative number"),
+    "rfid_absence_grace": (_non_negative, "a non-negative number"),
+    "rfid_read_mode": (
+        lambda v: v in ("classic", "uid_first"),
+        '"classic" or "uid_first"',
+    ),
+    "session_lifetime": (_positive, "a positive number"),
+    "session_refresh_margin": (_non_negative, "a non-negative number"),
+    "grant_sync_interval": (_positive, "a positive number"),
+    "journal_segment_size": (
+        lambda v: isinstance(v, int) and not isinstance(v, bool) and v >= 4096,
+        "an integer of at least 4096",
+    ),
+    "journal_retention_days": (_non_negative, "a non-negative number"),
+    "config_watch_interval": (_non_negative, "a non-negative number"),
+    "adaptive_polling": (lambda v: isinstance(v, bool), "a boolean"),
+    "poll_active_rate": (_positive, "a positive number"),
+    "poll_idle_rate": (_positive, "a positive number"),
+    "poll_active_hold": (_non_negative, "a non-negative number"),
+    "poll_backoff_time": (_non_negative, "a non-negative number"),
+    "poll_cpu_budget": (
+        lambda v: _non_negative(v) and v <= 1,
+        "a number between 0 and 1",
+    ),
+    "compartments": (
+        _valid_compartments,
+        "a non-empty list of compartments with distinct ids and pins, unset pins"
+        " taking their defaults",
+    ),
+}
+
+
+def _check_combinations(entries: Dict[str, Any]) -> Optional[str]:
+    """Returns why entries that depend on each other do not fit, None if they do."""
+    # pylint: disable-next=import-outside-toplevel
+    from box_manager.poll_scheduler import DEFAULT_ACTIVE_RATE, DEFAULT_IDLE_RATE
+
+    active_rate = entries.get("poll_active_rate", DEFAULT_ACTIVE_RATE)
+    idle_rate = entries.get("poll_idle_rate", DEFAULT_IDLE_RATE)
+    if idle_rate > active_rate:
+        return "poll_idle_rate must not exceed poll_active_rate, got {} and {}".format(
+            idle_rate, active_rate
+        )
+    return None
+
+
+def _freeze(value: Any) -> Any:
+    if isinstance(value, dict):
+        return MappingProxyType({k: _freeze(v) for k, v in value.items()})
+    if isinstance(value, list):
+        return tuple(_freeze(v) for v in value)
+    return value
+
+
+class ConfigSnapshot:
+    """Immutable, validated view of one version of the configuration file.
+
+    The core entries are typed attributes, all entries are available through
+    `get`. A reload replaces the whole snapshot, so code holding a snapshot
+    always sees a consistent configuration.
+
+    Args:
+        entries (Dict[str, Any]): parsed configuration file
+
+    Raises:
+        ConfigError: if an entry is missing or invalid
+    """
+
+    __slots__ = (
+        "name",
+        "id",
+        "password",
+        "address",
+        "backend_url",
+        "refresh_rate",
+        "compartments",
+        "_entries",
+    )
+
+    name: str
+    id: str  # pylint: disable=invalid-name
+    password: str
+    address: str
+    backend_url: str
+    refresh_rate: float
+    compartments: Tuple[Mapping[str, Any], ...]
+    _entries: Mapping[str, Any]
+
+    def __init__(self, entries: Dict[str, Any]):
+        if not isinstance(entries, dict):
+            raise ConfigError("configuration is not a mapping")
+        missing = [e for e in REQUIRED_ENTRIES if e not in entries]
+        if missing:
+            raise ConfigError("missing entries {}".format(", ".join(missing)))
+        for key, (check, expectation) in _RULES.items():
+            if key in entries and not check(entries[key]):
+                raise ConfigError(
+                    "{} must be {}, got {!r}".format(key, expectation, entries[key])
+                )
+        problem = _check_combinations(entries)
+        if problem is not None:
+            raise ConfigError(problem)
+        frozen = _freeze(entries)
+        for key in REQUIRED_ENTRIES:
+            object.__setattr__(self, key, frozen[key])
+        object.__setattr__(
+            self,
+            "refresh_rate",
+            float(frozen.get("box_status_refresh_rate", BOX_STATUS_REFRESH_RATE)),
+        )
+        object.__setattr__(self, "compartments", frozen.get("compartments", ()))
+        object.__setattr__(self, "_entries", frozen)
+
+    def __setattr__(self, name: str, value: Any):
+        raise AttributeError("ConfigSnapshot is immutable")
+
+    @property
+    def refresh_interval(self) -> float:
+        """Returns the main loop period in seconds."""
+        return 1.0 / self.refresh_rate
+
+    def get(self, key: str, default: Any = _MISSING) -> Any:
+        """Gets configuration entry value, see `ConfigureReader.get`."""
+        if default is _MISSING:
+            return self._entries[key]
+        return self._entries.get(key, default)
+
+    def entries(self) -> Mapping[str, Any]:
+        """Returns a read-only mapping of all entries."""
+        return self._entries
 
 
 class ConfigureReader:
-    """Reads and parses YAML configuration file."""
+    """Reads, validates and parses YAML configuration file.
+
+    The configuration is held as a `ConfigSnapshot`. `reload` (or the file
+    watcher started with `watch`) replaces it atomically, and only if the new
+    file is valid; subscribers are notified of every change.
+
+    The parsed entries are cached next to the file (`CACHE_SUFFIX`), keyed by
+    the hash of its content, so that an unchanged file is not parsed as YAML
+    again, e.g. at the next boot.
 
-    def __init__(self, file_path: str = "config.yaml"):
+    Args:
+        file_path (str, optional): YAML file. Defaults to "config.yaml".
+        cache (bool, optional): whether to use the parsed entries cache.
+            Defaults to True.
+
+    Raises:
+        ConfigError: if the initial configuration is invalid
+    """
+
+    def __init__(self, file_path: str = "config.yaml", cache: bool = True):
         self._file_path = file_path
-        self.required_entries = ["name", "id", "password", "address", "backend_url"]
-        self._configs = {}  # type: ignore
+        self._cache_path = file_path + CACHE_SUFFIX if cache else None
+        self.required_entries = list(REQUIRED_ENTRIES)
+        self._lock = Lock()
+        self._subscribers: List[Callable[[ConfigSnapshot, ConfigSnapshot], None]] = []
+        self._stamp = self._file_stamp()
+        self._snapshot = ConfigSnapshot(self._read_config())
+        self._watch_stopped = Event()
+        self._watcher: Optional[Thread] = None
+
+    def _read_config(self) -> Dict[str, Any]:
+        with open(self._file_path, "rb") as config_file:
+            content = config_file.read()
+        digest = hashlib.sha256(content).hexdigest()
+        entries = self._load_cache(digest)
+        if entries is None:
+            entries = yaml.safe_load(content.decode("utf-8"))
+            self._store_cache(digest, entries)
+        return entries
 
-        self._read_config()
-        self._check_entries()
+    def _load_cache(self, digest: str) -> Optional[Dict[str, Any]]:
+        if self._cache_path is None:
+            return None
+        try:
+            with open(self._cache_path, "r", encoding="utf-8") as cache_file:
+                cached = json.load(cache_file)
+        except (OSError, ValueError):
+            return None
+        if cached.get("sha256") != digest or not isinstance(
+            cached.get("entries"), dict
+        ):
+            return None
+        return cached["entries"]
 
-    def _check_entries(self) -> bool:
-        for entry in self.required_entries:
-            if entry not in self._configs.keys():
+    def _store_cache(self, digest: str, entries: Any):
+        if self._cache_path is None or not isinstance(entries, dict):
+            return
+        try:
+            # Only cache what JSON gives back unchanged, e.g. no dates
+            encoded = json.dumps({"sha256": digest, "entries": entries})
+            if json.loads(encoded)["entries"] != entries:
+                return
+            tmp_path = self._cache_path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as cache_file:
+                cache_file.write(encoded)
+            os.replace(tmp_path, self._cache_path)
+        except (OSError, TypeError, ValueError) as error:
+            logger.debug("Configuration cache not written: %s", error)
+
+    def _file_stamp(self) -> Optional[Tuple[int, int]]:
+        try:
+            stat = os.stat(self._file_path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    @property
+    def snapshot(self) -> ConfigSnapshot:
+        """Returns the current configuration snapshot."""
+        return self._snapshot
+
+    def subscribe(self, callback: Callable[[ConfigSnapshot, ConfigSnapshot], None]):
+        """Registers `callback(old, new)`, called after every successful reload."""
+        self._subscribers.append(callback)
+
+    def reload(self) -> bool:
+        """Reads the configuration file again. The current configuration is kept
+        if the file is invalid.
+
+        Returns:
+            bool: whether the new configuration was applied
+        """
+        with self._lock:
+            self._stamp = self._file_stamp()
+            try:
+                snapshot = ConfigSnapshot(self._read_config())
+            except (OSError, yaml.YAMLError, ConfigError) as error:
                 logger.error(
-                    "Configuration file {} has no entry {}.".format(  # pylint: disable=logging-format-interpolation
-                        self._file_path, entry
+                    "Configuration file {} rejected: {}".format(  # pylint: disable=logging-format-interpolation
+                        self._file_path, error
                     )
                 )
                 return False
+            old, self._snapshot = self._snapshot, snapshot
+        logger.info(
+            "Configuration file {} reloaded.".format(  # pylint: disable=logging-format-interpolation
+                self._file_path
+            )
+        )
+        for callback in self._subscribers:
+            try:
+                callback(old, snapshot)
+            except Exception as e:  # pylint: disable=invalid-name,broad-except
+                logger.error(
+                    "Configuration subscriber failed: {}".format(  # pylint: disable=logging-format-interpolation
+                        e
+                    )
+                )
         return True
 
-    def _read_config(self):
-        with open(
-            self._file_path, "r", encoding="utf-8"
-        ) as f:  # pylint: disable=invalid-name
-            self._configs = yaml.safe_load(f)
+    def _watch(self, interval: float):
+        while not self._watch_stopped.wait(interval):
+            if self._file_stamp() != self._stamp:
+                self.reload()
+
+    def watch(self, interval: float = DEFAULT_WATCH_INTERVAL):
+        """Reloads the configuration whenever the file changes, checked every
+        `interval` seconds in a background thread.
+        """
+        if self._watcher is not None:
+            return
+        self._watcher = Thread(
+            target=self._watch, args=(interval,), name="config-watch", daemon=True
+        )
+        self._watcher.start()
+
+    def stop_watching(self):  # pylint: disable=missing-function-docstring
+        self._watch_stopped.set()
 
     def get_configs(self) -> Dict[str, Any]:
         """Returns a copy of the configuration to prevent modifications.
@@ -44,18 +365,20 @@ class ConfigureReader:
         Returns:
             Dict[str, Any]: Configurations
         """
-        return self._configs.copy()
+        return dict(self._snapshot.entries())
 
-    def get(self, key: str) -> Any:
+    def get(self, key: str, default: Any = _MISSING) -> Any:
         """Gets configuration entry value
 
         Args:
             key (str): Key to query
+            default (Any, optional): Value returned if the entry is absent. Raises
+                KeyError if not given.
 
         Returns:
             Any: Value stored in the configuration file
         """
-        return self._configs[key]
+        return self._snapshot.get(key, default)
 
     def get_vals(self, keys: list[str]) -> Any:
         """Gets values from configuration file with given keys
@@ -66,9 +389,10 @@ class ConfigureReader:
         Returns:
             Any: Values resp. to keys in the configuration file
         """
+        snapshot = self._snapshot
         ret = []
         for key in keys:
-            ret.append(self._configs[key])
+            ret.append(snapshot.get(key))
         return ret
 
 
@@ -0,0 +1,406 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+"""On-demand diagnostics of the running daemon.
+
+Nothing runs until a diagnostic is requested, either by a signal
+
+    kill -USR1 <pid>    # write thread stacks and status to the output directory
+    kill -USR2 <pid>    # start the sampling profiler, the next USR2 writes it
+
+or by a command on the local control socket, e.g.
+
+    python -m utils.diagnostics /run/boardend.sock profile 30
+
+with the commands
+
+    stacks                      thread stacks
+    status                      state, time in state and last loop duration
+    profile <seconds>           profile for a while, then write the result
+    profile start|stop          start, or stop and write the profiler
+    help                        this list
+
+Profiles are written in folded stack format, one line per distinct stack with
+its sample count, which flamegraph.pl and speedscope read directly.
+"""
+
+from collections import Counter
+from socketserver import StreamRequestHandler, ThreadingUnixStreamServer
+from threading import Event, Lock, Thread, Timer
+from typing import Any, Callable, Dict, Optional
+import argparse
+import json
+import logging
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+import traceback
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DIRECTORY = "/tmp/boardend-diagnostics"
+DEFAULT_SAMPLE_INTERVAL = 0.005
+# Upper bound of a timed profile, so that a typo does not profile for days
+MAX_PROFILE_SECONDS = 600.0
+
+
+class DiagnosticsError(Exception):  # pylint: disable=missing-class-docstring
+    pass
+
+
+def dump_stacks() -> str:
+    """Returns the current stack of every thread, innermost frame last."""
+    names = {thread.ident: thread.name for thread in threading.enumerate()}
+    sections = []
+    frames = sys._current_frames()  # pylint: disable=protected-access
+    for ident, frame in frames.items():
+        sections.append(
+            'Thread "{}" ({}):\n{}'.format(
+                names.get(ident, "?"), ident, "".join(traceback.format_stack(frame))
+            )
+        )
+    return "\n".join(sections)
+
+
+class SamplingProfiler:
+    """Samples the stacks of all threads from a background thread.
+
+    The profiled threads are not instrumented, the cost is the sampling thread
+    taking the GIL once per `interval`. Nothing runs while stopped.
+
+    Args:
+        interval (float, optional): seconds between samples. Defaults to
+            DEFAULT_SAMPLE_INTERVAL.
+    """
+
+    def __init__(self, interval: float = DEFAULT_SAMPLE_INTERVAL):
+        self.interval = interval
+        self._samples: Counter = Counter()
+        self._started = 0.0
+        self._stopped = Event()
+        self._thread: Optional[Thread] = None
+
+    @property
+    def running(self) -> bool:  # pylint: disable=missing-function-docstring
+        return self._thread is not None
+
+    def start(self):
+        """Starts sampling.
+
+        Raises:
+            DiagnosticsError: if already running
+        """
+        if self._thread is not None:
+            raise DiagnosticsError("profiler is already running")
+        self._samples = Counter()
+        self._started = time.monotonic()
+        self._stopped.clear()
+        self._thread = Thread(target=self._run, name="profiler", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        own = threading.get_ident()
+        code_names: Dict[Any, str] = {}
+        while not self._stopped.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            frames = sys._current_frames()  # pylint: disable=protected-access
+            for ident, frame in frames.items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    name = code_names.get(code)
+                    if name is None:
+                        name = code_names[code] = "{} ({}:{})".format(
+                            code.co_name,
+                            os.path.basename(code.co_filename),
+                            code.co_firstlineno,
+                        )
+                    stack.append(name)
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                self._samples[tuple(reversed(stack))] += 1
+
+    def stop(self, path: str) -> int:
+        """Stops sampling and writes the folded stacks to `path`.
+
+        Returns:
+            int: number of samples written
+
+        Raises:
+            DiagnosticsError: if not running
+        """
+        if self._thread is None:
+            raise DiagnosticsError("profiler is not running")
+        self._stopped.set()
+        self._thread.join()
+        self._thread = None
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as profile_file:
+            for stack, count in self._samples.most_common():
+                profile_file.write("{} {}\n".format(";".join(stack), count))
+        os.replace(tmp_path, path)
+        logger.info(
+            "Profiled {:.1f} s, {} samples written to {}.".format(  # pylint: disable=logging-format-interpolation
+                time.monotonic() - self._started, sum(self._samples.values()), path
+            )
+        )
+        return sum(self._samples.values())
+
+
+class _ControlHandler(StreamRequestHandler):
+    server: "_ControlServer"
+
+    def handle(self):
+        line = self.rfile.readline(1024).decode("utf-8", "replace").strip()
+        try:
+            reply = self.server.diagnostics.handle(line)
+        except (DiagnosticsError, OSError) as error:
+            reply = "error: {}".format(error)
+        self.wfile.write(reply.encode("utf-8") + b"\n")
+
+
+class _ControlServer(ThreadingUnixStreamServer):
+    daemon_threads = True
+    diagnostics: "Diagnostics"
+
+
+class Diagnostics:
+    """Stack dumps, profiling and a status report, triggered by signals or a
+    control socket. See the module docstring for the commands.
+
+    Args:
+        status (Callable[[], Dict[str, Any]]): returns the status report,
+            called from a diagnostics thread
+        directory (str, optional): where stack dumps and profiles are written.
+            Defaults to DEFAULT_DIRECTORY.
+        sample_interval (float, optional): see `SamplingProfiler`. Defaults to
+            DEFAULT_SAMPLE_INTERVAL.
+    """
+
+    def __init__(
+        self,
+        status: Callable[[], Dict[str, Any]],
+        directory: str = DEFAULT_DIRECTORY,
+        sample_interval: float = DEFAULT_SAMPLE_INTERVAL,
+    ):
+        self._status = status
+        self.directory = directory
+        self.profiler = SamplingProfiler(sample_interval)
+        # Serializes profiler start and stop between signals, socket and timer
+        self._lock = Lock()
+        self._timer: Optional[Timer] = None
+        self._server: Optional[_ControlServer] = None
+        self._socket_path: Optional[str] = None
+
+    def _output_path(self, prefix: str, suffix: str) -> str:
+        os.makedirs(self.directory, exist_ok=True)
+        return os.path.join(
+            self.directory,
+            "{}-{}-{:03d}{}".format(
+                prefix,
+                time.strftime("%Y%m%d-%H%M%S"),
+                int(time.time() * 1000) % 1000,
+                suffix,
+            ),
+        )
+
+    def status(self) -> str:
+        """Returns the status report as JSON."""
+        report = dict(self._status())
+        report["threads"] = threading.active_count()
+        report["profiling"] = self.profiler.running
+        return json.dumps(report, indent=2, sort_keys=True, default=str)
+
+    def profile_start(self, seconds: Optional[float] = None) -> str:
+        """Starts the profiler, stopping it after `seconds` if given.
+
+        Returns:
+            str: confirmation
+
+        Raises:
+            DiagnosticsError: if already running or `seconds` is out of range
+        """
+        if seconds is not None and not 0 < seconds <= MAX_PROFILE_SECONDS:
+            raise DiagnosticsError(
+                "profile seconds must be in (0, {}]".format(MAX_PROFILE_SECONDS)
+            )
+        with self._lock:
+            self.profiler.start()
+            if seconds is not None:
+                self._timer = Timer(seconds, self._profile_timeout)
+                self._timer.daemon = True
+                self._timer.start()
+        if seconds is None:
+            return "profiling, stop with: profile stop"
+        return "profiling for {:g} s".format(seconds)
+
+    def _profile_timeout(self):
+        try:
+            self.profile_stop()
+        except (DiagnosticsError, OSError) as error:
+            logger.error("Timed profile failed: %s", error)
+
+    def profile_stop(self) -> str:
+        """Stops the profiler and writes its result.
+
+        Returns:
+            str: path of the profile
+
+        Raises:
+            DiagnosticsError: if not running
+        """
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            path = self._output_path("profile", ".folded")
+            self.profiler.stop(path)
+        return path
+
+    def write_report(self) -> str:
+        """Writes thread stacks and status to a file and logs its path.
+
+        Returns:
+            str: path of the report
+        """
+        path = self._output_path("stacks", ".txt")
+        with open(path, "w", encoding="utf-8") as report_file:
+            report_file.write(self.status())
+            report_file.write("\n\n")
+            report_file.write(dump_stacks())
+        logger.warning("Diagnostics report written to %s", path)
+        return path
+
+    def handle(self, command: str) -> str:
+        """Executes one control command.
+
+        Returns:
+            str: the reply
+
+        Raises:
+            DiagnosticsError: on an invalid command or profiler state
+        """
+        words = command.split()
+        if words == ["stacks"]:
+            return dump_stacks()
+        if words == ["status"]:
+            return self.status()
+        if words == ["profile", "start"]:
+            return self.profile_start()
+        if words == ["profile", "stop"]:
+            return self.profile_stop()
+        if len(words) == 2 and words[0] == "profile":
+            try:
+                seconds = float(words[1])
+            except ValueError:
+                raise DiagnosticsError(
+                    "invalid seconds {!r}".format(words[1])
+                ) from None
+            return self.profile_start(seconds)
+        if words == ["help"]:
+            return __doc__.split("with the commands\n\n", 1)[1].split("\n\n")[0]
+        raise DiagnosticsError("unknown command {!r}, try help".format(command))
+
+    def _on_report_signal(self, signum, frame):  # pylint: disable=unused-argument
+        # Signal handlers interrupt the main thread anywhere, e.g. while it holds
+        # a logging lock, the work is left to a thread of its own
+        Thread(target=self.write_report, name="diagnostics", daemon=True).start()
+
+    def _toggle_profiler(self):
+        try:
+            if self.profiler.running:
+                self.profile_stop()
+            else:
+                self.profile_start()
+                logger.warning("Profiling, send the signal again to stop.")
+        except (DiagnosticsError, OSError) as error:
+            logger.error("Profiler toggle failed: %s", error)
+
+    def _on_profile_signal(self, signum, frame):  # pylint: disable=unused-argument
+        Thread(target=self._toggle_profiler, name="diagnostics", daemon=True).start()
+
+    def install_signals(
+        self,
+        report_signal: int = getattr(signal, "SIGUSR1", 0),
+        profile_signal: int = getattr(signal, "SIGUSR2", 0),
+    ) -> bool:
+        """Installs the signal handlers. Must be called from the main thread.
+
+        Returns:
+            bool: False if the platform has no such signals
+        """
+        if not report_signal or not profile_signal:
+            return False
+        signal.signal(report_signal, self._on_report_signal)
+        signal.signal(profile_signal, self._on_profile_signal)
+        return True
+
+    def serve(self, path: str):
+        """Listens for commands on a Unix socket at `path`, accessible to the
+        owner only.
+        """
+        if os.path.exists(path):
+            os.unlink(path)
+        # Created owner-only, a chmod after the bind would leave a window
+        umask = os.umask(0o077)
+        try:
+            self._server = _ControlServer(path, _ControlHandler)
+        finally:
+            os.umask(umask)
+        self._server.diagnostics = self
+        self._socket_path = path
+        Thread(
+            target=self._server.serve_forever, name="diagnostics-socket", daemon=True
+        ).start()
+        logger.info("Diagnostics socket listening on %s", path)
+
+    def close(self):
+        """Stops the control socket and writes a running profile."""
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+            if self._socket_path and os.path.exists(self._socket_path):
+                os.unlink(self._socket_path)
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if self.profiler.running:
+                self.profiler.stop(self._output_path("profile", ".folded"))
+
+
+def request(path: str, command: str, timeout: float = MAX_PROFILE_SECONDS) -> str:
+    """Sends one command to a control socket and returns the reply."""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.settimeout(timeout)
+        client.connect(path)
+        client.sendall(command.encode("utf-8") + b"\n")
+        chunks = []
+        while True:
+            chunk = client.recv(65536)
+            if not chunk:
+                break
+            chunks.append(chunk)
+    return b"".join(chunks).decode("utf-8", "replace")
+
+
+def main():  # pylint: disable=missing-function-docstring
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("socket", help="Control socket of the daemon.")
+    parser.add_argument("command", nargs="+")
+    args = parser.parse_args()
+    reply = request(args.socket, " ".join(args.command))
+    sys.stdout.write(reply)
+    if reply.startswith("error:"):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+"""Offline authorization with pickup grants signed by the backend.
+
+The backend pre-issues one grant per pending order:
+
+    {"token": "<rfid token>", "expires": <unix time>, "signature": "<base64>"}
+
+signed with the private key matching `/auth/pem` over `grant_payload(...)`.
+`GrantIndex` stores the grants of this box on disk and verifies them on lookup,
+so a tag can be authorized without the backend.
+"""
+
+from threading import Event, Lock, Thread
+from typing import Any, Callable, Dict, List, Optional
+import base64
+import binascii
+import json
+import logging
+import os
+import time
+from utils.journal import token_hash
+from utils.metrics import REGISTRY
+from utils.startup import lazy_module
+
+# Only loaded with offline grants enabled
+exceptions = lazy_module("cryptography.exceptions")
+hashes = lazy_module("cryptography.hazmat.primitives.hashes")
+ec = lazy_module("cryptography.hazmat.primitives.asymmetric.ec")
+ed25519 = lazy_module("cryptography.hazmat.primitives.asymmetric.ed25519")
+padding = lazy_module("cryptography.hazmat.primitives.asymmetric.padding")
+rsa = lazy_module("cryptography.hazmat.primitives.asymmetric.rsa")
+serialization = lazy_module("cryptography.hazmat.primitives.serialization")
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_GRANT_INDEX_PATH = "grants.json"
+DEFAULT_SYNC_INTERVAL = 60.0
+
+_LOOKUPS = REGISTRY.counter(
+    "grant_lookups_total", "Offline grant lookups by verdict.", ["verdict"]
+)
+
+
+def grant_payload(box_id: str, token: str, expires: int) -> bytes:
+    """Returns the bytes a grant signature covers."""
+    return "{}|{}|{}".format(box_id, token, int(expires)).encode("utf-8")
+
+
+def _signature(signature: Any) -> Optional[bytes]:
+    """Returns the decoded base64 `signature`, None if it is malformed."""
+    if not isinstance(signature, str):
+        return None
+    try:
+        return base64.b64decode(signature, validate=True)
+    except binascii.Error:
+        return None
+
+
+def _valid(grant: Any) -> bool:
+    """Returns whether `grant` as served by the backend is well-formed."""
+    return (
+        isinstance(grant, dict)
+        and isinstance(grant.get("token"), str)
+        and isinstance(grant.get("expires"), (int, float))
+        and not isinstance(grant.get("expires"), bool)
+        and _signature(grant.get("signature")) is not None
+    )
+
+
+class GrantVerifier:
+    """Verifies grant signatures with the backend public key.
+
+    Args:
+        pem (str): PEM encoded RSA, EC or Ed25519 public key
+    """
+
+    def __init__(self, pem: str):
+        self._key = serialization.load_pem_public_key(pem.encode("utf-8"))
+
+    def verify(self, payload: bytes, signature: bytes) -> bool:
+        """Returns whether `signature` is a valid signature of `payload`."""
+        try:
+            if isinstance(self._key, rsa.RSAPublicKey):
+                self._key.verify(
+                    signature, payload, padding.PKCS1v15(), hashes.SHA256()
+                )
+            elif isinstance(self._key, ec.EllipticCurvePublicKey):
+                self._key.verify(signature, payload, ec.ECDSA(hashes.SHA256()))
+            elif isinstance(self._key, ed25519.Ed25519PublicKey):
+                self._key.verify(signature, payload)
+            else:
+                return False
+        except exceptions.InvalidSignature:
+            return False
+        return True
+
+
+class GrantIndex:
+    """On-disk index of the pickup grants of one box.
+
+    `lookup` only ever returns a positive verdict: an unexpired grant with a
+    valid signature that has not been consumed by a pickup. Without one, the
+    caller has to ask the backend.
+
+    Args:
+        box_id (str): id of this box
+        verifier (Callable[[], Optional[GrantVerifier]]): returns the verifier,
+            None while the public key is not available
+        path (str, optional): index file. Defaults to DEFAULT_GRANT_INDEX_PATH.
+    """
+
+    def __init__(
+        self,
+        box_id: str,
+        verifier: Callable[[], Optional[GrantVerifier]],
+        path: str = DEFAULT_GRANT_INDEX_PATH,
+    ):
+        self._box_id = box_id
+        self._verifier = verifier
+        self._path = path
+        self._lock = Lock()
+        # token -> (expires, signature)
+        self._grants: Dict[str, List[Any]] = {}
+        # token -> signature of the consumed grant
+        self._consumed: Dict[str, str] = {}
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self._path, "r", encoding="utf-8") as index_file:
+                index = json.load(index_file)
+        except (OSError, ValueError):
+            return
+        if index.get("box") != self._box_id:
+            return
+        self._grants = index.get("grants", {})
+        self._consumed = index.get("consumed", {})
+
+    def _save(self):
+        """Writes the index atomically. Must hold `self._lock`."""
+        tmp_path = self._path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:  # pylint: disable=invalid-name
+            json.dump(
+                {
+                    "box": self._box_id,
+                    "grants": self._grants,
+                    "consumed": self._consumed,
+                },
+                f,
+                separators=(",", ":"),
+            )
+        os.replace(tmp_path, self._path)
+
+    def update(self, grants: List[Dict[str, Any]]):
+        """Replaces the index with the grants currently issued by the backend.
+
+        Malformed grants are dropped.
+
+        Args:
+            grants (List[Dict[str, Any]]): grants as served by the backend
+        """
+        valid = [g for g in grants if _valid(g)]
+        if len(valid) < len(grants):
+            logger.warning(
+                "Dropped {} malformed grants.".format(  # pylint: disable=logging-format-interpolation
+                    len(grants) - len(valid)
+                )
+            )
+        now = time.time()
+        fresh = {
+            g["token"]: [int(g["expires"]), g["signature"]]
+            for g in valid
+            if g["expires"] > now
+        }
+        with self._lock:
+            self._grants = fresh
+            # A consumed grant is forgotten once the backend stops issuing it
+            self._consumed = {
+                token: signature
+                for token, signature in self._consumed.items()
+                if token in fresh and fresh[token][1] == signature
+            }
+            self._save()
+
+    def lookup(self, token: str) -> Optional[bool]:
+        """Checks the local grant of `token`.
+
+        Args:
+            token (str): user token, read from RFID
+
+        Returns:
+            Optional[bool]: True if a valid grant exists, None for no verdict
+        """
+        with self._lock:
+            grant = self._grants.get(token)
+            consumed = self._consumed.get(token)
+        verifier = self._verifier()
+        if (
+            grant is None
+            or verifier is None
+            or grant[0] <= time.time()
+            or consumed == grant[1]
+        ):
+            _LOOKUPS.labels("none").inc()
+            return None
+        signature = _signature(grant[1])
+        if signature is None or not verifier.verify(
+            grant_payload(self._box_id, token, grant[0]), signature
+        ):
+            # Never logs the token itself, only its hash as in the journal
+            logger.error(
+                "Invalid grant signature for box %s, token hash %s.",
+                self._box_id,
+                token_hash(token).hex(),
+            )
+            _LOOKUPS.labels("invalid").inc()
+            return None
+        _LOOKUPS.labels("granted").inc()
+        return True
+
+    def consume(self, token: str):
+        """Marks the grant of `token` as used by a pickup."""
+        with self._lock:
+            grant = self._grants.get(token)
+            if grant is None:
+                return
+            self._consumed[token] = grant[1]
+            self._save()
+
+
+class GrantSync:
+    """Periodically fetches the grants of this box into a `GrantIndex`.
+
+    Args:
+        index (GrantIndex): index to update
+        fetch (Callable[[], Optional[List[Dict[str, Any]]]]): fetches the grants,
+            returns None on failure
+        interval (float, optional): seconds between syncs. Defaults to
+            DEFAULT_SYNC_INTERVAL.
+    """
+
+    def __init__(
+        self,
+        index: GrantIndex,
+        fetch: Callable[[], Optional[List[Dict[str, Any]]]],
+        interval: float = DEFAULT_SYNC_INTERVAL,
+    ):
+        self._index = index
+        self._fetch = fetch
+        self._interval = interval
+        self._stopped = Event()
+        self._thread: Optional[Thread] = None
+
+    def sync(self) -> bool:
+        """Fetches and stores the grants once.
+
+        Returns:
+            bool: whether the grants were fetched
+        """
+        try:
+            grants = self._fetch()
+            if grants is None:
+                return False
+            if not isinstance(grants, list):
+                raise ValueError("expected a list of grants")
+            self._index.update(grants)
+        except Exception as e:  # pylint: disable=invalid-name,broad-except
+            logger.warning(
+                "Grant sync failed: {}".format(  # pylint: disable=logging-format-interpolation
+                    e
+                )
+            )
+            return False
+        return True
+
+    def _run(self):
+        while True:
+            self.sync()
+            if self._stopped.wait(self._interval):
+                return
+
+    def start(self):  # pylint: disable=missing-function-docstring
+        if self._thread is not None:
+            return
+        self._thread = Thread(target=self._run, name="grant-sync", daemon=True)
+        self._thread.start()
+
+    def stop(self):  # pylint: disable=missing-function-docstring
+        self._stopped.set()
@@ -0,0 +1,828 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+"""Append-only binary journal of box events.
+
+Events are appended to segment files `<seq>.seg` in a directory. A segment is
+closed once it reaches `segment_size`, and an index `<seq>.idx` is written next
+to it, holding
+
+- the number of events and their time range,
+- a sparse time index, one entry every INDEX_STRIDE events,
+- the offsets of all events per tag uid and per token.
+
+Queries only read the indexes of segments outside the requested time range or
+without the requested uid/token, and memory-map the others, so they stay fast
+with months of events on an SD card. The index of the open segment is kept in
+memory. Tokens are stored as a truncated hash only.
+
+Segment layout: a header (magic, creation time), then records
+
+    size:u16 crc32:u32 time:f64 kind:u8 uid:u64 token:8s len(compartment):u8
+    compartment detail
+
+with the CRC covering everything after it. A torn record at the end of the open
+segment (power loss) is truncated on the next start.
+
+Usage: python -m utils.journal [--dir DIR] query|stats|compact ...
+"""
+
+from bisect import bisect_left
+from contextlib import contextmanager
+from threading import Condition, Lock, Thread
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+import argparse
+import datetime
+import enum
+import hashlib
+import logging
+import mmap
+import os
+import struct
+import zlib
+from utils import clock
+from utils.metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_JOURNAL_PATH = "journal"
+DEFAULT_SEGMENT_SIZE = 1024 * 1024
+DEFAULT_RETENTION_DAYS = 180.0
+INDEX_STRIDE = 64
+MAX_DETAIL_BYTES = 1024
+# Restarts of a read-only query whose segments were compacted by the box
+QUERY_ATTEMPTS = 3
+
+_SEGMENT_MAGIC = b"BXJ1"
+_INDEX_MAGIC = b"BXI1"
+_SEGMENT_HEADER = struct.Struct("<4sd")
+_RECORD = struct.Struct("<HIdBQ8sB")
+_INDEX_HEADER = struct.Struct("<4sIddII")
+_TIME_ENTRY = struct.Struct("<dI")
+_KEY_ENTRY = struct.Struct("<8sI")
+
+NO_UID = 0xFFFFFFFFFFFFFFFF
+_NO_TOKEN = bytes(8)
+
+_EVENTS = REGISTRY.counter("journal_events_total", "Journaled events.", ["kind"])
+
+
+class EventKind(enum.IntEnum):
+    """Kind of journaled event"""
+
+    TRANSITION = 0
+    AUTH_GRANTED = 1
+    AUTH_DENIED = 2
+    TAG_IGNORED = 3
+    REMOTE_OPEN = 4
+    OPENED = 5
+    CLOSED = 6
+    EXPIRED = 7
+    LID_TIMEOUT = 8
+    UNEXPECTED_OPEN = 9
+
+
+class JournalEvent(NamedTuple):
+    """One journaled event"""
+
+    timestamp: float
+    kind: EventKind
+    compartment: str
+    uid: Optional[int]
+    token_hash: Optional[str]
+    detail: str
+
+
+def token_hash(token: str) -> bytes:
+    """Returns the 8 byte hash a token is journaled and queried by."""
+    return hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest()
+
+
+def _uid_key(uid: int) -> bytes:
+    return b"U" + (uid & 0xFFFFFFFFFFFFFF).to_bytes(7, "little")
+
+
+def _token_key(digest: bytes) -> bytes:
+    return b"T" + digest[:7]
+
+
+def _encode(  # pylint: disable=too-many-arguments
+    timestamp: float,
+    kind: EventKind,
+    compartment: str,
+    uid: Optional[int],
+    token: Optional[bytes],
+    detail: str,
+) -> bytes:
+    compartment_bytes = compartment.encode("utf-8")[:255]
+    detail_bytes = detail.encode("utf-8")[:MAX_DETAIL_BYTES]
+    size = _RECORD.size + len(compartment_bytes) + len(detail_bytes)
+    body = (
+        _RECORD.pack(
+            size,
+            0,
+            timestamp,
+            kind,
+            NO_UID if uid is None else uid,
+            token or _NO_TOKEN,
+            len(compartment_bytes),
+        )[6:]
+        + compartment_bytes
+        + detail_bytes
+    )
+    return struct.pack("<HI", size, zlib.crc32(body)) + body
+
+
+def _decode(buffer, offset: int) -> Optional[Tuple[int, JournalEvent, bytes, int]]:
+    """Returns (size, event, token hash, uid) of the record at `offset`, None if
+    the record is incomplete or corrupt."""
+    if offset + _RECORD.size > len(buffer):
+        return None
+    size, crc, timestamp, kind, uid, token, compartment_len = _RECORD.unpack_from(
+        buffer, offset
+    )
+    end = offset + size
+    if size < _RECORD.size + compartment_len or end > len(buffer):
+        return None
+    if zlib.crc32(buffer[offset + 6 : end]) != crc:
+        return None
+    start = offset + _RECORD.size
+    event = JournalEvent(
+        timestamp,
+        EventKind(kind),
+        bytes(buffer[start : start + compartment_len]).decode("utf-8", "replace"),
+        None if uid == NO_UID else uid,
+        None if token == _NO_TOKEN else token.hex(),
+        bytes(buffer[start + compartment_len : end]).decode("utf-8", "replace"),
+    )
+    return size, event, token, uid
+
+
+def _skip_through(
+    events: Iterator[JournalEvent], last: JournalEvent
+) -> Iterator[JournalEvent]:
+    """Skips the events of a restarted query up to `last`, the last one yielded
+    before the restart. If the retention dropped it meanwhile, resumes at the
+    first later event."""
+    for event in events:
+        if event == last:
+            break
+        if event.timestamp > last.timestamp:
+            yield event
+            break
+    yield from events
+
+
+class _SegmentIndex:
+    """Time range, sparse time index and uid/token offsets of one segment."""
+
+    def __init__(self):
+        self.count = 0
+        self.min_ts = float("inf")
+        self.max_ts = float("-inf")
+        # (max. time of all earlier events, offset), see `start_offset`
+        self.times: List[Tuple[float, int]] = []
+        self.keys: Dict[bytes, List[int]] = {}
+
+    def add(self, offset: int, timestamp: float, token: bytes, uid: int):
+        """Adds the record at `offset`."""
+        if self.count % INDEX_STRIDE == 0:
+            self.times.append((self.max_ts, offset))
+        self.count += 1
+        self.min_ts = min(self.min_ts, timestamp)
+        self.max_ts = max(self.max_ts, timestamp)
+        if uid != NO_UID:
+            self.keys.setdefault(_uid_key(uid), []).append(offset)
+        if token != _NO_TOKEN:
+            self.keys.setdefault(_token_key(token), []).append(offset)
+
+    def start_offset(self, since: float) -> int:
+        """Returns an offset before which all events are older than `since`."""
+        # Robust against clock steps: an entry is skipped only if every event
+        # before it is older
+        position = bisect_left(self.times, (since, -1)) - 1
+        return self.times[position][1] if position >= 0 else _SEGMENT_HEADER.size
+
+    def overlaps(self, since: float, until: float) -> bool:
+        """Returns whether the segment may hold events within [since, until]."""
+        return self.count > 0 and self.max_ts >= since and self.min_ts <= until
+
+    def dump(self) -> bytes:
+        """Serializes the index, see `load`."""
+        entries = sorted(
+            (key, offset) for key, offsets in self.keys.items() for offset in offsets
+        )
+        return b"".join(
+            [
+                _INDEX_HEADER.pack(
+                    _INDEX_MAGIC,
+                    self.count,
+                    self.min_ts,
+                    self.max_ts,
+                    len(self.times),
+                    len(entries),
+                )
+            ]
+            + [_TIME_ENTRY.pack(*entry) for entry in self.times]
+            + [_KEY_ENTRY.pack(*entry) for entry in entries]
+        )
+
+    @classmethod
+    def load(cls, data: bytes) -> "_SegmentIndex":
+        """Parses an index written by `dump`."""
+        magic, count, min_ts, max_ts, n_times, n_keys = _INDEX_HEADER.unpack_from(data)
+        if magic != _INDEX_MAGIC:
+            raise ValueError("not a journal index")
+        index = cls()
+        index.count, index.min_ts, index.max_ts = count, min_ts, max_ts
+        offset = _INDEX_HEADER.size
+        index.times = list(
+            _TIME_ENTRY.iter_unpack(data[offset : offset + n_times * _TIME_ENTRY.size])
+        )
+        offset += n_times * _TIME_ENTRY.size
+        for key, record in _KEY_ENTRY.iter_unpack(
+            data[offset : offset + n_keys * _KEY_ENTRY.size]
+        ):
+            index.keys.setdefault(key, []).append(record)
+        return index
+
+
+class _Segment:
+    def __init__(self, directory: str, seq: int, read_only: bool = False):
+        self.seq = seq
+        self.read_only = read_only
+        self.path = os.path.join(directory, "{:08d}.seg".format(seq))
+        self.index_path = os.path.join(directory, "{:08d}.idx".format(seq))
+        self.size = 0
+        self._index: Optional[_SegmentIndex] = None
+
+    @property
+    def index(self) -> _SegmentIndex:
+        """Returns the index, loaded from disk or rebuilt from the segment."""
+        if self._index is None:
+            try:
+                with open(self.index_path, "rb") as index_file:
+                    self._index = _SegmentIndex.load(index_file.read())
+            except (OSError, ValueError, struct.error):
+                self._index = self.scan()[0]
+                # The box may be writing the directory of a read-only journal
+                if not self.read_only:
+                    self.write_index()
+        return self._index
+
+    @index.setter
+    def index(self, index: _SegmentIndex):
+        self._index = index
+
+    def scan(self) -> Tuple[_SegmentIndex, int]:
+        """Reads all records.
+
+        Returns:
+            Tuple[_SegmentIndex, int]: the index and the end of the last valid
+            record
+        """
+        index = _SegmentIndex()
+        end = _SEGMENT_HEADER.size
+        for offset, size, _, token, uid, timestamp in self._iter_raw(
+            _SEGMENT_HEADER.size
+        ):
+            index.add(offset, timestamp, token, uid)
+            end = offset + size
+        return index, end
+
+    def _iter_raw(self, start: int, size: Optional[int] = None):
+        with open(self.path, "rb") as segment_file:
+            length = os.fstat(segment_file.fileno()).st_size if size is None else size
+            if length <= start:
+                return
+            with mmap.mmap(
+                segment_file.fileno(), length, access=mmap.ACCESS_READ
+            ) as buffer:
+                offset = start
+                while True:
+                    record = _decode(buffer, offset)
+                    if record is None:
+                        return
+                    record_size, event, token, uid = record
+                    yield offset, record_size, event, token, uid, event.timestamp
+                    offset += record_size
+
+    def events(
+        self, start: int = _SEGMENT_HEADER.size, size: Optional[int] = None
+    ) -> Iterator[JournalEvent]:
+        """Yields the events from offset `start` on, up to `size` bytes."""
+        for _, _, event, _, _, _ in self._iter_raw(start, size):
+            yield event
+
+    def events_at(
+        self, offsets: Iterable[int], size: Optional[int] = None
+    ) -> Iterator[JournalEvent]:
+        """Yields the events at the given offsets."""
+        with open(self.path, "rb") as segment_file:
+            length = os.fstat(segment_file.fileno()).st_size if size is None else size
+            with mmap.mmap(
+                segment_file.fileno(), length, access=mmap.ACCESS_READ
+            ) as buffer:
+                for offset in offsets:
+                    record = _decode(buffer, offset)
+                    if record is not None:
+                        yield record[1]
+
+    def write_index(self):  # pylint: disable=missing-function-docstring
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, "wb") as index_file:
+            index_file.write(self.index.dump())
+            index_file.flush()
+            os.fsync(index_file.fileno())
+        os.replace(tmp_path, self.index_path)
+
+    def remove(self):  # pylint: disable=missing-function-docstring
+        for path in (self.path, self.index_path):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+# A run of segments merged into a temporary file, and the index of the file
+_Merge = Tuple[List[_Segment], _SegmentIndex]
+
+
+class EventJournal:
+    """Append-only journal of box events, see the module documentation.
+
+    Appending is a single unbuffered write of a few dozen bytes, the journal
+    does not fsync per event; segments are fsync'ed when they are closed.
+    Compaction runs in a background thread, appends do not wait for it.
+
+    Args:
+        directory (str, optional): journal directory, created if missing.
+            Defaults to DEFAULT_JOURNAL_PATH.
+        segment_size (int, optional): size in bytes at which a segment is
+            closed. Defaults to DEFAULT_SEGMENT_SIZE.
+        retention_days (float, optional): events older than this are dropped by
+            `compact`, 0 keeps all events. Defaults to DEFAULT_RETENTION_DAYS.
+        read_only (bool, optional): only query, e.g. while the box is appending
+            from another process. Defaults to False.
+    """
+
+    def __init__(
+        self,
+        directory: str = DEFAULT_JOURNAL_PATH,
+        segment_size: int = DEFAULT_SEGMENT_SIZE,
+        retention_days: float = DEFAULT_RETENTION_DAYS,
+        read_only: bool = False,
+    ):
+        self._directory = directory
+        self._segment_size = segment_size
+        self._retention = retention_days * 86400
+        self._read_only = read_only
+        self._lock = Lock()
+        # Queries reading segment files, compaction only swaps and removes
+        # files without readers
+        self._readers = 0
+        self._no_readers = Condition(self._lock)
+        # Serializes compactions, which merge without self._lock
+        self._compact_lock = Lock()
+        self._compactor: Optional[Thread] = None
+        self._compact_pending = False
+        os.makedirs(directory, exist_ok=True)
+        self._segments = self._list_segments()
+        self._file = None
+        if not read_only:
+            self._open_last()
+
+    def _list_segments(self) -> List[_Segment]:
+        segments = [
+            _Segment(self._directory, int(name[:-4]), self._read_only)
+            for name in sorted(os.listdir(self._directory))
+            if name.endswith(".seg") and name[:-4].isdigit()
+        ]
+        if self._read_only and segments and not os.path.exists(segments[-1].index_path):
+            # Still being appended to, index it in memory only
+            last = segments[-1]
+            last.index, last.size = last.scan()
+        return segments
+
+    def _open_last(self):
+        """Continues the last segment if it was not closed, recovering a torn
+        write."""
+        if self._segments:
+            last = self._segments[-1]
+            if not os.path.exists(last.index_path):
+                last.index, end = last.scan()
+                if os.path.getsize(last.path) != end:
+                    logger.warning(
+                        "Journal segment {} truncated to {} bytes.".format(  # pylint: disable=logging-format-interpolation
+                            last.path, end
+                        )
+                    )
+                    os.truncate(last.path, end)
+                last.size = end
+                if end < self._segment_size:
+                    self._file = open(  # pylint: disable=consider-using-with
+                        last.path, "ab", buffering=0
+                    )
+                    return
+                last.write_index()
+        self._new_segment()
+
+    def _new_segment(self):
+        seq = self._segments[-1].seq + 1 if self._segments else 0
+        segment = _Segment(self._directory, seq)
+        segment.index = _SegmentIndex()
+        self._file = open(  # pylint: disable=consider-using-with
+            segment.path, "ab", buffering=0
+        )
+        self._file.write(_SEGMENT_HEADER.pack(_SEGMENT_MAGIC, clock.time()))
+        segment.size = _SEGMENT_HEADER.size
+        self._segments.append(segment)
+
+    def _close_segment(self):
+        os.fsync(self._file.fileno())
+        self._file.close()
+        self._segments[-1].write_index()
+
+    def append(  # pylint: disable=too-many-arguments
+        self,
+        kind: EventKind,
+        compartment: str = "",
+        uid: Optional[int] = None,
+        token: Optional[str] = None,
+        detail: str = "",
+        timestamp: Optional[float] = None,
+    ):
+        """Appends one event.
+
+        Args:
+            kind (EventKind): kind of event
+            compartment (str, optional): compartment id. Defaults to "".
+            uid (Optional[int], optional): tag uid. Defaults to None.
+            token (Optional[str], optional): tag token, stored as hash. Defaults
+                to None.
+            detail (str, optional): free text. Defaults to "".
+            timestamp (Optional[float], optional): epoch seconds. Defaults to
+                None, now.
+        """
+        if timestamp is None:
+            timestamp = clock.time()
+        digest = None if token is None else token_hash(token)
+        record = _encode(timestamp, kind, compartment, uid, digest, detail)
+        with self._lock:
+            if self._file is None:
+                raise ValueError("journal is closed or read-only")
+            segment = self._segments[-1]
+            self._file.write(record)
+            segment.index.add(
+                segment.size,
+                timestamp,
+                digest or _NO_TOKEN,
+                NO_UID if uid is None else uid,
+            )
+            segment.size += len(record)
+            if segment.size >= self._segment_size:
+                self._close_segment()
+                self._new_segment()
+                self._schedule_compaction()
+        _EVENTS.labels(kind.name).inc()
+
+    def query(  # pylint: disable=too-many-arguments
+        self,
+        since: Optional[float] = None,
+        until: Optional[float] = None,
+        kinds: Optional[Iterable[EventKind]] = None,
+        token: Optional[str] = None,
+        uid: Optional[int] = None,
+        compartment: Optional[str] = None,
+    ) -> Iterator[JournalEvent]:
+        """Yields matching events, oldest segment first.
+
+        Args:
+            since (Optional[float], optional): min. epoch seconds. Defaults to
+                None.
+            until (Optional[float], optional): max. epoch seconds. Defaults to
+                None.
+            kinds (Optional[Iterable[EventKind]], optional): kinds of interest.
+                Defaults to None, all kinds.
+            token (Optional[str], optional): token of the events. Defaults to
+                None.
+            uid (Optional[int], optional): tag uid of the events. Defaults to
+                None.
+            compartment (Optional[str], optional): compartment id of the events.
+                Defaults to None.
+
+        Yields:
+            JournalEvent: matching events
+        """
+        since = float("-inf") if since is None else since
+        until = float("inf") if until is None else until
+        kinds = None if kinds is None else set(kinds)
+        digest = None if token is None else token_hash(token)
+        key = None
+        if digest is not None:
+            key = _token_key(digest)
+        elif uid is not None:
+            key = _uid_key(uid)
+
+        def matches(event: JournalEvent) -> bool:
+            if not since <= event.timestamp <= until:
+                return False
+            if kinds is not None and event.kind not in kinds:
+                return False
+            if digest is not None and event.token_hash != digest.hex():
+                return False
+            if uid is not None and event.uid != uid:
+                return False
+            return compartment is None or event.compartment == compartment
+
+        last: Optional[JournalEvent] = None
+        for attempt in range(QUERY_ATTEMPTS):
+            try:
+                events: Iterator[JournalEvent] = filter(
+                    matches, self._events(since, until, key)
+                )
+                if last is not None:
+                    events = _skip_through(events, last)
+                for event in events:
+                    last = event
+                    yield event
+                return
+            except FileNotFoundError:
+                # Merged or expired by the box since the segments were listed
+                if not self._read_only or attempt + 1 == QUERY_ATTEMPTS:
+                    raise
+                with self._lock:
+                    self._segments = self._list_segments()
+
+    @contextmanager
+    def _snapshot(self) -> Iterator[List[Tuple[_Segment, Optional[int]]]]:
+        """Yields the segments with their current size. Compaction leaves their
+        files alone until the snapshot is released."""
+        with self._lock:
+            # The open segment is read up to its current size, appends
+            # happening meanwhile are not seen
+            segments = [(segment, segment.size or None) for segment in self._segments]
+            self._readers += 1
+        try:
+            yield segments
+        finally:
+            with self._lock:
+                self._readers -= 1
+                if not self._readers:
+                    self._no_readers.notify_all()
+
+    def _events(
+        self, since: float, until: float, key: Optional[bytes]
+    ) -> Iterator[JournalEvent]:
+        """Yields the events of the segments overlapping [since, until], only
+        those indexed under `key` if given."""
+        with self._snapshot() as segments:
+            for segment, size in segments:
+                index = segment.index
+                if not index.overlaps(since, until):
+                    continue
+                if key is not None:
+                    yield from segment.events_at(list(index.keys.get(key, ())), size)
+                else:
+                    yield from segment.events(index.start_offset(since), size)
+
+    def _schedule_compaction(self):
+        # Called with self._lock held
+        self._compact_pending = True
+        if self._compactor is None:
+            self._compactor = Thread(
+                target=self._run_compactions, name="journal-compact", daemon=True
+            )
+            self._compactor.start()
+
+    def _run_compactions(self):
+        while True:
+            with self._lock:
+                if not self._compact_pending:
+                    self._compactor = None
+                    return
+                self._compact_pending = False
+            try:
+                self._compact()
+            except OSError as e:  # pylint: disable=invalid-name
+                logger.error(
+                    "Journal compaction failed: {}".format(  # pylint: disable=logging-format-interpolation
+                        e
+                    )
+                )
+
+    def _compact(self, now: Optional[float] = None) -> int:
+        with self._compact_lock:
+            with self._lock:
+                # Only compaction changes closed segments, appends only add
+                # new ones
+                closed = self._segments[:-1]
+            expired, merges, result = self._compact_closed(closed, now)
+            with self._lock:
+                # Queries may still read the files about to be replaced
+                while self._readers and self._file is not None:
+                    self._no_readers.wait()
+                if self._readers:
+                    # Closed with a query still open, retried on the next start
+                    for run, _ in merges:
+                        os.remove(run[0].path + ".tmp")
+                    return 0
+                for run, index in merges:
+                    self._replace(run, index)
+                for segment in expired:
+                    segment.remove()
+                self._segments = result + self._segments[len(closed) :]
+            return len(expired) + sum(len(run) - 1 for run, _ in merges)
+
+    def _compact_closed(
+        self, closed: List[_Segment], now: Optional[float]
+    ) -> Tuple[List[_Segment], List[_Merge], List[_Segment]]:
+        """Merges runs of small segments into temporary files, see `_replace`.
+
+        Returns:
+            Tuple[List[_Segment], List[_Merge], List[_Segment]]: the expired
+            segments, the merged runs and the closed segments after the
+            compaction
+        """
+        now = clock.time() if now is None else now
+        horizon = now - self._retention if self._retention > 0 else float("-inf")
+        expired = [s for s in closed if s.index.max_ts < horizon]
+        kept = [s for s in closed if s.index.max_ts >= horizon]
+
+        # Merge runs of small segments, e.g. from restarts
+        merges: List[_Merge] = []
+        result: List[_Segment] = []
+        run: List[_Segment] = []
+        for segment in kept + [None]:
+            if segment is not None and (
+                sum(os.path.getsize(s.path) for s in run)
+                + os.path.getsize(segment.path)
+                <= self._segment_size
+            ):
+                run.append(segment)
+                continue
+            if len(run) > 1:
+                merges.append((run, self._merge(run, horizon)))
+                result.append(run[0])
+            else:
+                result.extend(run)
+            run = [] if segment is None else [segment]
+        return expired, merges, result
+
+    @staticmethod
+    def _merge(run: List[_Segment], horizon: float) -> _SegmentIndex:
+        """Writes the events of `run` to a temporary file next to its first
+        segment, and returns their index."""
+        index = _SegmentIndex()
+        with open(run[0].path + ".tmp", "wb") as merged:
+            merged.write(_SEGMENT_HEADER.pack(_SEGMENT_MAGIC, clock.time()))
+            offset = _SEGMENT_HEADER.size
+            for segment in run:
+                for event in segment.events():
+                    if event.timestamp < horizon:
+                        continue
+                    digest = (
+                        None
+                        if event.token_hash is None
+                        else bytes.fromhex(event.token_hash)
+                    )
+                    record = _encode(
+                        event.timestamp,
+                        event.kind,
+                        event.compartment,
+                        event.uid,
+                        digest,
+                        event.detail,
+                    )
+                    merged.write(record)
+                    index.add(
+                        offset,
+                        event.timestamp,
+                        digest or _NO_TOKEN,
+                        NO_UID if event.uid is None else event.uid,
+                    )
+                    offset += len(record)
+            merged.flush()
+            os.fsync(merged.fileno())
+        return index
+
+    @staticmethod
+    def _replace(run: List[_Segment], index: _SegmentIndex):
+        # Called with self._lock held. A crash in between leaves events twice
+        # rather than losing them. The stale index goes first, a segment
+        # without one is rescanned.
+        target = run[0]
+        try:
+            os.remove(target.index_path)
+        except FileNotFoundError:
+            pass
+        os.replace(target.path + ".tmp", target.path)
+        target.index = index
+        target.write_index()
+        for segment in run[1:]:
+            segment.remove()
+
+    def compact(self, now: Optional[float] = None) -> int:
+        """Drops events older than the retention and merges small segments.
+        Runs automatically in the background whenever a segment is closed.
+
+        Args:
+            now (Optional[float], optional): epoch seconds. Defaults to None.
+
+        Returns:
+            int: number of segments removed
+        """
+        with self._lock:
+            if self._file is None:
+                raise ValueError("journal is closed or read-only")
+        return self._compact(now)
+
+    def stats(self) -> Dict[str, float]:  # pylint: disable=missing-function-docstring
+        with self._snapshot() as snapshot:
+            segments = [segment for segment, _ in snapshot]
+            indexes = [s.index for s in segments if s.index.count]
+            size = sum(os.path.getsize(s.path) for s in segments)
+        return {
+            "segments": len(segments),
+            "events": sum(i.count for i in indexes),
+            "bytes": size,
+            "first": min((i.min_ts for i in indexes), default=float("nan")),
+            "last": max((i.max_ts for i in indexes), default=float("nan")),
+        }
+
+    def close(self):
+        """Closes the open segment, it is continued on the next start. Waits
+        for a running compaction."""
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            # A compaction waiting for readers gives up
+            self._no_readers.notify_all()
+            compactor = self._compactor
+        if compactor is not None:
+            compactor.join()
+
+
+def _format(event: JournalEvent) -> str:
+    return "{}  {:<15} {:<12} uid={:<12} token={:<16} {}".format(
+        datetime.datetime.fromtimestamp(event.timestamp).strftime("%Y-%m-%d %H:%M:%S"),
+        event.kind.name,
+        event.compartment or "-",
+        "-" if event.uid is None else event.uid,
+        event.token_hash or "-",
+        event.detail,
+    )
+
+
+def main():  # pylint: disable=missing-function-docstring
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--dir", default=DEFAULT_JOURNAL_PATH)
+    commands = parser.add_subparsers(dest="command", required=True)
+    query = commands.add_parser("query", help="Prints matching events.")
+    query.add_argument(
+        "--kind",
+        action="append",
+        choices=[k.name.lower() for k in EventKind],
+        help="Repeatable.",
+    )
+    query.add_argument("--token")
+    query.add_argument("--uid", type=int)
+    query.add_argument("--compartment")
+    query.add_argument("--days", type=float, help="Only the last N days.")
+    query.add_argument("--limit", type=int, default=0)
+    commands.add_parser("stats", help="Prints the journal size.")
+    commands.add_parser(
+        "compact",
+        help="Applies the retention and merges segments, with the box stopped.",
+    )
+    args = parser.parse_args()
+
+    # Compaction rewrites segments, the box must not be running meanwhile
+    journal = EventJournal(args.dir, read_only=args.command != "compact")
+    try:
+        if args.command == "query":
+            since = None if args.days is None else clock.time() - args.days * 86400
+            kinds = None
+            if args.kind:
+                kinds = [EventKind[k.upper()] for k in args.kind]
+            count = 0
+            for event in journal.query(
+                since, None, kinds, args.token, args.uid, args.compartment
+            ):
+                print(_format(event))
+                count += 1
+                if count == args.limit:
+                    break
+        elif args.command == "stats":
+            for key, value in journal.stats().items():
+                print("{}: {}".format(key, value))
+        else:
+            print("{} segments removed".format(journal.compact()))
+    finally:
+        journal.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+"""Non-blocking logging: callers only enqueue records, a background listener
+formats and writes them.
+
+    listener = configure_logging("INFO", path="/tmp/board.log")
+    ...
+    listener.stop()
+
+Identical messages are rate limited at the producer side: within
+`rate_interval` seconds a message is emitted once, repeats are counted and
+summarized as "... (repeated N times)" once the interval is over.
+"""
+
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from threading import Lock
+from typing import Any, Dict, List, Optional, Tuple
+import logging
+import queue
+import time
+from utils.metrics import REGISTRY
+
+DEFAULT_QUEUE_SIZE = 10000
+DEFAULT_MAX_BYTES = 1024 * 1024
+DEFAULT_BACKUP_COUNT = 3
+DEFAULT_RATE_INTERVAL = 10.0
+LOG_FORMAT = "[%(asctime)s] [%(levelname)s] %(filename)s: %(message)s"
+LOG_DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+_DROPPED = REGISTRY.counter(
+    "log_records_dropped_total", "Log records dropped because the queue was full."
+)
+_SUPPRESSED = REGISTRY.counter(
+    "log_records_suppressed_total", "Repeated log records suppressed."
+)
+
+
+class RateLimitingQueueHandler(QueueHandler):
+    """Puts records on a queue without formatting them, never blocks.
+
+    Records are formatted by the listener thread, so log arguments must not be
+    mutated after the logging call. A record is dropped if the queue is full.
+
+    Args:
+        log_queue (queue.Queue): queue read by the listener
+        rate_interval (float, optional): seconds within which an identical
+            message of the same logger, level and call site is emitted only
+            once, 0 disables rate limiting. Defaults to DEFAULT_RATE_INTERVAL.
+    """
+
+    def __init__(
+        self, log_queue: queue.Queue, rate_interval: float = DEFAULT_RATE_INTERVAL
+    ):
+        super().__init__(log_queue)
+        self._rate_interval = rate_interval
+        self._rate_lock = Lock()
+        # key -> [window start, suppressed count, first suppressed record]
+        self._windows: Dict[Tuple, List] = {}
+        self._next_sweep = 0.0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Formatting is left to the listener thread
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            _DROPPED.inc()
+
+    @staticmethod
+    def _summary(record: logging.LogRecord, count: int) -> logging.LogRecord:
+        summary = logging.makeLogRecord(record.__dict__)
+        summary.msg = "%s (repeated %d times)"
+        summary.args = (record.getMessage(), count)
+        summary.exc_info = None
+        return summary
+
+    def _sweep(self, now: float) -> List[logging.LogRecord]:
+        """Drops expired windows, returns the summaries of their repeats."""
+        summaries = []
+        for key, (start, count, first) in list(self._windows.items()):
+            if now - start >= self._rate_interval:
+                del self._windows[key]
+                if count:
+                    summaries.append(self._summary(first, count))
+        return summaries
+
+    def emit(self, record: logging.LogRecord):
+        if self._rate_interval <= 0:
+            super().emit(record)
+            return
+        now = time.monotonic()
+        # Identical messages from different call sites are limited separately
+        site = (record.name, record.levelno, record.pathname, record.lineno)
+        key: Tuple[Any, ...] = site + (record.msg, record.args)
+        try:
+            hash(key)
+        except TypeError:
+            key = site + (record.getMessage(),)
+        with self._rate_lock:
+            summaries = []
+            if now >= self._next_sweep:
+                summaries = self._sweep(now)
+                self._next_sweep = now + self._rate_interval
+            window = self._windows.get(key)
+            if window is not None and now - window[0] < self._rate_interval:
+                window[1] += 1
+                if window[2] is None:
+                    window[2] = record
+                _SUPPRESSED.inc()
+                record = None
+            else:
+                if window is not None and window[1]:
+                    summaries.append(self._summary(window[2], window[1]))
+                self._windows[key] = [now, 0, None]
+        for summary in summaries:
+            super().emit(summary)
+        if record is not None:
+            super().emit(record)
+
+    def flush_repeats(self):
+        """Emits the summaries of all pending repeats."""
+        with self._rate_lock:
+            summaries = self._sweep(float("inf"))
+        for summary in summaries:
+            super().emit(summary)
+
+
+class _StoppableListener(QueueListener):
+    def __init__(self, log_queue, handler: RateLimitingQueueHandler, *targets):
+        super().__init__(log_queue, *targets, respect_handler_level=True)
+        self._queue_handler = handler
+
+    def stop(self):
+        self._queue_handler.flush_repeats()
+        super().stop()
+        for target in self.handlers:
+            target.close()
+
+
+def configure_logging(
+    level: str,
+    path: Optional[str] = None,
+    max_bytes: int = DEFAULT_MAX_BYTES,
+    backup_count: int = DEFAULT_BACKUP_COUNT,
+    rate_interval: float = DEFAULT_RATE_INTERVAL,
+    queue_size: int = DEFAULT_QUEUE_SIZE,
+) -> QueueListener:
+    """Routes all logging through a queue to a background listener thread.
+
+    Args:
+        level (str): root log level
+        path (Optional[str], optional): log file, rotated at `max_bytes`. None
+            logs to stderr. Defaults to None.
+        max_bytes (int, optional): size at which the log file is rotated.
+            Defaults to DEFAULT_MAX_BYTES.
+        backup_count (int, optional): number of rotated files kept. Defaults to
+            DEFAULT_BACKUP_COUNT.
+        rate_interval (float, optional): see `RateLimitingQueueHandler`.
+            Defaults to DEFAULT_RATE_INTERVAL.
+        queue_size (int, optional): max. number of queued records. Defaults to
+            DEFAULT_QUEUE_SIZE.
+
+    Returns:
+        QueueListener: the started listener, stop it to flush on exit
+    """
+    if path is None:
+        target: logging.Handler = logging.StreamHandler()
+    else:
+        target = RotatingFileHandler(
+            path, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8"
+        )
+    target.setFormatter(logging.Formatter(LOG_FORMAT, LOG_DATE_FORMAT))
+
+    log_queue: queue.Queue = queue.Queue(queue_size)
+    handler = RateLimitingQueueHandler(log_queue, rate_interval)
+    root = logging.getLogger()
+    root.handlers = [handler]
+    root.setLevel(level)
+
+    listener = _StoppableListener(log_queue, handler, target)
+    listener.start()
+    return listener
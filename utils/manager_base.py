@@ -1,14 +1,18 @@
-import RPi.GPIO as GPIO
+from hardware.backend import get_backend
 from utils.singleton import Singleton
 
 
-class ManagerBase(metaclass=Singleton):
-    """Singleton manager base class. Implements enter and exit methods
-    to make sure GPIO is cleaned up upon destruction.
+class DeviceBase:
+    """Device base class. Implements enter and exit methods to make sure GPIO is
+    cleaned up upon destruction.
     """
 
     def __enter__(self):
         return self
 
     def __exit__(self, *args):
-        GPIO.cleanup()
+        get_backend().gpio().cleanup()
+
+
+class ManagerBase(DeviceBase, metaclass=Singleton):
+    """Singleton manager base class."""
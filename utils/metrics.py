@@ -0,0 +1,371 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+"""Low overhead in-process metrics with Prometheus text exposition.
+
+Metrics are declared at module level against the process wide `REGISTRY`, e.g.
+
+    _READ_SECONDS = REGISTRY.histogram("rfid_read_seconds", "Duration of reads")
+
+    with _READ_SECONDS.time():
+        ...
+
+and exposed either over HTTP (`MetricsServer`) or by periodically writing a
+text file (`MetricsFileWriter`), e.g. for the node exporter textfile collector.
+"""
+
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from contextlib import contextmanager
+from threading import Event, Lock, Thread
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+)
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    pairs = ['{}="{}"'.format(n, v) for n, v in zip(names, values)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric(ABC):
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = Lock()
+        self._children: Dict[Tuple[str, ...], "_Metric"] = {}
+
+    def _new_child(self) -> "_Metric":
+        return self.__class__(self.name, self.documentation)
+
+    def labels(self, *values: Any):
+        """Returns the child metric for the given label values."""
+        if len(values) != len(self.labelnames):
+            raise ValueError(
+                "{} expects labels {}".format(self.name, ", ".join(self.labelnames))
+            )
+        key = tuple(str(v) for v in values)
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    @abstractmethod
+    def _samples(self, labels: str) -> List[str]:
+        """Returns the sample lines, `labels` being the formatted label set."""
+
+    def render(self) -> List[str]:
+        """Returns the metric in Prometheus text format, one entry per line."""
+        lines = [
+            "# HELP {} {}".format(self.name, self.documentation),
+            "# TYPE {} {}".format(self.name, self.kind),
+        ]
+        if not self.labelnames:
+            return lines + self._samples("")
+        # A concurrent `labels` may add a child while the dict is iterated
+        with self._lock:
+            children = sorted(self._children.items())
+        for values, child in children:
+            lines += child._samples(  # pylint: disable=protected-access
+                _format_labels(self.labelnames, values)
+            )
+        return lines
+
+
+class Counter(_Metric):
+    """Monotonically increasing counter."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._value = 0.0
+
+    def inc(self, amount: float = 1.0):  # pylint: disable=missing-function-docstring
+        with self._lock:
+            self._value += amount
+
+    def get(self) -> float:  # pylint: disable=missing-function-docstring
+        return self._value
+
+    def _samples(self, labels: str) -> List[str]:
+        return ["{}{} {}".format(self.name, labels, self._value)]
+
+
+class Gauge(_Metric):
+    """Value that can go up and down."""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._value = 0.0
+
+    def set(self, value: float):  # pylint: disable=missing-function-docstring
+        self._value = value
+
+    def get(self) -> float:  # pylint: disable=missing-function-docstring
+        return self._value
+
+    def _samples(self, labels: str) -> List[str]:
+        return ["{}{} {}".format(self.name, labels, self._value)]
+
+
+class Histogram(_Metric):
+    """Cumulative histogram with fixed bucket upper bounds."""
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self._bounds = tuple(sorted(buckets))
+        self._counts = [0] * (len(self._bounds) + 1)
+        self._sum = 0.0
+
+    def _new_child(self) -> "Histogram":
+        return Histogram(self.name, self.documentation, buckets=self._bounds)
+
+    def observe(self, value: float):  # pylint: disable=missing-function-docstring
+        index = bisect_left(self._bounds, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+
+    @contextmanager
+    def time(self) -> Iterator[None]:
+        """Observes the duration of the `with` block in seconds."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+    def count(self) -> int:  # pylint: disable=missing-function-docstring
+        return sum(self._counts)
+
+    def _samples(self, labels: str) -> List[str]:
+        with self._lock:
+            counts = list(self._counts)
+            total = self._sum
+        label_names = labels[1:-1] if labels else ""
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self._bounds + (float("inf"),), counts):
+            cumulative += count
+            le = 'le="{}"'.format("+Inf" if bound == float("inf") else bound)
+            lines.append(
+                "{}_bucket{{{}}} {}".format(
+                    self.name, ",".join(filter(None, (label_names, le))), cumulative
+                )
+            )
+        lines.append("{}_sum{} {}".format(self.name, labels, total))
+        lines.append("{}_count{} {}".format(self.name, labels, cumulative))
+        return lines
+
+
+class Registry:
+    """Collection of metrics rendered together."""
+
+    def __init__(self):
+        self._lock = Lock()
+        self._metrics: Dict[str, _Metric] = {}
+
+    def _register(self, metric: _Metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                if type(existing) is not type(metric):
+                    raise ValueError("Metric {} already registered".format(metric.name))
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(
+        self, name: str, documentation: str, labelnames: Sequence[str] = ()
+    ) -> Counter:
+        """Registers and returns a counter."""
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(
+        self, name: str, documentation: str, labelnames: Sequence[str] = ()
+    ) -> Gauge:
+        """Registers and returns a gauge."""
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> Histogram:
+        """Registers and returns a histogram."""
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        """Returns all metrics in Prometheus text exposition format."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines += metric.render()
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+_LOOP_JITTER_SECONDS = REGISTRY.histogram(
+    "box_loop_jitter_seconds",
+    "Deviation of the main loop period from the interval the poll scheduler set.",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0, 15.0),
+)
+_LOOP_ITERATION_SECONDS = REGISTRY.histogram(
+    "box_loop_iteration_seconds", "Time spent in one main loop iteration."
+)
+
+
+class LoopMonitor:
+    """Tracks iteration cost and period jitter of a periodic loop.
+
+    Args:
+        interval (float): nominal loop period in seconds, the `interval`
+            attribute may be updated for loops with a variable period
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._last_start: Optional[float] = None
+        self.last_duration = 0.0
+
+    @contextmanager
+    def iteration(self) -> Iterator[None]:
+        """Wraps the work of one loop iteration, excluding the sleep."""
+        start = time.perf_counter()
+        if self._last_start is not None:
+            _LOOP_JITTER_SECONDS.observe(abs(start - self._last_start - self.interval))
+        self._last_start = start
+        try:
+            yield
+        finally:
+            self.last_duration = time.perf_counter() - start
+            _LOOP_ITERATION_SECONDS.observe(self.last_duration)
+
+
+def _create_http_server(host: str, port: int, registry: Registry):
+    # Imported here, http.server is only needed with a metrics port
+    from http.server import (  # pylint: disable=import-outside-toplevel
+        BaseHTTPRequestHandler,
+        ThreadingHTTPServer,
+    )
+
+    class _MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):  # pylint: disable=invalid-name,missing-function-docstring
+            if self.path not in ("/", "/metrics"):
+                self.send_error(404)
+                return
+            payload = registry.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+            pass
+
+    class _MetricsHTTPServer(ThreadingHTTPServer):
+        daemon_threads = True
+
+    return _MetricsHTTPServer((host, port), _MetricsHandler)
+
+
+class MetricsServer:
+    """Serves `/metrics` on a local port from a background thread.
+
+    Args:
+        port (int): port to listen on
+        host (str, optional): address to bind. Defaults to "127.0.0.1".
+        registry (Registry, optional): metrics to serve. Defaults to REGISTRY.
+    """
+
+    def __init__(self, port: int, host: str = "127.0.0.1", registry=REGISTRY):
+        self._server = _create_http_server(host, port, registry)
+        self._thread = Thread(
+            target=self._server.serve_forever, name="metrics", daemon=True
+        )
+
+    def start(self):  # pylint: disable=missing-function-docstring
+        self._thread.start()
+        logger.info(
+            "Serving metrics on port {}.".format(  # pylint: disable=logging-format-interpolation
+                self._server.server_address[1]
+            )
+        )
+
+    def stop(self):  # pylint: disable=missing-function-docstring
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class MetricsFileWriter:
+    """Periodically writes all metrics to a file, replacing it atomically.
+
+    Args:
+        path (str): output file
+        period (float, optional): seconds between writes. Defaults to 15.0.
+        registry (Registry, optional): metrics to write. Defaults to REGISTRY.
+    """
+
+    def __init__(self, path: str, period: float = 15.0, registry=REGISTRY):
+        self._path = path
+        self._period = period
+        self._registry = registry
+        self._stopped = Event()
+        self._thread = Thread(target=self._run, name="metrics-file", daemon=True)
+
+    def write(self):  # pylint: disable=missing-function-docstring
+        tmp_path = self._path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:  # pylint: disable=invalid-name
+            f.write(self._registry.render())
+        os.replace(tmp_path, self._path)
+
+    def _run(self):
+        while not self._stopped.wait(self._period):
+            self.write()
+
+    def start(self):  # pylint: disable=missing-function-docstring
+        self._thread.start()
+
+    def stop(self):  # pylint: disable=missing-function-docstring
+        self._stopped.set()
+        self._thread.join()
+        self.write()
@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+
+from collections import OrderedDict
+from threading import Condition, Thread
+from typing import Callable, List, Optional, Tuple
+import json
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_OUTBOX_PATH = "outbox.log"
+DEFAULT_BATCH_SIZE = 16
+DEFAULT_BACKOFF_BASE = 1.0
+DEFAULT_BACKOFF_MAX = 300.0
+DEFAULT_MAX_ATTEMPTS = 100
+
+_OP_ADD = "add"
+_OP_ACK = "ack"
+
+
+class Outbox:
+    """Durable, append-only outbox of box status reports.
+
+    Every report is appended (and fsync'ed) to a log file before `put` returns,
+    then delivered by a background worker. Delivered reports are acknowledged
+    by appending an ack record, so pending reports survive a restart. Reports
+    are deduplicated by (id, token).
+
+    Args:
+        sender (Callable[[str, str], bool]): delivers one report, e.g.
+            `Authenticator.update_box`. Returns True on success.
+        path (str, optional): log file path. Defaults to DEFAULT_OUTBOX_PATH.
+        batch_size (int, optional): max. reports delivered per wake-up.
+            Defaults to DEFAULT_BATCH_SIZE.
+        backoff_base (float, optional): first retry delay in seconds, doubled on
+            every consecutive failure. Defaults to DEFAULT_BACKOFF_BASE.
+        backoff_max (float, optional): upper bound of the retry delay in seconds.
+            Defaults to DEFAULT_BACKOFF_MAX.
+        max_attempts (int, optional): attempts before a report is dropped,
+            0 retries forever. Defaults to DEFAULT_MAX_ATTEMPTS.
+    """
+
+    def __init__(
+        self,
+        sender: Callable[[str, str], bool],
+        path: str = DEFAULT_OUTBOX_PATH,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        backoff_base: float = DEFAULT_BACKOFF_BASE,
+        backoff_max: float = DEFAULT_BACKOFF_MAX,
+        max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+    ):
+        self._sender = sender
+        self._path = path
+        self._batch_size = batch_size
+        self._backoff_base = backoff_base
+        self._backoff_max = backoff_max
+        self._max_attempts = max_attempts
+
+        self._cond = Condition()
+        # (id, token) -> number of failed attempts, in delivery order
+        self._pending: "OrderedDict[Tuple[str, str], int]" = OrderedDict()
+        self._records = 0
+        self._failures = 0
+        self._running = False
+        self._thread: Optional[Thread] = None
+
+        self._replay()
+        self._file = open(  # pylint: disable=consider-using-with
+            self._path, "a", encoding="utf-8"
+        )
+
+    def _replay(self):
+        if not os.path.exists(self._path):
+            return
+        with open(
+            self._path, "r", encoding="utf-8"
+        ) as f:  # pylint: disable=invalid-name
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # Torn write of the last record before a power loss
+                    logger.warning("Skipping corrupt outbox record.")
+                    continue
+                key = (record["id"], record["token"])
+                if record["op"] == _OP_ADD:
+                    self._pending.setdefault(key, 0)
+                else:
+                    self._pending.pop(key, None)
+                self._records += 1
+        if self._pending:
+            logger.info(
+                "Recovered {} pending status reports from {}.".format(  # pylint: disable=logging-format-interpolation
+                    len(self._pending), self._path
+                )
+            )
+        self._compact()
+
+    def _append(self, records: List[dict]):
+        self._file.write("".join(json.dumps(r) + "\n" for r in records))
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._records += len(records)
+
+    def _compact(self):
+        """Rewrites the log with pending reports only. Must hold `self._cond`."""
+        tmp_path = self._path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:  # pylint: disable=invalid-name
+            for box_id, token in self._pending:
+                f.write(json.dumps({"op": _OP_ADD, "id": box_id, "token": token}))
+                f.write("\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self._path)
+        self._records = len(self._pending)
+
+    def put(self, box_id: str, token: str) -> bool:
+        """Persists a status report and schedules its delivery.
+
+        Args:
+            box_id (str): box id
+            token (str): user token, read from RFID
+
+        Returns:
+            bool: False if the same report is already pending
+        """
+        key = (box_id, token)
+        with self._cond:
+            if key in self._pending:
+                return False
+            self._append([{"op": _OP_ADD, "id": box_id, "token": token}])
+            self._pending[key] = 0
+            self._cond.notify()
+        return True
+
+    def pending(self) -> int:
+        """Returns number of undelivered reports."""
+        with self._cond:
+            return len(self._pending)
+
+    def _next_batch(self) -> List[Tuple[str, str]]:
+        with self._cond:
+            while self._running and not self._pending:
+                self._cond.wait()
+            return list(self._pending)[: self._batch_size]
+
+    def _deliver(self, key: Tuple[str, str]) -> bool:
+        try:
+            return self._sender(*key)
+        except Exception as e:  # pylint: disable=invalid-name,broad-except
+            logger.error(
+                "Status report {} failed: {}".format(  # pylint: disable=logging-format-interpolation
+                    key, e
+                )
+            )
+            return False
+
+    def flush(self) -> int:
+        """Tries to deliver one batch of pending reports.
+
+        Returns:
+            int: number of failed deliveries
+        """
+        acked = []
+        failed = 0
+        for key in self._next_batch():
+            if self._deliver(key):
+                acked.append(key)
+                continue
+            failed += 1
+            with self._cond:
+                attempts = self._pending.pop(key) + 1
+                if self._max_attempts and attempts >= self._max_attempts:
+                    logger.error(
+                        "Dropping status report {} after {} attempts.".format(  # pylint: disable=logging-format-interpolation
+                            key, attempts
+                        )
+                    )
+                    acked.append(key)
+                else:
+                    # Requeue at the end so one bad report does not block the others
+                    self._pending[key] = attempts
+            # Backend is likely down, back off instead of failing the whole batch
+            break
+        with self._cond:
+            if acked:
+                for key in acked:
+                    self._pending.pop(key, None)
+                self._append(
+                    [
+                        {"op": _OP_ACK, "id": box_id, "token": token}
+                        for box_id, token in acked
+                    ]
+                )
+            if self._records > 2 * len(self._pending) + self._batch_size:
+                self._compact()
+                self._file.close()
+                self._file = open(  # pylint: disable=consider-using-with
+                    self._path, "a", encoding="utf-8"
+                )
+        return failed
+
+    def _run(self):
+        while self._running:
+            if self.flush() == 0:
+                self._failures = 0
+                continue
+            self._failures += 1
+            delay = min(
+                self._backoff_max, self._backoff_base * 2 ** (self._failures - 1)
+            )
+            logger.warning(
+                "Backend unavailable, retrying status reports in {:.1f}s.".format(  # pylint: disable=logging-format-interpolation
+                    delay
+                )
+            )
+            with self._cond:
+                # put() does not shorten the backoff, only stop() does
+                deadline = time.monotonic() + delay
+                while self._running and time.monotonic() < deadline:
+                    self._cond.wait(deadline - time.monotonic())
+
+    def start(self):
+        """Starts the background delivery worker."""
+        with self._cond:
+            if self._running:
+                return
+            self._running = True
+        self._thread = Thread(target=self._run, name="outbox", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        """Stops the background delivery worker. Pending reports stay on disk."""
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            if self._thread.is_alive():
+                # Still delivering, the daemon thread keeps the file open
+                return
+        self._file.close()
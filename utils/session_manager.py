@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+
+from threading import Event, Thread
+from typing import Optional
+import logging
+import time
+from utils.authenticator import Authenticator
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SESSION_LIFETIME = 3600.0
+DEFAULT_REFRESH_MARGIN = 300.0
+DEFAULT_RETRY_INTERVAL = 30.0
+
+
+class SessionManager:
+    """Keeps the backend session of an `Authenticator` alive.
+
+    A background thread logs in again (refetching the CSRF tokens first)
+    `refresh_margin` seconds before the earliest JWT/CSRF cookie expires, so a
+    refresh never happens on a customer's tap. Cookies without an expiry are
+    assumed to live `default_lifetime` seconds after login.
+
+    Args:
+        authenticator (Authenticator): logged in authenticator
+        default_lifetime (float, optional): assumed session lifetime in seconds.
+            Defaults to DEFAULT_SESSION_LIFETIME.
+        refresh_margin (float, optional): seconds before expiry to refresh.
+            Defaults to DEFAULT_REFRESH_MARGIN.
+        retry_interval (float, optional): seconds between attempts after a failed
+            refresh. Defaults to DEFAULT_RETRY_INTERVAL.
+    """
+
+    def __init__(
+        self,
+        authenticator: Authenticator,
+        default_lifetime: float = DEFAULT_SESSION_LIFETIME,
+        refresh_margin: float = DEFAULT_REFRESH_MARGIN,
+        retry_interval: float = DEFAULT_RETRY_INTERVAL,
+    ):
+        self._authenticator = authenticator
+        self._default_lifetime = default_lifetime
+        self._refresh_margin = refresh_margin
+        self._retry_interval = retry_interval
+        self._stopped = Event()
+        self._thread: Optional[Thread] = None
+
+    def next_refresh(self) -> float:
+        """Returns the unix time of the next planned refresh."""
+        try:
+            expiry = self._authenticator.session_expiry()
+        except Exception:  # pylint: disable=broad-except
+            expiry = None
+        logged_in_at = self._authenticator.logged_in_at or time.time()
+        if expiry is None:
+            expiry = logged_in_at + self._default_lifetime
+        # Refresh early, but never more often than every retry interval
+        return max(expiry - self._refresh_margin, logged_in_at + self._retry_interval)
+
+    def _refresh(self) -> bool:
+        try:
+            return self._authenticator.refresh_session()
+        except Exception as e:  # pylint: disable=invalid-name,broad-except
+            logger.error(
+                "Session refresh failed: {}".format(  # pylint: disable=logging-format-interpolation
+                    e
+                )
+            )
+            return False
+
+    def _run(self):
+        while not self._stopped.wait(max(0.0, self.next_refresh() - time.time())):
+            logger.info("Refreshing backend session.")
+            while not self._refresh():
+                if self._stopped.wait(self._retry_interval):
+                    return
+
+    def start(self):
+        """Starts the background refresh thread."""
+        if self._thread is not None:
+            return
+        self._thread = Thread(target=self._run, name="session", daemon=True)
+        self._thread.start()
+
+    def stop(self):  # pylint: disable=missing-function-docstring
+        self._stopped.set()
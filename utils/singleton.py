@@ -15,3 +15,9 @@ class Singleton(type):
         if cls not in cls._instances:
             cls._instances[cls] = super(Singleton, cls).__call__(*args, **kwargs)
         return cls._instances[cls]
+
+    def create(cls, *args, **kwargs):
+        """Creates an independent instance, leaving the shared one untouched.
+        Used where one process hosts several boxes, e.g. a fleet simulation.
+        """
+        return super(Singleton, cls).__call__(*args, **kwargs)
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+"""Startup phase timing and lazy imports of heavy dependencies.
+
+Phases are recorded against the process wide `STARTUP` profile, e.g.
+
+    with STARTUP.phase("config"):
+        ...
+
+and printed by `main.py --profile-startup`. Recording a phase costs two clock
+reads, the phases only run once.
+
+Heavy third party modules are bound with `lazy_module` instead of `import`, so
+that they load when first used, e.g. requests when the backend is bootstrapped,
+and not all at once before the box is up:
+
+    req = lazy_module("requests")
+
+Every deferred import is recorded as a phase "import <name>" of its own.
+"""
+
+from contextlib import contextmanager
+from threading import Lock, local
+from typing import Iterator, List, NamedTuple, Optional
+import importlib
+import sys
+import time
+import types
+
+# Bounds the phases of a box that retries its login for days
+MAX_PHASES = 256
+
+
+class Phase(NamedTuple):
+    """A recorded startup phase, times in seconds since `StartupProfile` creation"""
+
+    name: str
+    start: float
+    duration: float
+    depth: int
+
+
+class StartupProfile:
+    """Wall clock time of named startup phases. Phases may nest, and may be
+    recorded from several threads. Phases after `finish` are timed but not
+    recorded.
+    """
+
+    def __init__(self):
+        self._origin = time.perf_counter()
+        self._lock = Lock()
+        self._local = local()
+        self.phases: List[Phase] = []
+        self.finished: Optional[float] = None
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """Records the time spent in the `with` block as phase `name`."""
+        depth = getattr(self._local, "depth", 0)
+        self._local.depth = depth + 1
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - start
+            self._local.depth = depth
+            with self._lock:
+                if self.finished is None and len(self.phases) < MAX_PHASES:
+                    self.phases.append(
+                        Phase(name, start - self._origin, duration, depth)
+                    )
+
+    def finish(self):
+        """Marks the end of the startup, e.g. after the first login."""
+        with self._lock:
+            if self.finished is None:
+                self.finished = self.elapsed()
+
+    def elapsed(self) -> float:
+        """Returns the seconds since the profile was created."""
+        return time.perf_counter() - self._origin
+
+    def report(self) -> str:
+        """Returns the phases in start order as a table, nested phases indented."""
+        total = self.finished if self.finished is not None else self.elapsed()
+        lines = ["{:<36}{:>10}{:>12}{:>8}".format("phase", "start ms", "ms", "share")]
+        with self._lock:
+            phases = sorted(self.phases, key=lambda phase: phase.start)
+        for phase in phases:
+            lines.append(
+                "{:<36}{:>10.1f}{:>12.1f}{:>7.0%}".format(
+                    "  " * phase.depth + phase.name,
+                    phase.start * 1e3,
+                    phase.duration * 1e3,
+                    phase.duration / total if total else 0,
+                )
+            )
+        lines.append("{:<36}{:>10}{:>12.1f}".format("total", "", total * 1e3))
+        return "\n".join(lines)
+
+
+STARTUP = StartupProfile()
+
+
+class _LazyModule(types.ModuleType):
+    """Stands in for a module until the first attribute access imports it."""
+
+    def __getattr__(self, attr: str):
+        # Only called for attributes not copied from the module yet
+        module = sys.modules.get(self.__name__)
+        if module is None or module is self:
+            with STARTUP.phase("import " + self.__name__):
+                module = importlib.import_module(self.__name__)
+        self.__dict__.update(module.__dict__)
+        return getattr(module, attr)
+
+
+def lazy_module(name: str) -> types.ModuleType:
+    """Returns module `name`, deferring the import to its first use unless it is
+    loaded already. Import errors are raised at first use.
+    """
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    return _LazyModule(name)
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+"""Small table-driven finite state machine.
+
+Transition tables are compiled and checked once, when the class defining them
+is created, so a misspelled state or a conflicting transition fails at import
+time rather than on the first trigger:
+
+    class States(enum.Enum):
+        STANDBY = 1
+        OPEN = 3
+
+    TRANSITIONS = TransitionTable(States, [
+        ["opened", States.STANDBY, States.OPEN],
+        ["closed", States.OPEN, States.STANDBY],
+    ])
+
+    machine = StateMachine(TRANSITIONS, States.STANDBY)
+    machine.trigger("opened")
+
+A trigger is a dictionary lookup and an assignment under one lock. Reading
+`state` takes no lock.
+"""
+
+from threading import RLock
+from typing import Callable, Dict, List, NamedTuple, Optional, Sequence, Type
+import enum
+
+
+class MachineError(Exception):  # pylint: disable=missing-class-docstring
+    pass
+
+
+class Transition(NamedTuple):
+    """A transition taken by a `StateMachine`, passed to its hooks"""
+
+    trigger: str
+    source: enum.Enum
+    dest: enum.Enum
+
+
+class TransitionTable:
+    """Compiled transition table.
+
+    Args:
+        states (Type[enum.Enum]): enum of all states
+        transitions (Sequence[Sequence]): [trigger, source(s), dest] entries. The
+            source is a state, a list of states or "*" for all states.
+
+    Raises:
+        ValueError: if an entry refers to an unknown state, or a trigger leads
+            to two destinations from the same source
+    """
+
+    def __init__(self, states: Type[enum.Enum], transitions: Sequence[Sequence]):
+        self.states = states
+        self._table: Dict[str, Dict[enum.Enum, Transition]] = {}
+        for trigger, sources, dest in transitions:
+            if not isinstance(trigger, str) or not trigger.isidentifier():
+                raise ValueError("invalid trigger {!r}".format(trigger))
+            if not isinstance(dest, states):
+                raise ValueError(
+                    "{}: unknown destination state {!r}".format(trigger, dest)
+                )
+            if sources == "*":
+                sources = list(states)
+            elif not isinstance(sources, (list, tuple)):
+                sources = [sources]
+            by_source = self._table.setdefault(trigger, {})
+            for source in sources:
+                if not isinstance(source, states):
+                    raise ValueError(
+                        "{}: unknown source state {!r}".format(trigger, source)
+                    )
+                if source in by_source and by_source[source].dest is not dest:
+                    raise ValueError(
+                        "{}: conflicting transitions from {}".format(
+                            trigger, source.name
+                        )
+                    )
+                by_source[source] = Transition(trigger, source, dest)
+
+    @property
+    def triggers(self) -> List[str]:  # pylint: disable=missing-function-docstring
+        return list(self._table)
+
+    def lookup(self, trigger: str, source: enum.Enum) -> Optional[Transition]:
+        """Returns the transition of `trigger` from `source`, None if there is
+        none.
+
+        Raises:
+            MachineError: if the trigger is unknown
+        """
+        try:
+            return self._table[trigger].get(source)
+        except KeyError:
+            raise MachineError("unknown trigger {!r}".format(trigger)) from None
+
+
+class StateMachine:
+    """Runs a `TransitionTable`.
+
+    Hooks are called after every transition, in the thread of the trigger and
+    with `lock` held, so that they observe transitions in order.
+
+    Args:
+        table (TransitionTable): transitions
+        initial (enum.Enum): initial state
+        after_state_change (Optional[Callable[[Transition], None]], optional):
+            hook called after every transition. Defaults to None.
+    """
+
+    def __init__(
+        self,
+        table: TransitionTable,
+        initial: enum.Enum,
+        after_state_change: Optional[Callable[[Transition], None]] = None,
+    ):
+        if not isinstance(initial, table.states):
+            raise ValueError("unknown initial state {!r}".format(initial))
+        self._table = table
+        self._state = initial
+        # Held during a transition and its hooks. Callers may hold it to
+        # combine a state check with other work.
+        self.lock = RLock()
+        self._hooks: Dict[Optional[str], List[Callable[[Transition], None]]] = {}
+        if after_state_change is not None:
+            self.add_hook(after_state_change)
+
+    @property
+    def state(self) -> enum.Enum:
+        """Returns the current state, without locking."""
+        return self._state
+
+    def add_hook(
+        self, callback: Callable[[Transition], None], trigger: Optional[str] = None
+    ):
+        """Calls `callback(transition)` after every transition, or only after
+        transitions of `trigger`.
+
+        Raises:
+            MachineError: if the trigger is unknown
+        """
+        if trigger is not None and trigger not in self._table.triggers:
+            raise MachineError("unknown trigger {!r}".format(trigger))
+        self._hooks.setdefault(trigger, []).append(callback)
+
+    def can(self, trigger: str) -> bool:
+        """Returns whether `trigger` is valid in the current state."""
+        return self._table.lookup(trigger, self._state) is not None
+
+    def try_trigger(self, trigger: str) -> Optional[Transition]:
+        """Takes the transition of `trigger` if it is valid in the current state.
+
+        Returns:
+            Optional[Transition]: the transition taken, None if not valid
+        """
+        with self.lock:
+            transition = self._table.lookup(trigger, self._state)
+            if transition is None:
+                return None
+            self._state = transition.dest
+            for hook in self._hooks.get(trigger, ()):
+                hook(transition)
+            for hook in self._hooks.get(None, ()):
+                hook(transition)
+            return transition
+
+    def trigger(self, trigger: str) -> Transition:
+        """Takes the transition of `trigger`.
+
+        Returns:
+            Transition: the transition taken
+
+        Raises:
+            MachineError: if the trigger is not valid in the current state
+        """
+        transition = self.try_trigger(trigger)
+        if transition is None:
+            raise MachineError(
+                "Can't trigger event {} from state {}!".format(
+                    trigger, self._state.name
+                )
+            )
+        return transition